@@ -61,13 +61,28 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'surveys_builder.renderers.MessagePackRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'surveys_builder.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'surveys_builder.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
+    'DEFAULT_PAGINATION_CLASS': 'surveys_builder.pagination.CreatedAtCursorPagination',
 }
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 500))
+
+# COMPRESSION CONFIG
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_BROTLI_QUALITY = 5
 
 # SIMPLE JWT CONFIG
 
@@ -81,7 +96,11 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_OBTAIN_SERIALIZER': 'surveys_builder.authentication.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'surveys_builder.authentication.RoleTokenRefreshSerializer',
 }
+# safe requests are authorized from the roles claim of the access token without loading the user
+JWT_STATELESS_AUTH = os.getenv('JWT_STATELESS_AUTH', 'true').lower() == 'true'
 
 # SWAGGER CONFIG
 
@@ -99,12 +118,14 @@ SWAGGER_SETTINGS = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'surveys_builder.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'surveys_builder.middleware.AuditBufferMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -209,11 +230,63 @@ CACHES = {
         'LOCATION': 'redis://redis:6379/1',
     }
 }
+SURVEY_SCHEMA_CACHE_TIMEOUT = 60 * 60 * 24
+VIEW_CACHE_TIMEOUT = 300
+USER_ROLES_CACHE_TIMEOUT = 60 * 60
+
+# EXPORT CONFIG
+EXPORT_ROOT = os.getenv('EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+EXPORT_SHARD_SIZE = int(os.getenv('EXPORT_SHARD_SIZE', 50000))
+EXPORT_MAX_SHARDS = int(os.getenv('EXPORT_MAX_SHARDS', 16))
+EXPORT_STATUS_TIMEOUT = 60 * 60 * 24
+
+# SUBMISSION CONFIG
+BULK_SUBMISSION_MAX_ITEMS = int(os.getenv('BULK_SUBMISSION_MAX_ITEMS', 5000))
+BULK_SUBMISSION_BATCH_SIZE = 500
+# sync saves submissions in the request, queued validates them against the cached rules,
+# answers with a receipt and leaves the writes to a worker that persists them in batches
+SUBMISSION_MODE = os.getenv('SUBMISSION_MODE', 'sync')
+SUBMISSION_BATCH_SIZE = int(os.getenv('SUBMISSION_BATCH_SIZE', 1000))
+SUBMISSION_BATCH_DELAY = int(os.getenv('SUBMISSION_BATCH_DELAY', 2))
+SUBMISSION_RECEIPT_TIMEOUT = 60 * 60 * 24
+# seconds a queue slot may stay unwritten before ingestion gives up on it and moves on
+SUBMISSION_QUEUE_GAP_GRACE = int(os.getenv('SUBMISSION_QUEUE_GAP_GRACE', SUBMISSION_BATCH_DELAY * 30))
+# responses of writes sent with an Idempotency-Key header are replayed to retries for this long
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+
+# AUDIT LOG CONFIG
+# sync writes the buffered events with bulk_create, celery hands them to a worker
+AUDIT_LOG_MODE = os.getenv('AUDIT_LOG_MODE', 'sync')
+AUDIT_LOG_BATCH_SIZE = 500
+# logs younger than this are left out of the daily aggregates so transactions still writing lower ids can commit
+AUDIT_AGGREGATE_SETTLE_SECONDS = int(os.getenv('AUDIT_AGGREGATE_SETTLE_SECONDS', 300))
+# logs older than the retention period are moved to gzipped archives by celery beat
+AUDIT_LOG_RETENTION_DAYS = int(os.getenv('AUDIT_LOG_RETENTION_DAYS', 180))
+AUDIT_ARCHIVE_ROOT = os.getenv('AUDIT_ARCHIVE_ROOT', os.path.join(BASE_DIR, 'archives'))
+
+# FIELD ENCRYPTION CONFIG
+# Comma separated Fernet keys, the first key encrypts and the others are kept for decryption during rotation
+FIELD_ENCRYPTION_KEYS = [key for key in os.getenv('FIELD_ENCRYPTION_KEYS', '').split(',') if key]
 
 # CELERY CONFIG
 CELERY_BROKER_URL = os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'refresh-audit-log-daily-aggregates': {
+        'task': 'surveys_builder.tasks.refresh_audit_log_daily_aggregates',
+        'schedule': 60 * 15,
+    },
+    'archive-audit-logs': {
+        'task': 'surveys_builder.tasks.archive_old_audit_logs',
+        'schedule': 60 * 60 * 24,
+    },
+    'ingest-submissions': {
+        'task': 'surveys_builder.tasks.ingest_submissions',
+        'schedule': 60,
+    },
+}
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
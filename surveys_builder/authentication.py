@@ -0,0 +1,113 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer
+)
+from rest_framework_simplejwt.settings import api_settings
+from surveys_builder.utils.roles import (
+    ROLES_CHANGED_AT_KEY,
+    get_user_roles
+)
+
+ROLES_CLAIM = 'roles'
+ROLES_AT_CLAIM = 'roles_at'
+REVOKED_TOKEN_KEY = 'revoked_token:{jti}'
+TOKENS_REVOKED_BEFORE_KEY = 'tokens_revoked_before:{user_id}'
+
+
+def revoke_token(token) -> None:
+    """
+    Revoke a single token until it expires
+    """
+    timeout = max(int(token['exp'] - time.time()), 1)
+    cache.set(REVOKED_TOKEN_KEY.format(jti = token[api_settings.JTI_CLAIM]), True, timeout = timeout)
+
+
+def revoke_user_tokens(user_id: int) -> None:
+    """
+    Revoke every token issued to a user until now
+    """
+    cache.set(
+        TOKENS_REVOKED_BEFORE_KEY.format(user_id = user_id),
+        time.time(),
+        timeout = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    )
+
+
+def get_token_state(token) -> tuple:
+    """
+    Get whether a token is revoked and whether its roles claim is still current,
+    from a single cache round trip
+    """
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    keys = {
+        'revoked': REVOKED_TOKEN_KEY.format(jti = token.get(api_settings.JTI_CLAIM)),
+        'revoked_before': TOKENS_REVOKED_BEFORE_KEY.format(user_id = user_id),
+        'roles_changed_at': ROLES_CHANGED_AT_KEY.format(user_id = user_id),
+    }
+    values = cache.get_many(keys.values())
+    revoked_before = values.get(keys['revoked_before'])
+    revoked = keys['revoked'] in values or (revoked_before is not None and token.get('iat', 0) < revoked_before)
+    roles_changed_at = values.get(keys['roles_changed_at'])
+    roles_current = ROLES_CLAIM in token and (
+        roles_changed_at is None or token.get(ROLES_AT_CLAIM, 0) > roles_changed_at
+    )
+    return revoked, roles_current
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Embed the roles of the user in the issued tokens
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['username'] = user.username
+        token[ROLES_CLAIM] = sorted(get_user_roles(user))
+        token[ROLES_AT_CLAIM] = time.time()
+        return token
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuse to refresh revoked tokens
+    """
+
+    def validate(self, attrs):
+        revoked, _roles_current = get_token_state(self.token_class(attrs['refresh']))
+        if revoked:
+            raise InvalidToken(_('Token has been revoked'))
+        return super().validate(attrs)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Authenticate safe requests from the token claims without loading the user
+    when JWT_STATELESS_AUTH is enabled and the roles claim is still current,
+    every other request loads the user. Revoked tokens are always refused.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        revoked, roles_current = get_token_state(validated_token)
+        if revoked:
+            raise InvalidToken(_('Token has been revoked'))
+        if settings.JWT_STATELESS_AUTH and roles_current and request.method in SAFE_METHODS:
+            return TokenUser(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
@@ -0,0 +1,45 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from surveys_builder.models import SurveyResponse
+from surveys_builder.utils.answers import sync_response_answers
+from surveys_builder.utils.crypto import decrypt_response_data
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per field answer rows of stored survey responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', type = int, help = 'Only backfill the responses of this survey')
+        parser.add_argument('--chunk-size', type = int, default = 1000)
+
+    def handle(self, *args, **kwargs):
+        queryset = SurveyResponse.objects.order_by('id')
+        if kwargs['survey']:
+            queryset = queryset.filter(survey_id = kwargs['survey'])
+
+        last_id = 0
+        responses = 0
+        answers = 0
+        while True:
+            chunk = list(
+                queryset.filter(id__gt = last_id).values_list(
+                    'id', 'survey_id', 'response_data'
+                )[:kwargs['chunk_size']]
+            )
+            if not chunk:
+                break
+            with transaction.atomic():
+                for survey_id, rows in groupby(sorted(chunk, key = lambda row: row[1]), key = lambda row: row[1]):
+                    answers += len(
+                        sync_response_answers(
+                            survey_id,
+                            [(response_id, decrypt_response_data(response_data)) for response_id, _, response_data in rows]
+                        )
+                    )
+            responses += len(chunk)
+            last_id = chunk[-1][0]
+            self.stdout.write(f'{responses} responses processed')
+
+        self.stdout.write(self.style.SUCCESS(f'{answers} answers backfilled from {responses} responses'))
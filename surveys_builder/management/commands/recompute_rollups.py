@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from surveys_builder.models import Survey
+from surveys_builder.utils.rollups import recompute_survey_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the analytics rollups of surveys from their stored responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', type = int, help = 'Only rebuild the rollups of this survey')
+        parser.add_argument('--chunk-size', type = int, default = 1000)
+
+    def handle(self, *args, **kwargs):
+        surveys = Survey.objects.order_by('id').values_list('id', flat = True)
+        if kwargs['survey']:
+            surveys = surveys.filter(id = kwargs['survey'])
+
+        for survey_id in surveys:
+            with transaction.atomic():
+                responses = recompute_survey_rollups(survey_id, chunk_size = kwargs['chunk_size'])
+            self.stdout.write(f'Survey {survey_id}: {responses} responses rolled up')
+
+        self.stdout.write(self.style.SUCCESS('Rollups recomputed successfully'))
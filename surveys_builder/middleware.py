@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from surveys_builder.utils.audit import audit_buffer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class AuditBufferMiddleware:
+    """
+    Write the audit events of a request in a single batch once the response is ready
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit_buffer():
+            return self.get_response(request)
+
+
+def _accepts_encoding(request, encoding: str) -> bool:
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, *params = coding.split(';')
+        if name.strip().lower() != encoding:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        return quality > 0
+    return False
+
+
+def _is_breach_safe(request, response) -> bool:
+    """
+    Whether a response is unlikely to mix secrets with reflected input, brotli has no
+    room for the random padding GZipMiddleware adds against BREACH so responses that
+    may carry tokens (writes, cookies, HTML pages with CSRF tokens) are left to gzip
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and not response.cookies
+        and not response.get('Content-Type', '').startswith('text/html')
+    )
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses of at least COMPRESSION_MIN_SIZE bytes with brotli when the
+    client accepts it, the brotli package is installed and the response is safe from
+    BREACH without padding, and with gzip otherwise
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if (
+            response.streaming
+            or brotli is None
+            or response.has_header('Content-Encoding')
+            or not _accepts_encoding(request, 'br')
+            or not _is_breach_safe(request, response)
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed_content = brotli.compress(response.content, quality = settings.COMPRESSION_BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+        # A compressed representation only matches its strong ETag weakly
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
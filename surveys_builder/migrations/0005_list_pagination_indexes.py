@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 10:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys_builder', '0004_alter_condition_created_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='field',
+            index=models.Index(fields=['created_at', 'id'], name='surveys_bui_created_2b8cb2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['created_at', 'id'], name='surveys_bui_created_06c95a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['created_at', 'id'], name='surveys_bui_created_5bb438_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='surveyresponse',
+            index=models.Index(fields=['created_at', 'id'], name='surveys_bui_created_3e8b7b_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0 on 2026-10-18 10:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys_builder', '0005_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='auditlog',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='AuditLogDailyAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete'), ('view', 'View'), ('export_response', 'Export response'), ('generate_report', 'Generate report'), ('send_invitations', 'Send invitations')], max_length=50)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_log_id', models.PositiveBigIntegerField(default=0)),
+                ('survey', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='audit_log_aggregates', to='surveys_builder.survey')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_log_id'], name='surveys_bui_last_lo_97d90f_idx')],
+                'unique_together': {('day', 'survey', 'action')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0 on 2026-10-18 10:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys_builder', '0006_audit_log_daily_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['created_at', 'id'], name='surveys_bui_created_bfce7e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['survey', 'created_at'], name='surveys_bui_survey__42d2d0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['user', 'created_at'], name='surveys_bui_user_id_aae73f_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0 on 2026-10-18 10:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys_builder', '0007_audit_log_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Answer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numeric_value', models.FloatField(blank=True, null=True)),
+                ('text_value', models.TextField(blank=True, null=True)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='surveys_builder.field')),
+                ('option', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='answers', to='surveys_builder.option')),
+                ('response', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='surveys_builder.surveyresponse')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['field', 'option'], name='surveys_bui_field_i_f78b6a_idx'), models.Index(fields=['field', 'numeric_value'], name='surveys_bui_field_i_c5edb2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0 on 2026-10-18 10:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('surveys_builder', '0008_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered', models.PositiveIntegerField(default=0)),
+                ('numeric_count', models.PositiveIntegerField(default=0)),
+                ('numeric_sum', models.FloatField(default=0)),
+                ('numeric_sum_squares', models.FloatField(default=0)),
+                ('numeric_min', models.FloatField(blank=True, null=True)),
+                ('numeric_max', models.FloatField(blank=True, null=True)),
+                ('field', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rollup', to='surveys_builder.field')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='field_rollups', to='surveys_builder.survey')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OptionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='option_rollups', to='surveys_builder.field')),
+                ('option', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rollup', to='surveys_builder.option')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SurveyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('responses', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rollup', to='surveys_builder.survey')),
+            ],
+        ),
+    ]
@@ -1,6 +1,11 @@
-from django.db import models
-from cryptography.fernet import Fernet
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from surveys_builder.utils.crypto import (
+    encrypt_response_data,
+    decrypt_response_data,
+    get_sensitive_field_ids
+)
+from surveys_builder.utils.answers import sync_response_answers
 from surveys_builder.utils.constants import (
     ACTIONS,
     OPERATORS,
@@ -45,7 +50,8 @@ class Survey(BaseModelWithoutOrder):
     class Meta:
         verbose_name_plural = "Surveys"
         indexes = [
-            models.Index(fields = ['title', 'id'])
+            models.Index(fields = ['title', 'id']),
+            models.Index(fields = ['created_at', 'id'])
         ]
 
     def __str__(self):
@@ -67,7 +73,8 @@ class Section(BaseModelWithOrder, BaseModelWithoutOrder):
     class Meta(BaseModelWithOrder.Meta):
         unique_together = ('survey', 'order')
         indexes = [
-            models.Index(fields = ['survey', 'order'])
+            models.Index(fields = ['survey', 'order']),
+            models.Index(fields = ['created_at', 'id'])
         ]
 
     def __str__(self):
@@ -111,7 +118,8 @@ class Field(BaseModelWithOrder, BaseModelWithoutOrder):
 
     class Meta(BaseModelWithOrder.Meta):
         indexes = [
-            models.Index(fields = ['section', 'order'])
+            models.Index(fields = ['section', 'order']),
+            models.Index(fields = ['created_at', 'id'])
         ]
 
     def __str__(self):
@@ -242,7 +250,8 @@ class SurveyResponse(BaseModelWithoutOrder):
 
     class Meta:
         indexes = [
-            models.Index(fields = ['survey', 'user'])
+            models.Index(fields = ['survey', 'user']),
+            models.Index(fields = ['created_at', 'id'])
         ]
         unique_together = ('survey', 'user')
         ordering = ['-created_at']
@@ -256,28 +265,86 @@ class SurveyResponse(BaseModelWithoutOrder):
             self.created_by = request.user
         if request:
             self.updated_by = request.user
-        self.response_data = self._encrypt_response(self.response_data)
-        super().save(*args, **kwargs)
+        from surveys_builder.utils.rollups import update_survey_rollups
+
+        self.response_data = self._encrypt_response(self.survey_id, self.response_data)
+        response_data = self.decrypt_response(self.response_data)
+        with transaction.atomic():
+            previous_data = None
+            if self.pk:
+                previous_data = SurveyResponse.objects.select_for_update().filter(
+                    pk = self.pk
+                ).values_list('response_data', flat = True).first()
+            super().save(*args, **kwargs)
+            sync_response_answers(self.survey_id, [(self.id, response_data)])
+            update_survey_rollups(
+                self.survey_id,
+                self.decrypt_response(previous_data) if previous_data else None,
+                response_data
+            )
 
-    @classmethod
-    def _encrypt_response(cls, response_data: dict) -> dict:
-        for section in response_data['sections']:
-            for field in section['fields']:
-                field_obj = Field.objects.get(id = field['id'])
-                if field_obj.is_sensitive:
-                    f = Fernet(Fernet.generate_key())
-                    field['value'] = f.encrypt(field['value'].encode()).decode()
-        return cls.response_data
+    @staticmethod
+    def _encrypt_response(survey_id: int, response_data: dict) -> dict:
+        return encrypt_response_data(response_data, get_sensitive_field_ids(survey_id))
 
     @staticmethod
     def decrypt_response(response_data: dict) -> dict:
-        for section in survey['sections']:
-            for field in section['fields']:
-                field_obj = Field.objects.get(id = field['id'])
-                if field_obj.is_sensitive:
-                    f = Fernet(Fernet.generate_key())
-                    field['value'] = f.decrypt(field['value'].encode()).decode()
-        return response_data
+        return decrypt_response_data(response_data)
+
+
+class Answer(models.Model):
+    response = models.ForeignKey(SurveyResponse, related_name = 'answers', on_delete = models.CASCADE)
+    field = models.ForeignKey(Field, related_name = 'answers', on_delete = models.CASCADE)
+    option = models.ForeignKey(
+        Option,
+        related_name = 'answers',
+        on_delete = models.SET_NULL,
+        null = True,
+        blank = True
+    )
+    numeric_value = models.FloatField(null = True, blank = True)
+    text_value = models.TextField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['field', 'option']),
+            models.Index(fields = ['field', 'numeric_value'])
+        ]
+
+    def __str__(self):
+        return f"Answer to Field {self.field_id} in Response {self.response_id}"
+
+
+class SurveyRollup(models.Model):
+    survey = models.OneToOneField(Survey, related_name = 'rollup', on_delete = models.CASCADE)
+    responses = models.PositiveIntegerField(default = 0)
+    completed = models.PositiveIntegerField(default = 0)
+
+    def __str__(self):
+        return f"Rollup of Survey {self.survey_id}"
+
+
+class FieldRollup(models.Model):
+    field = models.OneToOneField(Field, related_name = 'rollup', on_delete = models.CASCADE)
+    survey = models.ForeignKey(Survey, related_name = 'field_rollups', on_delete = models.CASCADE)
+    answered = models.PositiveIntegerField(default = 0)
+    numeric_count = models.PositiveIntegerField(default = 0)
+    numeric_sum = models.FloatField(default = 0)
+    numeric_sum_squares = models.FloatField(default = 0)
+    numeric_min = models.FloatField(null = True, blank = True)
+    numeric_max = models.FloatField(null = True, blank = True)
+
+    def __str__(self):
+        return f"Rollup of Field {self.field_id}"
+
+
+class OptionRollup(models.Model):
+    option = models.OneToOneField(Option, related_name = 'rollup', on_delete = models.CASCADE)
+    field = models.ForeignKey(Field, related_name = 'option_rollups', on_delete = models.CASCADE)
+    count = models.PositiveIntegerField(default = 0)
+
+    def __str__(self):
+        return f"Rollup of Option {self.option_id}"
 
 
 class AuditLog(models.Model):
@@ -318,6 +385,40 @@ class AuditLog(models.Model):
         max_length = 50,
         choices = AUDIT_LOG_ACTIONS
     )
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields = ['created_at', 'id']),
+            models.Index(fields = ['survey', 'created_at']),
+            models.Index(fields = ['user', 'created_at'])
+        ]
 
     def __str__(self):
         return f"{self.user.username} {self.action}"
+
+
+class AuditLogDailyAggregate(models.Model):
+    day = models.DateField()
+    survey = models.ForeignKey(
+        Survey,
+        related_name = 'audit_log_aggregates',
+        on_delete = models.CASCADE,
+        null = True,
+        blank = True
+    )
+    action = models.CharField(
+        max_length = 50,
+        choices = AUDIT_LOG_ACTIONS
+    )
+    count = models.PositiveIntegerField(default = 0)
+    last_log_id = models.PositiveBigIntegerField(default = 0)
+
+    class Meta:
+        unique_together = ('day', 'survey', 'action')
+        indexes = [
+            models.Index(fields = ['last_log_id'])
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.action} {self.count}"
@@ -0,0 +1,19 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Paginate on the (created_at, id) index, newest first
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    """
+    Paginate on the primary key, newest first
+    """
+    ordering = '-id'
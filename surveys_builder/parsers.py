@@ -0,0 +1,16 @@
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parse MessagePack request bodies
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type = None, parser_context = None):
+        try:
+            return msgpack.unpackb(stream.read(), raw = False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
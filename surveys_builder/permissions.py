@@ -2,25 +2,20 @@ from rest_framework.permissions import (
     BasePermission,
     SAFE_METHODS
 )
+from surveys_builder.utils.roles import get_request_roles
 
 class IsAdmin(BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(
-            name='Admin'
-        ).exists()
+        return 'Admin' in get_request_roles(request)
 
 class IsAnalyst(BasePermission):
     def has_permission(self, request, view):
         if request.method in SAFE_METHODS + ('PUT', 'PATCH', 'POST'):
-            return request.user.groups.filter(
-                name='Analyst'
-            ).exists()
+            return 'Analyst' in get_request_roles(request)
         return False
 
 class IsDataViewer(BasePermission):
     def has_permission(self, request, view):
         if request.method in SAFE_METHODS:
-            return request.user.groups.filter(
-                name='Data Viewer'
-            ).exists()
+            return 'Data Viewer' in get_request_roles(request)
         return False
@@ -0,0 +1,44 @@
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    Render JSON with orjson, producing the same bytes as JSONRenderer for compact output
+    of data without floats. orjson writes floats in a different form (1e16 against 1e+16)
+    and NaN as null where JSONRenderer refuses it, so it is only used for the dict trees
+    of the read path.
+
+    Dates, decimals and other types orjson does not handle like DRF go through the DRF
+    encoder, indented output and data orjson cannot encode fall back to JSONRenderer.
+    """
+    def render(self, data, accepted_media_type = None, renderer_context = None):
+        if data is None:
+            return b''
+        if not self.compact or self.ensure_ascii or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            rendered = orjson.dumps(data, default = JSONEncoder().default, option = ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Keep the output a strict javascript subset like JSONRenderer
+        return rendered.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Render MessagePack, values msgpack does not handle natively are encoded like in JSON
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type = None, renderer_context = None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default = JSONEncoder().default, use_bin_type = True)
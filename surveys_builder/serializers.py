@@ -1,10 +1,14 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueTogetherValidator
+from django.db import transaction
 from django.contrib.auth.models import User
-from surveys_builder.utils.helpers import (
-    evaluate_condition,
-    get_section_field_map,
-    check_dependency
+from surveys_builder.utils.authoring import (
+    SurveyTreeBuilder,
+    resolve_field_types
 )
+from surveys_builder.utils.helpers import get_response_shape_error
+from surveys_builder.utils.rules import get_survey_rule_plan
+from surveys_builder.utils.submissions import upsert_survey_responses
 from surveys_builder.models import (
     Field,
     FieldType,
@@ -37,9 +41,10 @@ class FieldTypeSerializer(BaseModelSerializer):
 
 
 class ConditionSerializer(BaseModelSerializer):
+    source_field = serializers.PrimaryKeyRelatedField(queryset = Field.objects.all(), write_only = True)
+
     class Meta(BaseModelSerializer.Meta):
         model = Condition
-        exclude = BaseModelSerializer.Meta.exclude + ('source_field',)
 
 
 class ConditionDependencySerializer(BaseModelSerializer):
@@ -57,70 +62,103 @@ class DependencySerializer(BaseModelSerializer):
 
 class FieldSerializer(BaseModelSerializer):
     field_type = FieldTypeSerializer()
-    options = OptionSerializer(many = True)
-    conditional_logic = ConditionDependencySerializer(many = True)
-    dependencies = DependencySerializer(many = True)
+    options = OptionSerializer(many = True, required = False)
+    conditional_logic = ConditionDependencySerializer(many = True, required = False)
+    dependencies = DependencySerializer(many = True, required = False)
 
     class Meta(BaseModelSerializer.Meta):
         model = Field
+        extra_kwargs = {'section': {'required': False}}
+
+    def validate(self, data):
+        if self.parent is None and self.instance is None and 'section' not in data:
+            raise serializers.ValidationError({'section': "This field is required."})
+        return data
 
+    @transaction.atomic
     def create(self, validated_data):
-        options_data = validated_data.pop('options', [])
-        conditional_logic_data = validated_data.pop('conditional_logic', [])
-        dependencies_data = validated_data.pop('dependencies', [])
-        field_type_data = validated_data.pop('field_type')
-
-        field_type, created = FieldType.objects.get_or_create(**field_type_data)
-        validated_data['field_type'] = field_type
-
-        field = Field.objects.create(**validated_data)
-
-        if options_data:
-            for option_data in options_data:
-                Option.objects.create(field = field, **option_data)
-        if conditional_logic_data:
-            for condition_data in conditional_logic_data:
-                condition = Condition.objects.create(**condition_data['condition'])
-                ConditionDependency.objects.create(condition = condition, **condition_data)
-        if dependencies_data:
-            for dependency_data in dependencies_data:
-                Dependency.objects.create(**dependency_data)
+        builder = SurveyTreeBuilder(user = validated_data.pop('created_by', None))
+        field = builder.create_fields([(validated_data.pop('section'), validated_data)])[0]
+        builder.finish()
         return field
 
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        for nested in ('options', 'conditional_logic', 'dependencies'):
+            validated_data.pop(nested, None)
+        if 'field_type' in validated_data:
+            field_type_data = validated_data.pop('field_type')
+            validated_data['field_type'] = resolve_field_types([field_type_data])[
+                (field_type_data['name'], field_type_data['widget'])
+            ]
+        return super().update(instance, validated_data)
+
 
 class SectionSerializer(BaseModelSerializer):
-    fields = FieldSerializer(many = True, read_only = True)
+    fields = FieldSerializer(many = True, required = False)
 
     class Meta(BaseModelSerializer.Meta):
         model = Section
+        extra_kwargs = {'survey': {'required': False}}
+
+    def get_validators(self):
+        # Nested sections are validated before their survey exists
+        if self.parent is not None:
+            return []
+        return super().get_validators()
 
+    def validate(self, data):
+        if self.parent is None and self.instance is None and 'survey' not in data:
+            raise serializers.ValidationError({'survey': "This field is required."})
+        return data
+
+    @transaction.atomic
     def create(self, validated_data):
-        fields_data = validated_data.pop('fields', [])
-        section = Section.objects.create(**validated_data)
-        for field_data in fields_data:
-            Field.objects.create(section = section, **field_data)
+        builder = SurveyTreeBuilder(user = validated_data.pop('created_by', None))
+        survey = validated_data.pop('survey')
+        validated_data.setdefault('order', 0)
+        section = builder.create_sections(survey, [validated_data])[0]
+        builder.finish()
         return section
 
+    def update(self, instance, validated_data):
+        validated_data.pop('fields', None)
+        return super().update(instance, validated_data)
+
 
 class SurveySerializer(BaseModelSerializer):
-    sections = SectionSerializer(many = True, read_only = True)
+    sections = SectionSerializer(many = True, required = False)
 
     class Meta(BaseModelSerializer.Meta):
         model = Survey
 
+    def validate(self, data):
+        # Sections sent without an order take their position in the list, the model default
+        # filled in by the nested serializer would make them collide. Nested sections skip the
+        # unique together validation so their orders are checked here.
+        sections_data = data.get('sections', [])
+        for index, (section, initial) in enumerate(zip(sections_data, self.initial_data.get('sections', []))):
+            if 'order' not in initial:
+                section['order'] = index
+        orders = [section['order'] for section in sections_data]
+        if len(set(orders)) != len(orders):
+            raise serializers.ValidationError({'sections': "Sections must have distinct orders."})
+        return data
+
+    @transaction.atomic
     def create(self, validated_data) -> Survey:
         sections_data = validated_data.pop('sections', [])
         survey = Survey.objects.create(**validated_data)
         if sections_data:
-            for section_data in sections_data:
-                fields_data = section_data.pop('fields', [])
-                section = Section.objects.create(survey = survey, **section_data)
-                for field_data in fields_data:
-                    field_type_data = field_data.pop('field_type')
-                    field_type, _ = FieldType.objects.get_or_create(**field_type_data)
-                    Field.objects.create(section = section, field_type = field_type, **field_data)
+            builder = SurveyTreeBuilder(user = validated_data.get('created_by'))
+            builder.create_sections(survey, sections_data)
+            builder.finish()
         return survey
 
+    def update(self, instance, validated_data):
+        validated_data.pop('sections', None)
+        return super().update(instance, validated_data)
+
 
 class SurveyResponseSerializer(BaseModelSerializer):
     response_data = serializers.JSONField(
@@ -146,41 +184,44 @@ class SurveyResponseSerializer(BaseModelSerializer):
         model = SurveyResponse
         exclude = BaseModelSerializer.Meta.exclude + ('id',)
 
+    def get_validators(self):
+        # Creating a response for a survey and user that already answered it updates their response
+        validators = super().get_validators()
+        if self.instance is None:
+            validators = [validator for validator in validators if not isinstance(validator, UniqueTogetherValidator)]
+        return validators
+
+    def validate_response_data(self, value):
+        error = get_response_shape_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
     def validate(self, data):
-        section_field_map = get_section_field_map(data['response_data'])
-        sections = data['response_data']['sections']
-        for section in sections:
-            for field in section['fields']:
-                if 'conditional_logic' in field and field['conditional_logic']:
-                    for condition_dependency in field['conditional_logic']:
-                        condition = condition_dependency['condition']
-                        if not evaluate_condition(condition, section_field_map):
-                            raise serializers.ValidationError(
-                                f"Condition {condition['id']} not met for field {field['id']}"
-                            )
-                if 'dependencies' in field and field['dependencies']:
-                    for dependency in field['dependencies']:
-                        dependent_field_value = section_field_map.get(dependency['target_field']['id'])
-                        if not check_dependency(field, dependent_field_value):
-                            raise serializers.ValidationError(
-                                f"Dependency {dependency['id']} not met for field {field['id']}"
-                            )
+        survey = data.get('survey') or getattr(self.instance, 'survey', None)
+        if survey is None or 'response_data' not in data:
+            return data
+        errors = get_survey_rule_plan(survey.id).validate(data['response_data'])
+        if errors:
+            raise serializers.ValidationError(errors)
         return data
 
     def create(self, validated_data):
-        survey_id = self.context.get('survey')
-        user_id = self.context.get('user')
+        survey = validated_data.pop('survey', None)
+        user = validated_data.pop('user', None)
+        survey_id = self.context.get('survey') or getattr(survey, 'id', None)
+        user_id = self.context.get('user') or getattr(user, 'id', None)
 
         if not survey_id or not user_id:
             raise serializers.ValidationError("Survey and user must be provided in the context.")
 
-        response_data = validated_data.pop('response_data')
-        survey_response = SurveyResponse.objects.create(
-            survey_id = survey_id,
-            user_id = user_id,
-            response_data = {**response_data}
-        )
-        return survey_response
+        created_by = validated_data.get('created_by')
+        key = (survey_id, user_id)
+        response_id, _ = upsert_survey_responses(
+            {key: {**validated_data['response_data']}},
+            {key: getattr(created_by, 'id', None)}
+        )[key]
+        return SurveyResponse.objects.get(pk = response_id)
 
 
 class AuditLogSerializer(serializers.ModelSerializer):
@@ -1,31 +1,50 @@
 import logging
 
-from django.db.models.signals import post_save, post_delete
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from surveys_builder.models import (
     Survey,
     Section,
+    FieldType,
     Field,
-    SurveyResponse,
-    AuditLog
+    Option,
+    Condition,
+    ConditionDependency,
+    Dependency,
+    SurveyResponse
 )
+from surveys_builder.utils.audit import record_audit_event
+from surveys_builder.authentication import revoke_user_tokens
+from surveys_builder.utils.cache import (
+    bump_survey_revision,
+    bump_view_cache
+)
+from surveys_builder.utils.constants import (
+    AUDIT_LOGS_CACHE_NAMESPACE,
+    SURVEY_RESPONSES_CACHE_NAMESPACE
+)
+from surveys_builder.utils.crypto import decrypt_response_data
+from surveys_builder.utils.helpers import get_field_survey_id
+from surveys_builder.utils.roles import invalidate_user_roles
+from surveys_builder.utils.rollups import update_survey_rollups
 
 
 @receiver(post_save, sender = Survey)
 def log_survey_save(instance, created, **kwargs) -> None:
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
-        user = instance.created_by or instance.updated_by,
-        survey = instance,
+    record_audit_event(
+        user_id = instance.created_by_id or instance.updated_by_id,
+        survey_id = instance.id,
         action = action
     )
 
 
 @receiver(post_delete, sender = Survey)
 def log_survey_delete(instance, **kwargs) -> None:
-    AuditLog.objects.create(
-        user = instance.updated_by,
-        survey = instance,
+    record_audit_event(
+        user_id = instance.updated_by_id,
+        survey_id = instance.id,
         action = 'delete'
     )
 
@@ -33,20 +52,20 @@ def log_survey_delete(instance, **kwargs) -> None:
 @receiver(post_save, sender = Section)
 def log_section_save(instance, created, **kwargs) -> None:
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
-        user = instance.created_by or instance.updated_by,
-        section = instance,
-        survey = instance.survey,
+    record_audit_event(
+        user_id = instance.created_by_id or instance.updated_by_id,
+        section_id = instance.id,
+        survey_id = instance.survey_id,
         action = action
     )
 
 
 @receiver(post_delete, sender = Section)
 def log_section_delete(instance, **kwargs) -> None:
-    AuditLog.objects.create(
-        user = instance.updated_by,
-        section = instance,
-        survey = instance.survey,
+    record_audit_event(
+        user_id = instance.updated_by_id,
+        section_id = instance.id,
+        survey_id = instance.survey_id,
         action = 'delete'
     )
 
@@ -54,22 +73,22 @@ def log_section_delete(instance, **kwargs) -> None:
 @receiver(post_save, sender = Field)
 def log_field_save(instance, created, **kwargs) -> None:
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
-        user = instance.created_by or instance.updated_by,
-        field = instance,
-        section = instance.section,
-        survey = instance.section.survey,
+    record_audit_event(
+        user_id = instance.created_by_id or instance.updated_by_id,
+        field_id = instance.id,
+        section_id = instance.section_id,
+        survey_id = instance.section.survey_id,
         action = action
     )
 
 
 @receiver(post_delete, sender = Field)
 def log_field_delete(instance, **kwargs) -> None:
-    AuditLog.objects.create(
-        user = instance.updated_by,
-        field = instance,
-        section = instance.section,
-        survey = instance.section.survey,
+    record_audit_event(
+        user_id = instance.updated_by_id,
+        field_id = instance.id,
+        section_id = instance.section_id,
+        survey_id = instance.section.survey_id,
         action = 'delete'
     )
 
@@ -77,19 +96,120 @@ def log_field_delete(instance, **kwargs) -> None:
 @receiver(post_save, sender = SurveyResponse)
 def log_survey_response_save(instance, created, **kwargs) -> None:
     action = 'create' if created else 'update'
-    AuditLog.objects.create(
-        user = instance.created_by or instance.updated_by,
-        survey_response = instance,
-        survey = instance.survey,
+    record_audit_event(
+        user_id = instance.created_by_id or instance.updated_by_id or instance.user_id,
+        survey_response_id = instance.id,
+        survey_id = instance.survey_id,
         action = action
     )
 
 
 @receiver(post_delete, sender = SurveyResponse)
 def log_survey_response_delete(instance, **kwargs) -> None:
-    AuditLog.objects.create(
-        user = instance.updated_by,
-        survey_response = instance,
-        survey = instance.survey,
+    record_audit_event(
+        user_id = instance.updated_by_id or instance.user_id,
+        survey_response_id = instance.id,
+        survey_id = instance.survey_id,
         action = 'delete'
     )
+
+
+@receiver(post_save, sender = Survey)
+@receiver(post_delete, sender = Survey)
+def invalidate_survey_schema(instance, **kwargs) -> None:
+    bump_survey_revision(instance.id)
+
+
+@receiver(post_save, sender = Section)
+@receiver(post_delete, sender = Section)
+def invalidate_section_schema(instance, **kwargs) -> None:
+    bump_survey_revision(instance.survey_id)
+
+
+@receiver(post_save, sender = Option)
+@receiver(post_delete, sender = Option)
+def invalidate_option_schema(instance, **kwargs) -> None:
+    bump_survey_revision(get_field_survey_id(instance.field_id))
+
+
+@receiver(post_save, sender = FieldType)
+def invalidate_field_type_schemas(instance, created, **kwargs) -> None:
+    if created:
+        return
+    for survey_id in Section.objects.filter(
+        fields__field_type = instance
+    ).values_list('survey_id', flat = True).distinct():
+        bump_survey_revision(survey_id)
+
+
+@receiver(post_save, sender = Field)
+@receiver(post_delete, sender = Field)
+def invalidate_field_rules(instance, **kwargs) -> None:
+    bump_survey_revision(
+        Section.objects.filter(pk = instance.section_id).values_list('survey_id', flat = True).first()
+    )
+
+
+@receiver(post_save, sender = Condition)
+@receiver(post_delete, sender = Condition)
+@receiver(post_save, sender = Dependency)
+@receiver(post_delete, sender = Dependency)
+def invalidate_source_field_rules(instance, **kwargs) -> None:
+    bump_survey_revision(get_field_survey_id(instance.source_field_id))
+
+
+@receiver(post_save, sender = ConditionDependency)
+@receiver(post_delete, sender = ConditionDependency)
+def invalidate_condition_dependency_rules(instance, **kwargs) -> None:
+    source_field_id = Condition.objects.filter(
+        pk = instance.condition_id
+    ).values_list('source_field_id', flat = True).first()
+    bump_survey_revision(get_field_survey_id(source_field_id))
+
+
+@receiver(post_save, sender = SurveyResponse)
+@receiver(post_delete, sender = SurveyResponse)
+def invalidate_survey_response_views(instance, **kwargs) -> None:
+    bump_view_cache(SURVEY_RESPONSES_CACHE_NAMESPACE, instance.id)
+
+
+@receiver(post_delete, sender = User)
+@receiver(post_delete, sender = Survey)
+@receiver(post_delete, sender = Section)
+@receiver(post_delete, sender = Field)
+@receiver(post_delete, sender = SurveyResponse)
+def invalidate_audit_log_views(**kwargs) -> None:
+    # Audit logs are removed in cascade with the objects they reference
+    bump_view_cache(AUDIT_LOGS_CACHE_NAMESPACE, everything = True)
+
+
+@receiver(m2m_changed, sender = User.groups.through)
+def invalidate_group_membership_roles(instance, action, reverse, pk_set, **kwargs) -> None:
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_user_roles([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_user_roles(pk_set)
+    elif action == 'pre_clear':
+        invalidate_user_roles(instance.user_set.values_list('pk', flat = True))
+
+
+@receiver(post_save, sender = Group)
+@receiver(pre_delete, sender = Group)
+def invalidate_group_roles(instance, **kwargs) -> None:
+    invalidate_user_roles(instance.user_set.values_list('pk', flat = True))
+
+
+@receiver(post_save, sender = User)
+def revoke_inactive_user_tokens(instance, **kwargs) -> None:
+    if not instance.is_active:
+        revoke_user_tokens(instance.id)
+
+
+@receiver(post_delete, sender = SurveyResponse)
+def remove_survey_response_rollups(instance, **kwargs) -> None:
+    try:
+        update_survey_rollups(instance.survey_id, decrypt_response_data(instance.response_data))
+    except Survey.DoesNotExist:
+        # The rollups of a deleted survey are deleted with it
+        pass
@@ -1,50 +1,97 @@
+import os
+
 from celery.utils.log import get_task_logger
-from celery import shared_task
-from django.core.mail import send_mail
+from celery import shared_task, chord, group
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, send_mail
+from django.contrib.auth.models import User
 from surveys_builder.models import (
     Survey,
     AuditLog
 )
+from surveys_builder.utils.analysis import analyze_survey_answers
+from surveys_builder.utils.audit import persist_audit_events_now
+from surveys_builder.utils.audit_archive import archive_audit_logs
+from surveys_builder.utils.exports import (
+    export_survey_responses_to_file,
+    get_export_columns,
+    get_export_path,
+    merge_export_files,
+    new_export_handle,
+    plan_export_shards,
+    write_survey_responses
+)
+from surveys_builder.utils.ingestion import ingest_queued_submissions
+from surveys_builder.utils.reports import (
+    filter_audit_logs,
+    get_audit_log_summary,
+    new_report_handle,
+    refresh_audit_log_aggregates,
+    write_audit_report
+)
 
 logger = get_task_logger(__name__)
 
 
 @shared_task
-def generate_report(emails=None) -> list:
+def generate_report(
+    emails = None,
+    start: str = None,
+    end: str = None,
+    survey_id: int = None,
+    actions: list = None
+) -> dict:
     if emails is None:
         emails = []
     logger.info(f'Generating report for Audit Log')
-    audit_logs = AuditLog.objects.all()
-    report = []
-    for log in audit_logs:
-        log_data = {
-            'user': log.user.username,
-            'action': log.action,
-            'survey': log.survey.title,
-            'section': log.section,
-            'field': log.field,
-        }
-        report.append(log_data)
-    send_mail(
+    refresh_audit_log_aggregates()
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok = True)
+    handle = new_report_handle()
+    path = get_export_path(handle)
+    rows = write_audit_report(path, filter_audit_logs(start, end, survey_id, actions))
+    summary = '\n'.join(
+        f"{row['day']} {row['action']}: {row['count']}"
+        for row in get_audit_log_summary(start, end, survey_id, actions)
+    )
+
+    message = EmailMessage(
         'Audit Log Report',
-        'Please find the attached report for the Audit Log',
+        f'Please find the attached report for the Audit Log\n\n{summary}',
         'info@info.com',
-        [emails],
+        emails,
     )
-    logger.info(f'Report generated for Audit Log')
-    return report
+    message.attach_file(path, 'text/csv')
+    message.send()
+    logger.info(f'Report generated for Audit Log with {rows} rows to {handle}')
+    return {'handle': handle, 'rows': rows}
+
+
+@shared_task
+def analyze_survey_responses(survey_id: int, crosstabs: list = None, numeric_field_ids: list = None) -> dict:
+    logger.info(f'Analyzing survey responses for survey {survey_id}')
+    return analyze_survey_answers(survey_id, crosstabs, numeric_field_ids)
 
 
 @shared_task
-def export_survey_responses(survey_id: int, user_id: int = None) -> list:
+def refresh_audit_log_daily_aggregates() -> int:
+    return refresh_audit_log_aggregates()
+
+
+@shared_task
+def archive_old_audit_logs() -> dict:
+    archive = archive_audit_logs()
+    logger.info(f'{archive["rows"]} audit logs archived to {archive["handle"]}')
+    return archive
+
+
+@shared_task
+def export_survey_responses(survey_id: int, user_id: int = None, export_format: str = 'csv') -> dict:
     logger.info(f'Exporting survey responses for survey {survey_id}')
     survey = Survey.objects.get(pk = survey_id)
-    responses = survey.responses.all()
-    export_data = []
-    for response in responses:
-        response_data = response.decrypt_response(response.response_data)
-        export_data.append(response_data)
-    logger.info(f'Survey responses exported for survey {survey_id}')
+    export = export_survey_responses_to_file(survey.id, export_format)
+    logger.info(f'{export["rows"]} survey responses exported for survey {survey_id} to {export["handle"]}')
 
     user = None
     if user_id:
@@ -54,7 +101,95 @@ def export_survey_responses(survey_id: int, user_id: int = None) -> list:
         survey = survey,
         action = 'export_response'
     )
-    return export_data
+    return export
+
+
+EXPORT_SHARDS_KEY = 'export_shards:{task_id}'
+
+
+def start_sharded_export(survey_id: int, user_id: int = None, export_format: str = 'csv'):
+    """
+    Fan the export of a survey out into id range shards and merge them with a chord callback
+    """
+    survey = Survey.objects.get(pk = survey_id)
+    field_ids = get_export_columns(survey.id)
+    shards = plan_export_shards(survey.id)
+    result = chord(
+        group(
+            export_survey_responses_shard.s(survey.id, index, start_id, end_id, export_format, field_ids)
+            for index, (start_id, end_id) in enumerate(shards)
+        ),
+        merge_survey_response_export.s(survey.id, user_id, export_format, field_ids)
+    ).apply_async()
+    shard_task_ids = [shard.id for shard in result.parent.results] if result.parent else []
+    cache.set(EXPORT_SHARDS_KEY.format(task_id = result.id), shard_task_ids, timeout = settings.EXPORT_STATUS_TIMEOUT)
+    return result, shard_task_ids
+
+
+@shared_task(bind = True)
+def export_survey_responses_shard(
+    self,
+    survey_id: int,
+    shard: int,
+    start_id: int,
+    end_id: int,
+    export_format: str,
+    field_ids: list
+) -> dict:
+    logger.info(f'Exporting shard {shard} ({start_id} - {end_id}) of survey {survey_id}')
+
+    def report_progress(rows: int) -> None:
+        if not self.request.is_eager:
+            self.update_state(state = 'PROGRESS', meta = {'shard': shard, 'rows': rows})
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok = True)
+    handle = new_export_handle(survey_id, export_format, suffix = f'_shard{shard}')
+    rows = write_survey_responses(
+        survey_id,
+        get_export_path(handle),
+        export_format,
+        field_ids = field_ids,
+        start_id = start_id,
+        end_id = end_id,
+        include_header = False,
+        on_chunk = report_progress
+    )
+    return {'shard': shard, 'handle': handle, 'rows': rows}
+
+
+@shared_task
+def merge_survey_response_export(
+    shard_results: list,
+    survey_id: int,
+    user_id: int = None,
+    export_format: str = 'csv',
+    field_ids: list = None
+) -> dict:
+    shard_results = sorted(shard_results, key = lambda shard: shard['shard'])
+    handle = merge_export_files(
+        [shard['handle'] for shard in shard_results],
+        survey_id,
+        export_format,
+        field_ids or []
+    )
+    rows = sum(shard['rows'] for shard in shard_results)
+    logger.info(f'{rows} survey responses exported for survey {survey_id} to {handle}')
+
+    user = None
+    if user_id:
+        user = User.objects.get(pk = user_id)
+    AuditLog.objects.create(
+        user = user,
+        survey_id = survey_id,
+        action = 'export_response'
+    )
+    return {
+        'survey_id': survey_id,
+        'format': export_format,
+        'handle': handle,
+        'rows': rows,
+        'shards': [{'shard': shard['shard'], 'rows': shard['rows']} for shard in shard_results],
+    }
 
 
 @shared_task
@@ -78,3 +213,17 @@ def send_survey_invitations(survey_id: int, emails: list = [], user_id: int = No
         survey = survey,
         action = 'export_response'
     )
+
+
+@shared_task
+def persist_audit_events(events: list) -> int:
+    persist_audit_events_now(events)
+    return len(events)
+
+
+@shared_task
+def ingest_submissions() -> int:
+    processed = ingest_queued_submissions()
+    if processed:
+        logger.info(f'{processed} queued submissions ingested')
+    return processed
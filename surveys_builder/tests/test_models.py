@@ -1,9 +1,14 @@
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.contrib.auth.models import User, Group
 from surveys_builder.models import (
     Survey, Section, FieldType, Field, Option, Condition, ConditionDependency,
-    Dependency, SurveyResponse, AuditLog
+    Dependency, SurveyResponse, AuditLog, Answer
 )
+from surveys_builder.utils.answers import count_answers_per_option, histogram_numeric_answers, summarize_numeric_answers
+from surveys_builder.utils.crypto import get_sensitive_field_ids
 
 
 class SurveyModelTest(TestCase):
@@ -154,3 +159,115 @@ class AuditLogModelTest(TestCase):
 
     def test_audit_log_str(self):
         self.assertEqual(str(self.audit_log), f"{self.user.username} created")
+
+
+class SurveyResponseEncryptionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        self.section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        self.field_type = FieldType.objects.create(name = "Text", widget = "text_input", created_by = self.user)
+        self.public_field = Field.objects.create(section = self.section, field_type = self.field_type,
+                                                 label = "Name", created_by = self.user)
+        self.sensitive_field = Field.objects.create(section = self.section, field_type = self.field_type,
+                                                    label = "SSN", is_sensitive = True, created_by = self.user)
+        self.response_data = {
+            "sections": [
+                {
+                    "fields": [
+                        {"id": self.public_field.id, "value": "Jane"},
+                        {"id": self.sensitive_field.id, "value": "123-45-6789"}
+                    ]
+                }
+            ]
+        }
+
+    def test_sensitive_fields_encrypted_and_decrypted(self):
+        survey_response = SurveyResponse.objects.create(
+            survey = self.survey,
+            user = self.user,
+            response_data = self.response_data
+        )
+        stored = SurveyResponse.objects.get(pk = survey_response.pk).response_data
+        public, sensitive = stored['sections'][0]['fields']
+        self.assertEqual(public['value'], "Jane")
+        self.assertNotEqual(sensitive['value'], "123-45-6789")
+        self.assertEqual(SurveyResponse.decrypt_response(stored), self.response_data)
+
+    def test_resave_does_not_encrypt_twice(self):
+        survey_response = SurveyResponse.objects.create(
+            survey = self.survey,
+            user = self.user,
+            response_data = self.response_data
+        )
+        survey_response.save()
+        self.assertEqual(SurveyResponse.decrypt_response(survey_response.response_data), self.response_data)
+
+    def test_client_encrypted_flag_does_not_skip_encryption(self):
+        self.response_data['sections'][0]['fields'][1]['encrypted'] = True
+        survey_response = SurveyResponse.objects.create(
+            survey = self.survey,
+            user = self.user,
+            response_data = self.response_data
+        )
+        stored = SurveyResponse.objects.get(pk = survey_response.pk).response_data
+        self.assertNotEqual(stored['sections'][0]['fields'][1]['value'], "123-45-6789")
+        decrypted = SurveyResponse.decrypt_response(stored)
+        self.assertEqual(decrypted['sections'][0]['fields'][1], {"id": self.sensitive_field.id, "value": "123-45-6789"})
+
+    def test_sensitivity_lookup_is_cached(self):
+        self.assertEqual(get_sensitive_field_ids(self.survey.id), {self.sensitive_field.id})
+        with self.assertNumQueries(0):
+            get_sensitive_field_ids(self.survey.id)
+        self.public_field.is_sensitive = True
+        self.public_field.save()
+        self.assertEqual(get_sensitive_field_ids(self.survey.id), {self.public_field.id, self.sensitive_field.id})
+
+
+class AnswerModelTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        field_type = FieldType.objects.create(name = "Choice", widget = "checkbox", created_by = self.user)
+        self.colors = Field.objects.create(section = section, field_type = field_type, label = "Colors")
+        self.red = Option.objects.create(field = self.colors, value = "Red", order = 0)
+        self.blue = Option.objects.create(field = self.colors, value = "Blue", order = 1)
+        self.age = Field.objects.create(section = section, field_type = field_type, label = "Age", order = 1)
+        self.secret = Field.objects.create(section = section, field_type = field_type, label = "Secret", order = 2,
+                                           is_sensitive = True)
+
+    def create_response(self, username, colors, age):
+        return SurveyResponse.objects.create(
+            survey = self.survey,
+            user = User.objects.create(username = username),
+            response_data = {"sections": [{"fields": [
+                {"id": self.colors.id, "value": colors},
+                {"id": self.age.id, "value": age},
+                {"id": self.secret.id, "value": "hidden"},
+            ]}]}
+        )
+
+    def test_answers_are_synced_on_save(self):
+        response = self.create_response('first', ["Red", "Blue"], 30)
+        self.assertEqual(count_answers_per_option(self.colors.id), {self.red.id: 1, self.blue.id: 1})
+        self.assertFalse(Answer.objects.filter(field = self.secret).exists())
+
+        response.response_data = {"sections": [{"fields": [{"id": self.colors.id, "value": ["Red"]}]}]}
+        response.save()
+        self.assertEqual(count_answers_per_option(self.colors.id), {self.red.id: 1})
+        self.assertFalse(Answer.objects.filter(field = self.age).exists())
+
+    def test_numeric_answers_are_aggregated_in_sql(self):
+        for index, age in enumerate([20, 30, 40, "50"]):
+            self.create_response(f'user{index}', ["Red"], age)
+        summary = summarize_numeric_answers(self.age.id)
+        self.assertEqual((summary['count'], summary['average']), (4, 35))
+        self.assertEqual([count for _, _, count in histogram_numeric_answers(self.age.id, bins = 3)], [1, 1, 2])
+
+    def test_backfill_command_rebuilds_answers(self):
+        self.create_response('first', ["Blue"], 30)
+        Answer.objects.all().delete()
+        call_command('backfill_answers', stdout = StringIO())
+        self.assertEqual(count_answers_per_option(self.colors.id), {self.blue.id: 1})
+        self.assertEqual(Answer.objects.filter(field = self.age).get().numeric_value, 30)
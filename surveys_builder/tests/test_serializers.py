@@ -1,7 +1,14 @@
+from unittest import mock
+
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from surveys_builder.serializers import SurveySerializer, SectionSerializer, FieldSerializer
-from surveys_builder.models import Survey, Section, Field, FieldType, Option
+from surveys_builder.models import (
+    Survey, Section, Field, FieldType, Option, Condition, ConditionDependency, Dependency
+)
 from django.contrib.auth.models import User, Group
+from surveys_builder.utils.authoring import bulk_create_with_pks
 
 
 class SurveySerializerTest(TestCase):
@@ -60,4 +67,92 @@ class FieldSerializerTest(TestCase):
 
     def test_field_serializer_valid(self):
         serializer = FieldSerializer(data=self.field_data)
-        self.assertTrue(serializer.is_valid(), serializer.errors)
\ No newline at end of file
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+class BulkSurveyCreationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.existing_survey = Survey.objects.create(title = 'Existing', created_by = self.user)
+        existing_section = Section.objects.create(survey = self.existing_survey, title = 'Section', order = 1)
+        field_type = FieldType.objects.create(name = 'Text', widget = 'text_input')
+        self.existing_field = Field.objects.create(section = existing_section, field_type = field_type)
+
+    def build_survey_data(self, section_count, field_count):
+        return {
+            'title': 'Bulk Survey',
+            'sections': [
+                {
+                    'title': f'Section {section_index}',
+                    'fields': [
+                        {
+                            'label': f'Field {field_index}',
+                            'field_type': {'name': 'Choice', 'widget': 'radio'},
+                            'options': [{'value': 'Yes'}, {'value': 'No'}],
+                            'conditional_logic': [
+                                {
+                                    'condition': {
+                                        'source_field': self.existing_field.id,
+                                        'operator': 'equals',
+                                        'value': 'yes'
+                                    }
+                                }
+                            ],
+                            'dependencies': [
+                                {'target_field': self.existing_field.id, 'dependency_type': 'equal'}
+                            ]
+                        }
+                        for field_index in range(field_count)
+                    ]
+                }
+                for section_index in range(section_count)
+            ]
+        }
+
+    def create_survey(self, data):
+        serializer = SurveySerializer(data = data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return serializer.save(created_by = self.user)
+
+    def test_creates_whole_tree(self):
+        survey = self.create_survey(self.build_survey_data(2, 3))
+        self.assertEqual(list(survey.sections.values_list('order', flat = True)), [0, 1])
+        fields = Field.objects.filter(section__survey = survey)
+        self.assertEqual(fields.count(), 6)
+        self.assertEqual(Option.objects.filter(field__in = fields).count(), 12)
+        self.assertEqual(Condition.objects.filter(source_field = self.existing_field).count(), 6)
+        self.assertEqual(ConditionDependency.objects.filter(affected_field__in = fields).count(), 6)
+        self.assertEqual(Dependency.objects.filter(source_field__in = fields).count(), 6)
+        self.assertEqual(FieldType.objects.filter(name = 'Choice').count(), 1)
+
+    def test_query_count_independent_of_tree_size(self):
+        serializer = SurveySerializer(data = self.build_survey_data(5, 20))
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save(created_by = self.user)
+        # One insert per level, large levels may be split into batches by the backend
+        self.assertLessEqual(len(queries), 15)
+
+    def test_primary_keys_recovered_without_returning_rows(self):
+        with mock.patch.object(
+            type(connection.features),
+            'can_return_rows_from_bulk_insert',
+            new_callable = mock.PropertyMock,
+            return_value = False
+        ):
+            survey = self.create_survey(self.build_survey_data(2, 2))
+        for section in survey.sections.all():
+            self.assertEqual(section.fields.count(), 2)
+            for field in section.fields.all():
+                self.assertEqual(list(field.options.values_list('value', flat = True)), ['Yes', 'No'])
+                self.assertEqual(field.conditional_logic.count(), 1)
+
+    def test_recovered_primary_keys_must_match_the_new_rows(self):
+        objects = [FieldType(name = 'Text', widget = 'text')]
+        with mock.patch.object(
+            type(connection.features),
+            'can_return_rows_from_bulk_insert',
+            new_callable = mock.PropertyMock,
+            return_value = False
+        ), mock.patch.object(FieldType.objects, 'bulk_create'):
+            with self.assertRaises(DatabaseError):
+                bulk_create_with_pks(FieldType, objects, name = 'Text')
@@ -0,0 +1,427 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth.models import Group, User
+from surveys_builder.models import (
+    Survey, Section, FieldType, Field, Option, Condition, ConditionDependency, Dependency, SurveyResponse, AuditLog,
+    AuditLogDailyAggregate
+)
+from rest_framework.renderers import JSONRenderer
+from surveys_builder.renderers import ORJSONRenderer
+from surveys_builder.serializers import FieldSerializer, SectionSerializer, SurveySerializer
+from surveys_builder.utils.audit import audit_buffer
+from django.core import mail
+from surveys_builder.tasks import export_survey_responses_shard, generate_report, merge_survey_response_export
+from surveys_builder.utils.exports import (
+    export_survey_responses_to_file, get_export_columns, get_export_path, plan_export_shards
+)
+from surveys_builder.utils.analysis import analyze_survey_answers, load_survey_answers
+from django.core.cache import cache
+from surveys_builder.utils.cache import VIEW_CACHE_VERSION_KEY, bump_survey_revision
+from surveys_builder.utils.constants import AUDIT_LOGS_CACHE_NAMESPACE
+from surveys_builder.utils.audit_archive import archive_audit_logs, get_archive_path
+from surveys_builder.utils.reports import refresh_audit_log_aggregates
+from surveys_builder.utils.roles import get_user_roles
+from surveys_builder.utils.rules import RULE_PLAN_CACHE_SIZE, _get_compiled_plan, get_survey_rule_plan
+from surveys_builder.utils.selection import Selection, apply_selection
+from surveys_builder.utils.trees import build_field_trees, build_section_trees, build_survey_trees
+
+
+def build_response(values):
+    return {
+        "sections": [
+            {"fields": [{"id": field_id, "value": value} for field_id, value in values.items()]}
+        ]
+    }
+
+
+class SurveyRulePlanTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        self.section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        self.field_type = FieldType.objects.create(name = "Text", widget = "text_input", created_by = self.user)
+        self.age = Field.objects.create(section = self.section, field_type = self.field_type, label = "Age",
+                                        created_by = self.user)
+        self.employer = Field.objects.create(section = self.section, field_type = self.field_type,
+                                             label = "Employer", created_by = self.user)
+        self.salary = Field.objects.create(section = self.section, field_type = self.field_type, label = "Salary",
+                                           created_by = self.user)
+        self.adult = Condition.objects.create(source_field = self.age, operator = "greater_than_or_equals",
+                                              value = "18", created_by = self.user)
+        ConditionDependency.objects.create(condition = self.adult, affected_field = self.employer,
+                                           created_by = self.user)
+        self.employed = Condition.objects.create(source_field = self.employer, operator = "does_not_equal",
+                                                 value = "none", created_by = self.user)
+        ConditionDependency.objects.create(condition = self.employed, affected_field = self.salary,
+                                           created_by = self.user)
+
+    def test_conditions_met(self):
+        plan = get_survey_rule_plan(self.survey.id)
+        self.assertEqual(plan.validate(build_response({self.age.id: 30, self.employer.id: "Acme",
+                                                       self.salary.id: 10})), [])
+
+    def test_condition_not_met(self):
+        plan = get_survey_rule_plan(self.survey.id)
+        errors = plan.validate(build_response({self.age.id: 12, self.employer.id: "Acme"}))
+        self.assertEqual(errors, [f"Condition {self.adult.id} not met for field {self.employer.id}"])
+
+    def test_hidden_source_hides_dependents(self):
+        plan = get_survey_rule_plan(self.survey.id)
+        self.assertEqual(plan.order, [self.employer.id, self.salary.id])
+        errors = plan.validate(build_response({self.age.id: 12, self.salary.id: 10}))
+        self.assertEqual(errors, [f"Condition {self.employed.id} not met for field {self.salary.id}"])
+
+    def test_dependency(self):
+        dependency = Dependency.objects.create(source_field = self.salary, target_field = self.age,
+                                               dependency_type = "greater_than", created_by = self.user)
+        plan = get_survey_rule_plan(self.survey.id)
+        errors = plan.validate(build_response({self.age.id: 30, self.employer.id: "Acme", self.salary.id: 20}))
+        self.assertEqual(errors, [f"Dependency {dependency.id} not met for field {self.salary.id}"])
+
+    def test_unknown_field(self):
+        plan = get_survey_rule_plan(self.survey.id)
+        self.assertEqual(len(plan.validate(build_response({0: "value"}))), 1)
+
+    def test_cached_plan_runs_without_queries(self):
+        get_survey_rule_plan(self.survey.id)
+        with self.assertNumQueries(0):
+            plan = get_survey_rule_plan(self.survey.id)
+            plan.validate(build_response({self.age.id: 30}))
+
+    def test_plan_invalidated_on_rule_change(self):
+        plan = get_survey_rule_plan(self.survey.id)
+        self.adult.value = "21"
+        self.adult.save()
+        self.assertIsNot(get_survey_rule_plan(self.survey.id), plan)
+        errors = get_survey_rule_plan(self.survey.id).validate(build_response({self.age.id: 19,
+                                                                              self.employer.id: "Acme"}))
+        self.assertEqual(len(errors), 1)
+
+    def test_plan_cache_is_bounded(self):
+        for _ in range(RULE_PLAN_CACHE_SIZE + 1):
+            bump_survey_revision(self.survey.id)
+            get_survey_rule_plan(self.survey.id)
+        self.assertEqual(_get_compiled_plan.cache_info().currsize, RULE_PLAN_CACHE_SIZE)
+
+
+class SurveyResponseExportTest(TestCase):
+    def setUp(self):
+        self.export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.export_root.cleanup)
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        self.section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        self.field_type = FieldType.objects.create(name = "Text", widget = "text_input", created_by = self.user)
+        self.name = Field.objects.create(section = self.section, field_type = self.field_type, label = "Name",
+                                         created_by = self.user)
+        self.secret = Field.objects.create(section = self.section, field_type = self.field_type, label = "Secret",
+                                           is_sensitive = True, created_by = self.user)
+        for index in range(5):
+            respondent = User.objects.create(username = f'respondent{index}')
+            SurveyResponse.objects.create(
+                survey = self.survey,
+                user = respondent,
+                response_data = build_response({self.name.id: f"name {index}", self.secret.id: f"secret {index}"})
+            )
+
+    def test_csv_export_streams_in_chunks(self):
+        with override_settings(EXPORT_ROOT = self.export_root.name, EXPORT_CHUNK_SIZE = 2):
+            export = export_survey_responses_to_file(self.survey.id, 'csv')
+            path = get_export_path(export['handle'])
+        self.assertEqual(export['rows'], 5)
+        with open(path, newline = '') as export_file:
+            rows = list(csv.DictReader(export_file))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0][f'field_{self.secret.id}'], "secret 0")
+        self.assertFalse(os.path.exists(f'{path}.part'))
+
+    def test_parquet_cells_match_csv(self):
+        import pyarrow.parquet
+
+        with override_settings(EXPORT_ROOT = self.export_root.name):
+            parquet_export = export_survey_responses_to_file(self.survey.id, 'parquet')
+            csv_export = export_survey_responses_to_file(self.survey.id, 'csv')
+            table = pyarrow.parquet.read_table(get_export_path(parquet_export['handle'])).to_pylist()
+            with open(get_export_path(csv_export['handle']), newline = '') as export_file:
+                rows = list(csv.DictReader(export_file))
+        self.assertEqual(table[0][f'field_{self.name.id}'], "name 0")
+        self.assertEqual(
+            [row[f'field_{self.name.id}'] for row in table],
+            [row[f'field_{self.name.id}'] for row in rows]
+        )
+
+    def test_failed_exports_leave_no_partial_file(self):
+        with override_settings(EXPORT_ROOT = self.export_root.name), \
+                mock.patch('surveys_builder.utils.exports.iter_response_chunks', side_effect = OSError):
+            with self.assertRaises(OSError):
+                export_survey_responses_to_file(self.survey.id, 'csv')
+        self.assertEqual(os.listdir(self.export_root.name), [])
+
+    def test_jsonl_export(self):
+        with override_settings(EXPORT_ROOT = self.export_root.name, EXPORT_CHUNK_SIZE = 3):
+            export = export_survey_responses_to_file(self.survey.id, 'jsonl')
+            path = get_export_path(export['handle'])
+        with open(path) as export_file:
+            rows = [json.loads(line) for line in export_file]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[4]['answers'][str(self.name.id)], "name 4")
+
+    def test_sharded_export_merges_in_order(self):
+        with override_settings(EXPORT_ROOT = self.export_root.name, EXPORT_SHARD_SIZE = 2):
+            shards = plan_export_shards(self.survey.id)
+            field_ids = get_export_columns(self.survey.id)
+            shard_results = [
+                export_survey_responses_shard.apply(
+                    args = [self.survey.id, index, start_id, end_id, 'csv', field_ids]
+                ).get()
+                for index, (start_id, end_id) in enumerate(shards)
+            ]
+            export = merge_survey_response_export.apply(
+                args = [list(reversed(shard_results)), self.survey.id, self.user.id, 'csv', field_ids]
+            ).get()
+            path = get_export_path(export['handle'])
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(export['rows'], 5)
+        self.assertEqual([shard['rows'] for shard in export['shards']], [2, 2, 1])
+        with open(path, newline = '') as export_file:
+            rows = list(csv.DictReader(export_file))
+        self.assertEqual([row[f'field_{self.name.id}'] for row in rows], [f"name {index}" for index in range(5)])
+        self.assertEqual(sorted(os.listdir(self.export_root.name)), [export['handle']])
+
+
+class AuditBufferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+
+    def test_events_written_in_one_batch(self):
+        with audit_buffer():
+            with self.captureOnCommitCallbacks(execute = True):
+                survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+                Section.objects.create(survey = survey, title = "Section 1", order = 1, created_by = self.user)
+                Section.objects.create(survey = survey, title = "Section 2", order = 2, created_by = self.user)
+            self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertEqual(
+            list(AuditLog.objects.order_by('id').values_list('action', 'section__title')),
+            [('create', None), ('create', 'Section 1'), ('create', 'Section 2')]
+        )
+
+    def test_rolled_back_events_discarded(self):
+        with audit_buffer():
+            with self.captureOnCommitCallbacks(execute = True):
+                Survey.objects.create(title = "Kept", created_by = self.user)
+                try:
+                    with transaction.atomic():
+                        Survey.objects.create(title = "Rolled back", created_by = self.user)
+                        raise ValueError
+                except ValueError:
+                    pass
+        self.assertEqual(AuditLog.objects.count(), 1)
+
+    def test_delete_event_drops_deleted_reference(self):
+        survey = Survey.objects.create(title = "Test Survey", created_by = self.user, updated_by = self.user)
+        with self.captureOnCommitCallbacks(execute = True):
+            survey.delete()
+        log = AuditLog.objects.get(action = 'delete')
+        self.assertIsNone(log.survey_id)
+        self.assertEqual(log.user, self.user)
+
+    @override_settings(AUDIT_LOG_MODE = 'celery')
+    def test_celery_mode_enqueues_events(self):
+        with mock.patch('surveys_builder.tasks.persist_audit_events.delay') as delay:
+            with self.captureOnCommitCallbacks(execute = True):
+                survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        delay.assert_called_once_with(
+            [{'user_id': self.user.id, 'survey_id': survey.id, 'action': 'create'}]
+        )
+        self.assertEqual(AuditLog.objects.count(), 0)
+
+
+class UserRolesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.admin_group = Group.objects.create(name = 'Admin')
+        self.analyst_group = Group.objects.create(name = 'Analyst')
+        self.user.groups.add(self.admin_group)
+
+    def test_roles_are_cached(self):
+        self.assertEqual(get_user_roles(self.user), {'Admin'})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_roles(self.user), {'Admin'})
+
+    def test_roles_are_invalidated_on_membership_change(self):
+        get_user_roles(self.user)
+        self.user.groups.add(self.analyst_group)
+        self.assertEqual(get_user_roles(self.user), {'Admin', 'Analyst'})
+        self.admin_group.user_set.remove(self.user)
+        self.assertEqual(get_user_roles(self.user), {'Analyst'})
+        self.analyst_group.user_set.clear()
+        self.assertEqual(get_user_roles(self.user), set())
+
+    def test_roles_are_invalidated_on_group_rename(self):
+        get_user_roles(self.user)
+        self.admin_group.name = 'Data Viewer'
+        self.admin_group.save()
+        self.assertEqual(get_user_roles(self.user), {'Data Viewer'})
+
+
+@override_settings(EXPORT_ROOT = tempfile.mkdtemp(), AUDIT_AGGREGATE_SETTLE_SECONDS = 0)
+class AuditReportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        self.other_survey = Survey.objects.create(title = "Other Survey", created_by = self.user)
+        self.section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        AuditLog.objects.bulk_create(
+            [AuditLog(user = self.user, survey = self.survey, section = self.section, action = 'update')] * 3
+            + [AuditLog(user = self.user, survey = self.other_survey, action = 'create')]
+        )
+
+    def test_report_is_attached_with_filters(self):
+        with self.assertNumQueries(9):
+            result = generate_report(['admin@example.com'], survey_id = self.survey.id, actions = ['update'])
+        self.assertEqual(result['rows'], 3)
+        attachment_name, content, mimetype = mail.outbox[0].attachments[0]
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], ['id', 'created_at', 'user', 'action', 'survey', 'section', 'field'])
+        self.assertEqual(rows[1][2:], ['testuser', 'update', 'Test Survey', 'Section 1', ''])
+        self.assertIn('update: 3', mail.outbox[0].body)
+
+    def test_aggregates_only_process_new_logs(self):
+        self.assertEqual(refresh_audit_log_aggregates(), 4)
+        self.assertEqual(refresh_audit_log_aggregates(), 0)
+        AuditLog.objects.create(user = self.user, survey = self.survey, action = 'update')
+        self.assertEqual(refresh_audit_log_aggregates(), 1)
+        aggregate = AuditLogDailyAggregate.objects.get(survey = self.survey, action = 'update')
+        self.assertEqual(aggregate.count, 4)
+
+    def test_aggregates_wait_for_logs_to_settle(self):
+        with self.settings(AUDIT_AGGREGATE_SETTLE_SECONDS = 60):
+            self.assertEqual(refresh_audit_log_aggregates(), 0)
+            AuditLog.objects.update(created_at = timezone.now() - timedelta(minutes = 2))
+            self.assertEqual(refresh_audit_log_aggregates(), 4)
+
+
+@override_settings(AUDIT_ARCHIVE_ROOT = tempfile.mkdtemp(), AUDIT_AGGREGATE_SETTLE_SECONDS = 0)
+class AuditArchiveTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        AuditLog.objects.bulk_create([AuditLog(user = self.user, survey = self.survey, action = 'update')] * 5)
+        self.old_ids = list(AuditLog.objects.order_by('id').values_list('id', flat = True)[:3])
+        AuditLog.objects.filter(id__in = self.old_ids).update(created_at = timezone.now() - timedelta(days = 400))
+
+    def test_old_logs_are_archived_and_counted(self):
+        archive = archive_audit_logs(chunk_size = 2)
+        self.assertEqual(archive['rows'], 3)
+        with gzip.open(get_archive_path(archive['handle']), 'rt') as archive_file:
+            rows = [json.loads(line) for line in archive_file]
+        self.assertEqual([row['id'] for row in rows], self.old_ids)
+        self.assertEqual(AuditLog.objects.count(), 2)
+        self.assertEqual(sum(AuditLogDailyAggregate.objects.values_list('count', flat = True)), 5)
+        self.assertEqual(archive_audit_logs()['rows'], 0)
+
+    def test_archiving_invalidates_cached_audit_logs(self):
+        key = VIEW_CACHE_VERSION_KEY.format(namespace = AUDIT_LOGS_CACHE_NAMESPACE, scope = 'all')
+        version = cache.get(key)
+        archive_audit_logs()
+        self.assertNotEqual(cache.get(key), version)
+
+
+class SurveyAnalysisTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Test Survey", created_by = self.user)
+        section = Section.objects.create(survey = self.survey, title = "Section 1", created_by = self.user)
+        field_type = FieldType.objects.create(name = "Choice", widget = "radio", created_by = self.user)
+        self.smoker = Field.objects.create(section = section, field_type = field_type, label = "Smoker")
+        self.region = Field.objects.create(section = section, field_type = field_type, label = "Region", order = 1)
+        self.age = Field.objects.create(section = section, field_type = field_type, label = "Age", order = 2)
+        self.income = Field.objects.create(section = section, field_type = field_type, label = "Income", order = 3)
+        for order, value in enumerate(["Yes", "No"]):
+            Option.objects.create(field = self.smoker, value = value, order = order)
+        for order, value in enumerate(["North", "South", "East"]):
+            Option.objects.create(field = self.region, value = value, order = order)
+        answers = [("Yes", "North", 20, 1000), ("No", "North", 30, 2000), ("No", "South", 40, 3000),
+                   ("Yes", "East", None, 500)]
+        for index, (smoker, region, age, income) in enumerate(answers):
+            SurveyResponse.objects.create(
+                survey = self.survey,
+                user = User.objects.create(username = f'user{index}'),
+                response_data = build_response(
+                    {self.smoker.id: smoker, self.region.id: region, self.age.id: age, self.income.id: income}
+                )
+            )
+
+    def test_answers_load_into_columns(self):
+        matrix = load_survey_answers(self.survey.id, chunk_size = 3)
+        self.assertEqual(matrix.codes[self.smoker.id].tolist(), [0, 1, 1, 0])
+        self.assertEqual(matrix.codes[self.region.id].tolist(), [0, 0, 1, 2])
+        self.assertEqual(matrix.numeric[self.age.id][:3].tolist(), [20, 30, 40])
+
+    def test_crosstabs_percentiles_and_correlations(self):
+        result = analyze_survey_answers(
+            self.survey.id, crosstabs = [(self.smoker.id, self.region.id)], numeric_field_ids = [self.age.id, self.income.id]
+        )
+        self.assertEqual(result['crosstabs'][0]['counts'], [[1, 0, 1], [1, 1, 0]])
+        self.assertEqual(result['percentiles'][self.age.id], [25, 30, 35])
+        self.assertAlmostEqual(result['correlation']['matrix'][0][1], 1)
+
+    def test_crosstabs_of_unknown_fields_are_rejected(self):
+        result = analyze_survey_answers(self.survey.id, crosstabs = [(self.smoker.id, self.age.id), (0,)])
+        self.assertEqual(len(result['errors']), 2)
+        self.assertNotIn('crosstabs', result)
+
+
+class SurveyTreeReadPathTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username = 'testuser')
+        self.survey = Survey.objects.create(title = "Enquête \u2028", description = None, created_by = self.user)
+        field_type = FieldType.objects.create(name = "Choice", widget = "radio", created_by = self.user)
+        for section_order in (1, 0):
+            section = Section.objects.create(survey = self.survey, title = "Section", order = section_order)
+            first = Field.objects.create(section = section, field_type = field_type, label = "Première", order = 1)
+            second = Field.objects.create(section = section, field_type = field_type, label = None, required = True)
+            Option.objects.create(field = first, value = "Oui", order = 1)
+            Option.objects.create(field = first, value = None, order = 0)
+            condition = Condition.objects.create(source_field = second, operator = 'equals', value = "1")
+            ConditionDependency.objects.create(condition = condition, affected_field = first)
+            Dependency.objects.create(source_field = first, target_field = second, dependency_type = 'required')
+
+    def assertSameBytes(self, trees, serialized):
+        self.assertEqual(ORJSONRenderer().render(trees), JSONRenderer().render(serialized))
+
+    def test_survey_trees_match_the_serializer(self):
+        self.assertSameBytes(build_survey_trees([self.survey.id]), SurveySerializer([self.survey], many = True).data)
+
+    def test_section_and_field_trees_match_the_serializers(self):
+        sections = list(Section.objects.order_by('-id'))
+        fields = list(Field.objects.order_by('-id'))
+        self.assertSameBytes(
+            build_section_trees([section.id for section in sections]),
+            SectionSerializer(sections, many = True).data
+        )
+        self.assertSameBytes(build_field_trees([field.id for field in fields]), FieldSerializer(fields, many = True).data)
+
+    def test_selected_trees_match_the_selected_serializer(self):
+        for selection in (
+            Selection({'id', 'title'}, None),
+            Selection(None, {'sections'}),
+            Selection({'id', 'sections.fields.label', 'sections.fields.conditional_logic'}, {'sections.fields'}),
+            Selection(None, {'sections.fields.field_type', 'sections.fields.conditional_logic.condition'}),
+        ):
+            serializer = SurveySerializer([self.survey], many = True)
+            apply_selection(serializer, selection)
+            self.assertSameBytes(build_survey_trees([self.survey.id], selection), serializer.data)
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        data = {'created_at': timezone.now(), 1: [0.5, None, "\u2029"]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
@@ -1,8 +1,28 @@
+from io import StringIO
+from unittest import mock
+
+import brotli
+import msgpack
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth.models import User, Group
-from surveys_builder.models import Survey, Section, Field, FieldType
+from surveys_builder.models import (
+    Survey, Section, Field, FieldType, Option, Condition, ConditionDependency, Dependency, SurveyResponse, AuditLog,
+    SurveyRollup, FieldRollup, OptionRollup
+)
+from surveys_builder.utils import ingestion
+from surveys_builder.utils.ingestion import (
+    ABANDONED_SLOT,
+    SUBMISSION_QUEUE_SLOT_KEY,
+    ingest_queued_submissions
+)
 
 class SurveyViewSetTest(APITestCase):
     def setUp(self):
@@ -24,6 +44,48 @@ class SurveyViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['title'], self.survey.title)
 
+    def test_survey_detail_served_from_cache(self):
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+            self.client.get(self.list_url)
+        self.assertEqual(response.data['title'], self.survey.title)
+        self.assertFalse([query for query in queries if 'surveys_builder_section' in query['sql']])
+
+    def test_permission_roles_are_resolved_once(self):
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.detail_url)
+        self.assertFalse([query for query in queries if 'auth_group' in query['sql']])
+
+    def test_nested_section_orders(self):
+        def create(*orders):
+            sections = [{'title': f"Section {index}"} for index in range(len(orders))]
+            for section, order in zip(sections, orders):
+                if order is not None:
+                    section['order'] = order
+            return self.client.post(self.list_url, {'title': "Nested", 'sections': sections}, format='json')
+
+        for orders in ((1, 0, 1), (1, None)):
+            self.assertEqual(create(*orders).status_code, status.HTTP_400_BAD_REQUEST, orders)
+        response = create(2, 0)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            list(Section.objects.filter(survey_id=response.data['id']).order_by('title').values_list('order', flat=True)),
+            [2, 0]
+        )
+
+    def test_survey_detail_reflects_changes(self):
+        self.client.get(self.detail_url)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        response = self.client.get(self.detail_url)
+        self.assertEqual([item['title'] for item in response.data['sections']], ["Section 1"])
+
+        section.title = "Renamed"
+        section.save()
+        response = self.client.get(self.list_url)
+        self.assertEqual([item['title'] for item in response.data['results'][0]['sections']], ["Renamed"])
+
 
 class SectionViewSetTest(APITestCase):
     def setUp(self):
@@ -69,3 +131,697 @@ class FieldViewSetTest(APITestCase):
         response = self.client.get(self.detail_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['label'], self.field.label)
+
+
+class SurveySchemaViewTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        admin_group, created = Group.objects.get_or_create(name='Admin')
+        self.user.groups.add(admin_group)
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", description="Description", created_by=self.user)
+        self.section = Section.objects.create(survey=self.survey, title="Section 1", order=1, created_by=self.user)
+        self.hidden_section = Section.objects.create(survey=self.survey, title="Section 2", order=2,
+                                                     created_by=self.user)
+        field_type = FieldType.objects.create(name="Choice", widget="radio", created_by=self.user)
+        self.question = Field.objects.create(section=self.section, field_type=field_type, label="Question",
+                                             created_by=self.user)
+        self.follow_up = Field.objects.create(section=self.section, field_type=field_type, label="Follow up",
+                                              order=1, created_by=self.user)
+        Option.objects.create(field=self.question, value="Yes", order=0)
+        Option.objects.create(field=self.question, value="No", order=1)
+        condition = Condition.objects.create(source_field=self.question, operator="equals", value="Yes")
+        ConditionDependency.objects.create(condition=condition, affected_field=self.follow_up)
+        section_condition = Condition.objects.create(source_field=self.question, operator="equals", value="No")
+        ConditionDependency.objects.create(condition=section_condition, affected_section=self.hidden_section)
+        Dependency.objects.create(source_field=self.follow_up, target_field=self.question, dependency_type="equal")
+
+    def test_export_and_import_round_trip(self):
+        response = self.client.get(reverse('surveys-schema', kwargs={'pk': self.survey.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        document = response.json()
+        self.assertEqual(document['version'], 2)
+
+        response = self.client.post(reverse('surveys-import-schema'), document, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        clone = Survey.objects.get(pk=response.data['id'])
+        self.assertEqual(clone.title, "Survey 1")
+
+        cloned_document = self.client.get(reverse('surveys-schema', kwargs={'pk': clone.id})).json()
+        clone_question = Field.objects.get(section__survey=clone, label="Question")
+        clone_follow_up = Field.objects.get(section__survey=clone, label="Follow up")
+        clone_hidden_section = Section.objects.get(survey=clone, title="Section 2")
+        for rule in cloned_document['conditions'] + cloned_document['dependencies']:
+            rule.pop('id')
+        self.assertCountEqual(cloned_document['conditions'], [
+            {'source': clone_question.id, 'operator': 'equals', 'value': 'Yes', 'field': clone_follow_up.id},
+            {'source': clone_question.id, 'operator': 'equals', 'value': 'No', 'section': clone_hidden_section.id},
+        ])
+        self.assertEqual(cloned_document['dependencies'], [
+            {'source': clone_follow_up.id, 'target': clone_question.id, 'type': 'equal'}
+        ])
+        for document_ in (document, cloned_document):
+            for section in document_['sections']:
+                section.pop('id')
+                for field in section['fields']:
+                    field.pop('id')
+            for key in ('survey', 'conditions', 'dependencies'):
+                document_.pop(key)
+        self.assertEqual(cloned_document, document)
+
+    def test_import_rejects_unknown_references(self):
+        document = self.client.get(reverse('surveys-schema', kwargs={'pk': self.survey.id})).json()
+        document['dependencies'].append({'source': self.question.id, 'target': 0, 'type': 'equal'})
+        response = self.client.post(reverse('surveys-import-schema'), document, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Survey.objects.count(), 1)
+
+    def test_import_accepts_version_1_documents(self):
+        document = self.client.get(reverse('surveys-schema', kwargs={'pk': self.survey.id})).json()
+        document['version'] = 1
+        for rule in document['conditions'] + document['dependencies']:
+            rule.pop('id')
+        response = self.client.post(reverse('surveys-import-schema'), document, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Dependency.objects.filter(source_field__section__survey_id=response.data['id']).count(), 1)
+
+    def test_import_rejects_invalid_values(self):
+        def duplicate_section_order(document):
+            document['sections'][1]['order'] = document['sections'][0]['order']
+
+        def unknown_operator(document):
+            document['conditions'][0]['operator'] = 'rm -rf'
+
+        def long_label(document):
+            document['sections'][0]['fields'][0]['label'] = 'x' * 51
+
+        def negative_type(document):
+            document['sections'][0]['fields'][0]['type'] = -1
+
+        for change in (duplicate_section_order, unknown_operator, long_label, negative_type):
+            document = self.client.get(reverse('surveys-schema', kwargs={'pk': self.survey.id})).json()
+            change(document)
+            response = self.client.post(reverse('surveys-import-schema'), document, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, change.__name__)
+            self.assertIn('schema', response.data)
+        self.assertEqual(Survey.objects.count(), 1)
+
+
+class ScopedViewCacheTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='testpass')
+        self.admin.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.analyst = User.objects.create_user(username='analyst', password='testpass')
+        self.analyst.groups.add(Group.objects.get_or_create(name='Analyst')[0])
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.admin)
+        self.response = SurveyResponse.objects.create(survey=self.survey, user=self.admin,
+                                                      response_data={'sections': []})
+        self.list_url = reverse('survey_responses-list')
+        self.detail_url = reverse('survey_responses-detail', kwargs={'pk': self.response.id})
+
+    def test_cached_pages_are_served_per_role(self):
+        self.client.force_authenticate(user=self.admin)
+        self.client.get(self.detail_url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['survey'], self.survey.id)
+        self.assertFalse([query for query in queries if 'surveys_builder_surveyresponse' in query['sql']])
+
+        self.client.force_authenticate(user=self.analyst)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue([query for query in queries if 'surveys_builder_surveyresponse' in query['sql']])
+
+    def test_cached_pages_are_invalidated_on_change(self):
+        self.client.force_authenticate(user=self.admin)
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        SurveyResponse.objects.create(survey=self.survey, user=self.analyst, response_data={'sections': []})
+        self.response.response_data = {'sections': [{'id': 1, 'fields': []}]}
+        self.response.save()
+
+        self.assertEqual(len(self.client.get(self.list_url).data['results']), 2)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['response_data'], {'sections': [{'id': 1, 'fields': []}]})
+
+    def test_audit_logs_are_invalidated_on_write(self):
+        self.client.force_authenticate(user=self.admin)
+        url = reverse('audit_logs-list')
+        count = len(self.client.get(url).data['results'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Section.objects.create(survey=self.survey, title="Section 1", created_by=self.admin)
+        self.assertEqual(len(self.client.get(url).data['results']), count + 1)
+
+
+class CursorPaginationTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.surveys = [Survey.objects.create(title=f"Survey {index}", created_by=self.user) for index in range(5)]
+
+    def test_list_pages_follow_cursor(self):
+        response = self.client.get(reverse('surveys-list'), {'page_size': 2})
+        titles = [survey['title'] for survey in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            titles.extend(survey['title'] for survey in response.data['results'])
+        self.assertEqual(titles, [survey.title for survey in reversed(self.surveys)])
+
+
+class StatelessAuthenticationTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.admin_group = Group.objects.get_or_create(name='Admin')[0]
+        self.user.groups.add(self.admin_group)
+        Survey.objects.create(title="Survey 1", created_by=self.user)
+        tokens = self.client.post(reverse('token_obtain_pair'), {'username': 'testuser', 'password': 'testpass'}).data
+        self.access, self.refresh = tokens['access'], tokens['refresh']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def test_safe_requests_skip_auth_queries(self):
+        self.client.get(reverse('surveys-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('surveys-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'auth_' in query['sql']])
+
+    def test_revoked_tokens_are_refused(self):
+        response = self.client.post(reverse('token_revoke'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('surveys-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('token_refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stale_role_claims_are_not_trusted(self):
+        self.user.groups.remove(self.admin_group)
+        self.assertEqual(self.client.get(reverse('surveys-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SurveyAnalyticsViewTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Analyst')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Choice", widget="radio", created_by=self.user)
+        self.color = Field.objects.create(section=section, field_type=field_type, label="Color", required=True)
+        self.red = Option.objects.create(field=self.color, value="Red", order=0)
+        self.blue = Option.objects.create(field=self.color, value="Blue", order=1)
+        self.age = Field.objects.create(section=section, field_type=field_type, label="Age", order=1)
+        self.url = reverse('surveys-analytics', kwargs={'pk': self.survey.id})
+
+    def respond(self, username, values):
+        return SurveyResponse.objects.create(
+            survey=self.survey,
+            user=User.objects.create(username=username),
+            response_data={'sections': [{'fields': [{'id': key, 'value': value} for key, value in values.items()]}]}
+        )
+
+    def test_analytics_follow_response_changes(self):
+        self.respond('first', {self.color.id: "Red", self.age.id: 20})
+        second = self.respond('second', {self.color.id: "Blue", self.age.id: 40})
+        self.respond('third', {self.age.id: 60})
+        second.response_data = {'sections': [{'fields': [{'id': self.color.id, 'value': "Red"}]}]}
+        second.save()
+        SurveyResponse.objects.get(user__username='third').delete()
+
+        data = self.client.get(self.url).data
+        self.assertEqual((data['responses'], data['completed'], data['completion_rate']), (2, 2, 1))
+        color, age = data['fields']
+        self.assertEqual([option['count'] for option in color['options']], [2, 0])
+        self.assertEqual(age['answered'], 1)
+        self.assertEqual((age['numeric']['min'], age['numeric']['max'], age['numeric']['average']), (20, 20, 20))
+
+        call_command('recompute_rollups', survey=self.survey.id, stdout=StringIO())
+        self.assertEqual(self.client.get(self.url).data, data)
+
+    def test_analytics_are_rendered_with_the_json_renderer(self):
+        self.respond('first', {self.color.id: "Red", self.age.id: 1e16})
+        data = self.client.get(self.url)
+        self.assertEqual(type(data.accepted_renderer).__name__, 'JSONRenderer')
+        self.assertIn(b'1e+16', data.content)
+        surveys = self.client.get(reverse('surveys-list'))
+        self.assertEqual(type(surveys.accepted_renderer).__name__, 'ORJSONRenderer')
+
+    def test_analytics_reads_do_not_scan_responses(self):
+        for index in range(5):
+            self.respond(f'user{index}', {self.color.id: "Blue", self.age.id: index})
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url).data
+        self.assertEqual(data['fields'][1]['numeric']['count'], 5)
+        self.assertFalse([query for query in queries if 'surveys_builder_surveyresponse' in query['sql']])
+
+    def test_responses_stored_before_rollups_are_counted(self):
+        first = self.respond('first', {self.color.id: "Red", self.age.id: 20})
+        self.respond('second', {self.color.id: "Blue", self.age.id: 40})
+        for model in (SurveyRollup, FieldRollup, OptionRollup):
+            model.objects.all().delete()
+
+        data = self.client.get(self.url).data
+        self.assertEqual((data['responses'], data['completed']), (2, 2))
+        SurveyRollup.objects.all().delete()
+        first.delete()
+        data = self.client.get(self.url).data
+        self.assertEqual(data['responses'], 1)
+        self.assertEqual([option['count'] for option in data['fields'][0]['options']], [0, 1])
+
+    def test_counters_do_not_go_below_zero(self):
+        response = self.respond('first', {self.color.id: "Red", self.age.id: 20})
+        SurveyRollup.objects.update(responses=0, completed=0)
+        OptionRollup.objects.update(count=0)
+        response.delete()
+        self.assertEqual(SurveyRollup.objects.values_list('responses', 'completed').get(), (0, 0))
+        self.assertEqual(OptionRollup.objects.get(option=self.red).count, 0)
+
+
+class BulkSubmissionViewTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Choice", widget="radio", created_by=self.user)
+        self.color = Field.objects.create(section=section, field_type=field_type, label="Color", required=True)
+        Option.objects.create(field=self.color, value="Red", order=0)
+        Option.objects.create(field=self.color, value="Blue", order=1)
+        self.url = reverse('survey_responses-bulk')
+
+    def item(self, user, value):
+        return {
+            'survey': self.survey.id,
+            'user': user.id,
+            'response_data': {'sections': [{'fields': [{'id': self.color.id, 'value': value}]}]}
+        }
+
+    def test_bulk_submission_returns_per_item_results(self):
+        existing = User.objects.create(username='existing')
+        SurveyResponse.objects.create(survey=self.survey, user=existing, response_data=self.item(existing, "Red")['response_data'])
+        new = User.objects.create(username='new')
+        items = [self.item(existing, "Blue"), self.item(new, "Red"), {'survey': 0, 'response_data': {}}, self.item(self.user, "Red")]
+        items[3]['response_data']['sections'][0]['fields'][0]['id'] = 0
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], ['updated', 'created', 'error', 'error'])
+        self.assertEqual(results[0]['id'], SurveyResponse.objects.get(user=existing).id)
+        self.assertEqual(SurveyResponse.objects.get(user=existing).response_data, items[0]['response_data'])
+        self.assertEqual(SurveyResponse.objects.filter(survey=self.survey).count(), 2)
+        analytics = self.client.get(reverse('surveys-analytics', kwargs={'pk': self.survey.id})).data
+        self.assertEqual([option['count'] for option in analytics['fields'][0]['options']], [1, 1])
+
+    def test_bulk_submission_query_count_does_not_grow_with_items(self):
+        users = User.objects.bulk_create([User(username=f'user{index}') for index in range(50)])
+        self.client.post(self.url, [self.item(users[0], "Red")], format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, [self.item(user, "Blue") for user in users], format='json')
+        self.assertEqual(len(response.data['results']), 50)
+        self.assertLess(len(queries), 40)
+
+    def test_bulk_submission_rejects_malformed_ids(self):
+        items = [{**self.item(self.user, "Red"), 'survey': [self.survey.id]}, {**self.item(self.user, "Red"), 'user': {}}]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']], ['error', 'error'])
+
+    def test_bulk_submission_rejects_oversized_batches(self):
+        with self.settings(BULK_SUBMISSION_MAX_ITEMS=1):
+            response = self.client.post(self.url, [self.item(self.user, "Red")] * 2, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(SUBMISSION_MODE='queued')
+class QueuedSubmissionViewTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Text", widget="text", created_by=self.user)
+        self.field = Field.objects.create(section=section, field_type=field_type, label="Name")
+        self.url = reverse('survey_responses-list')
+
+    def submit(self, user, value):
+        return self.client.post(self.url, {
+            'survey': self.survey.id,
+            'user': user.id,
+            'response_data': {'sections': [{'fields': [{'id': self.field.id, 'value': value}]}]}
+        }, format='json')
+
+    def status_of(self, receipt):
+        return self.client.get(reverse('survey_responses-receipt', kwargs={'receipt': receipt}))
+
+    def test_submissions_are_acknowledged_then_persisted_in_batch(self):
+        other = User.objects.create(username='other')
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async') as apply_async:
+            with CaptureQueriesContext(connection) as queries:
+                first = self.submit(self.user, "Ann")
+            second = self.submit(other, "Bob")
+            third = self.submit(self.user, "Anna")
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse([query for query in queries if 'surveys_builder_surveyresponse' in query['sql']])
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(self.status_of(first.data['receipt']).data['status'], 'queued')
+        self.assertFalse(SurveyResponse.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ingest_queued_submissions(), 3)
+
+        statuses = [self.status_of(response.data['receipt']).data for response in (first, second, third)]
+        self.assertEqual([submission['status'] for submission in statuses], ['error', 'created', 'created'])
+        response = SurveyResponse.objects.get(user=self.user)
+        self.assertEqual(statuses[2]['id'], response.id)
+        self.assertEqual(response.response_data['sections'][0]['fields'][0]['value'], "Anna")
+        self.assertEqual(ingest_queued_submissions(), 0)
+
+    def test_invalid_submissions_are_rejected_before_queueing(self):
+        response = self.client.post(self.url, {'survey': self.survey.id, 'response_data': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.status_of('abc').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_queue_slots_are_skipped_after_the_grace_period(self):
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async'):
+            first = self.submit(self.user, "Ann")
+        cache.delete(SUBMISSION_QUEUE_SLOT_KEY.format(position=1))
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async'):
+            second = self.submit(User.objects.create(username='other'), "Bob")
+        self.assertEqual(ingest_queued_submissions(), 0)
+        self.assertEqual(ingest_queued_submissions(), 0)
+        self.assertEqual(self.status_of(first.data['receipt']).data['status'], 'queued')
+        with self.settings(SUBMISSION_QUEUE_GAP_GRACE=0):
+            self.assertEqual(ingest_queued_submissions(), 1)
+        lost = self.status_of(first.data['receipt']).data
+        self.assertEqual(lost['status'], 'error')
+        self.assertTrue(lost['errors'])
+        self.assertEqual(self.status_of(second.data['receipt']).data['status'], 'created')
+
+    def test_every_expired_slot_is_skipped_in_one_pass(self):
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async'):
+            first = self.submit(self.user, "Ann")
+            second = self.submit(User.objects.create(username='other'), "Bob")
+            third = self.submit(User.objects.create(username='third'), "Cy")
+        cache.delete_many([SUBMISSION_QUEUE_SLOT_KEY.format(position=position) for position in (1, 2)])
+        self.assertEqual(ingest_queued_submissions(), 0)
+        with self.settings(SUBMISSION_QUEUE_GAP_GRACE=0):
+            self.assertEqual(ingest_queued_submissions(), 1)
+        self.assertEqual(
+            [self.status_of(response.data['receipt']).data['status'] for response in (first, second, third)],
+            ['error', 'error', 'created']
+        )
+
+    def test_failing_submissions_do_not_stall_the_queue(self):
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async'):
+            broken = self.submit(self.user, "Ann")
+            valid = self.submit(User.objects.create(username='other'), "Bob")
+        save_submissions = ingestion.save_submissions
+
+        def save_or_fail(items, submitted_by):
+            if any(item['user'] == self.user.id for item in items):
+                raise IntegrityError("created_by_id")
+            return save_submissions(items, submitted_by)
+
+        with mock.patch('surveys_builder.utils.ingestion.save_submissions', side_effect=save_or_fail), \
+                self.assertLogs('surveys_builder.utils.ingestion', 'ERROR'):
+            self.assertEqual(ingest_queued_submissions(), 2)
+        failed = self.status_of(broken.data['receipt']).data
+        self.assertEqual((failed['status'], len(failed['errors'])), ('error', 1))
+        self.assertEqual(self.status_of(valid.data['receipt']).data['status'], 'created')
+        self.assertEqual(ingest_queued_submissions(), 0)
+
+    def test_late_producers_do_not_write_abandoned_slots(self):
+        cache.set(SUBMISSION_QUEUE_SLOT_KEY.format(position=1), ABANDONED_SLOT)
+        with mock.patch('surveys_builder.tasks.ingest_submissions.apply_async'):
+            receipt = self.submit(self.user, "Ann").data['receipt']
+        self.assertEqual(cache.get(SUBMISSION_QUEUE_SLOT_KEY.format(position=2)), receipt)
+        with self.settings(SUBMISSION_QUEUE_GAP_GRACE=0):
+            ingest_queued_submissions()
+            ingest_queued_submissions()
+        self.assertEqual(self.status_of(receipt).data['status'], 'created')
+
+
+class IdempotentSubmissionTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Text", widget="text", created_by=self.user)
+        self.field = Field.objects.create(section=section, field_type=field_type, label="Name")
+        self.url = reverse('survey_responses-list')
+
+    def payload(self, value):
+        return {
+            'survey': self.survey.id,
+            'user': self.user.id,
+            'response_data': {'sections': [{'fields': [{'id': self.field.id, 'value': value}]}]}
+        }
+
+    def test_duplicate_submissions_update_the_existing_response(self):
+        first = self.client.post(self.url, self.payload("Ann"), format='json')
+        second = self.client.post(self.url, self.payload("Anna"), format='json')
+        self.assertEqual((first.status_code, second.status_code), (status.HTTP_201_CREATED, status.HTTP_201_CREATED))
+        response = SurveyResponse.objects.get(survey=self.survey, user=self.user)
+        self.assertEqual(response.response_data['sections'][0]['fields'][0]['value'], "Anna")
+        self.assertEqual(response.updated_by, self.user)
+
+    def test_reserved_field_keys_are_rejected(self):
+        payload = self.payload("Ann")
+        payload['response_data']['sections'][0]['fields'][0]['encrypted'] = True
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(SurveyResponse.objects.exists())
+
+    def test_retries_with_an_idempotency_key_are_replayed(self):
+        first = self.client.post(self.url, self.payload("Ann"), format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.client.post(self.url, self.payload("Ann"), format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertFalse([query for query in queries if 'surveys_builder_surveyresponse' in query['sql']])
+
+        reused = self.client.post(self.url, self.payload("Bob"), format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        other = self.client.post(self.url, self.payload("Bob"), format='json', HTTP_IDEMPOTENCY_KEY='def')
+        self.assertNotIn('Idempotent-Replayed', other)
+
+
+class ListQueryCountTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        self.field_type = FieldType.objects.create(name="Choice", widget="radio", created_by=self.user)
+        self.add_section()
+
+    def add_section(self):
+        section = Section.objects.create(
+            survey=self.survey, title="Section", order=Section.objects.count(), created_by=self.user
+        )
+        for order in range(2):
+            field = Field.objects.create(section=section, field_type=self.field_type, label="Field", order=order)
+            Option.objects.create(field=field, value="Yes", order=0)
+            Option.objects.create(field=field, value="No", order=1)
+            condition = Condition.objects.create(source_field=field, operator='equals', value="Yes")
+            ConditionDependency.objects.create(condition=condition, affected_field=field)
+            Dependency.objects.create(source_field=field, target_field=field, dependency_type='required')
+
+    def assertQueryCountIndependentOfRows(self, url):
+        with CaptureQueriesContext(connection) as before:
+            first = self.client.get(url)
+        for _ in range(3):
+            self.add_section()
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            second = self.client.get(url)
+        self.assertGreater(len(second.data['results']), len(first.data['results']))
+        self.assertEqual(len(after), len(before))
+
+    def test_section_list_query_count(self):
+        self.assertQueryCountIndependentOfRows(reverse('sections-list'))
+
+    def test_field_list_query_count(self):
+        self.assertQueryCountIndependentOfRows(reverse('fields-list'))
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        self.section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Choice", widget="radio", created_by=self.user)
+        self.field = Field.objects.create(section=self.section, field_type=field_type, label="Color")
+        Option.objects.create(field=self.field, value="Red", order=0)
+        SurveyResponse.objects.create(survey=self.survey, user=self.user, response_data={'sections': []})
+
+    def test_survey_list_only_queries_selected_relations(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('surveys-list'), {'fields': 'id,title'})
+        self.assertEqual(response.data['results'], [{'id': self.survey.id, 'title': "Survey 1"}])
+        self.assertFalse([query for query in queries if 'surveys_builder_section' in query['sql']])
+
+    def test_relations_that_are_not_expanded_are_ids(self):
+        response = self.client.get(reverse('surveys-detail', kwargs={'pk': self.survey.id}), {'expand': 'sections'})
+        self.assertEqual(response.data['sections'][0]['fields'], [self.field.id])
+
+        response = self.client.get(reverse('fields-detail', kwargs={'pk': self.field.id}), {
+            'fields': 'label,options.value,field_type', 'expand': 'options'
+        })
+        self.assertEqual(response.data, {'field_type': self.field.field_type_id, 'options': [{'value': "Red"}], 'label': "Color"})
+
+    def test_serializer_viewsets_prune_fields(self):
+        response = self.client.get(reverse('survey_responses-list'), {'fields': 'survey,user'})
+        self.assertEqual(response.data['results'], [{'survey': self.survey.id, 'user': self.user.id}])
+        AuditLog.objects.create(user=self.user, survey=self.survey, action='create')
+        response = self.client.get(reverse('audit_logs-list'), {'fields': 'action'})
+        self.assertEqual(response.data['results'], [{'action': 'create'}])
+
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Text", widget="text", created_by=self.user)
+        self.field = Field.objects.create(section=section, field_type=field_type, label="Name")
+
+    def test_unchanged_surveys_are_not_rebuilt(self):
+        url = reverse('surveys-detail', kwargs={'pk': self.survey.id})
+        response = self.client.get(url)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], etag)
+        # Only the existence check of the survey
+        self.assertEqual(len([query for query in queries if 'surveys_builder_' in query['sql']]), 1)
+
+        self.field.label = "Full name"
+        self.field.save()
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(modified['ETag'], etag)
+        self.assertEqual(modified.data['sections'][0]['fields'][0]['label'], "Full name")
+
+    def test_section_and_field_endpoints_answer_conditional_reads(self):
+        for url in (reverse('sections-list'), reverse('fields-list'), reverse('fields-detail', kwargs={'pk': self.field.id})):
+            response = self.client.get(url)
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            other_fields = self.client.get(url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(other_fields.status_code, status.HTTP_200_OK)
+        detail_url = reverse('fields-detail', kwargs={'pk': self.field.id})
+        response = self.client.get(detail_url)
+        self.assertEqual(
+            self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+    def test_lists_do_not_answer_if_modified_since(self):
+        other = Survey.objects.create(title="Survey 2", created_by=self.user)
+        response = self.client.get(reverse('surveys-list'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.client.delete(reverse('surveys-detail', kwargs={'pk': other.id}))
+        after_delete = self.client.get(
+            reverse('surveys-list'),
+            HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT',
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(after_delete.status_code, status.HTTP_200_OK)
+        self.assertEqual([survey['id'] for survey in after_delete.data['results']], [self.survey.id])
+
+    def test_missing_surveys_are_not_matched(self):
+        response = self.client.get(reverse('surveys-detail', kwargs={'pk': 987654}), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseFormatTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.user.groups.add(Group.objects.get_or_create(name='Admin')[0])
+        self.client.force_authenticate(user=self.user)
+        self.survey = Survey.objects.create(title="Survey 1", description="x" * 2000, created_by=self.user)
+        section = Section.objects.create(survey=self.survey, title="Section 1", created_by=self.user)
+        field_type = FieldType.objects.create(name="Text", widget="text", created_by=self.user)
+        self.field = Field.objects.create(section=section, field_type=field_type, label="Name")
+
+    def test_msgpack_round_trip(self):
+        items = [{
+            'survey': self.survey.id,
+            'user': self.user.id,
+            'response_data': {'sections': [{'fields': [{'id': self.field.id, 'value': "Ada"}]}]}
+        }]
+        response = self.client.post(
+            reverse('survey_responses-bulk'),
+            msgpack.packb(items),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'][0]['status'], 'created')
+
+        surveys = self.client.get(reverse('surveys-list'), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(msgpack.unpackb(surveys.content)['results'][0]['title'], "Survey 1")
+
+    def test_large_responses_are_compressed(self):
+        url = reverse('surveys-detail', kwargs={'pk': self.survey.id})
+        plain = self.client.get(url, format='json')
+        self.assertEqual(plain['Vary'].count('Accept-Encoding'), 1)
+
+        compressed = self.client.get(url, format='json', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(compressed['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(compressed.content), plain.content)
+        self.assertEqual(compressed['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(
+            self.client.get(url, HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH=compressed['ETag']).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+        gzipped = self.client.get(url, format='json', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+
+    def test_responses_that_may_carry_secrets_are_not_brotli_compressed(self):
+        url = reverse('surveys-detail', kwargs={'pk': self.survey.id})
+        html = self.client.get(url, HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(html['Content-Encoding'], 'gzip')
+        write = self.client.put(url, {'title': "Survey 1", 'description': "x" * 2000}, format='json',
+                                HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(write['Content-Encoding'], 'gzip')
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('fields-detail', kwargs={'pk': self.field.id}), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('Content-Encoding'))
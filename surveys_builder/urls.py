@@ -11,7 +11,9 @@ from surveys_builder.views import (
     AuditLogViewSet,
     GenerateReportView,
     ExportSurveyResponsesView,
-    SendSurveyInvitationsView
+    ExportSurveyResponsesStatusView,
+    SendSurveyInvitationsView,
+    RevokeTokenView
 )
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -34,6 +36,7 @@ router.register(r'surveys', SurveyViewSet, basename = 'surveys')
 router.register(r'survey-responses', SurveyResponseViewSet, basename = 'survey_responses')
 router.register(r'sections', SectionViewSet, basename = 'sections')
 router.register(r'fields', FieldViewSet, basename = 'fields')
+router.register(r'audit-logs', AuditLogViewSet, basename = 'audit_logs')
 urlpatterns = [
     # API Resources
     path('', include(router.urls)),
@@ -41,6 +44,7 @@ urlpatterns = [
     # AUTHENTICATION
     path('token/', TokenObtainPairView.as_view(), name = 'token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name = 'token_refresh'),
+    path('token/revoke/', RevokeTokenView.as_view(), name = 'token_revoke'),
 
     # SWAGGER
     path('swagger<format>/', schema_view.without_ui(cache_timeout = 0), name = 'schema-json'),
@@ -49,6 +53,11 @@ urlpatterns = [
 
     # Celery Task API Resources
     path('surveys/responses/export/', ExportSurveyResponsesView.as_view(), name = 'export_survey_responses'),
+    path(
+        'surveys/responses/export/<str:task_id>/',
+        ExportSurveyResponsesStatusView.as_view(),
+        name = 'export_survey_responses_status'
+    ),
     path('surveys/invitations/send/', SendSurveyInvitationsView.as_view(), name = 'send_survey_invitations'),
     path('audit-logs/reports/generate/', GenerateReportView.as_view(), name = 'generate_report'),
 ]
@@ -0,0 +1,177 @@
+import numpy as np
+
+from django.conf import settings
+from surveys_builder.models import (
+    Answer,
+    SurveyResponse
+)
+from surveys_builder.utils.answers import get_survey_options
+from surveys_builder.utils.schema import get_survey_schema
+
+
+class SurveyAnswerMatrix:
+    """
+    Columnar answers of a survey, one row per response.
+
+    Choice fields are int32 arrays of option codes (the position of the option
+    in the field, -1 when unanswered) and every field with numeric answers is a
+    float64 array (NaN when unanswered). When a field has several answers in a
+    response the last one is kept.
+    """
+
+    def __init__(self, response_ids: np.ndarray, categories: dict):
+        self.response_ids = response_ids
+        self.categories = categories
+        self.codes = {field_id: np.full(len(response_ids), -1, dtype = np.int32) for field_id in categories}
+        self.numeric = {}
+
+    def __len__(self):
+        return len(self.response_ids)
+
+    def numeric_column(self, field_id: int) -> np.ndarray:
+        if field_id not in self.numeric:
+            self.numeric[field_id] = np.full(len(self.response_ids), np.nan)
+        return self.numeric[field_id]
+
+
+def load_survey_answers(survey_id: int, chunk_size: int = None) -> SurveyAnswerMatrix:
+    """
+    Load the answers of a survey into a SurveyAnswerMatrix, reading the Answer
+    table chunk by chunk so only one chunk of rows is materialized at a time
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    response_ids = np.fromiter(
+        SurveyResponse.objects.filter(survey_id = survey_id).order_by('id').values_list('id', flat = True).iterator(
+            chunk_size = chunk_size
+        ),
+        dtype = np.int64
+    )
+    option_ids = get_survey_options(survey_id)
+    categories = {}
+    option_codes = {}
+    for section in get_survey_schema(survey_id)['sections']:
+        for field in section['fields']:
+            if field['options']:
+                categories[field['id']] = [value for value, _ in field['options']]
+            for code, (value, _) in enumerate(field['options']):
+                if (field['id'], value) in option_ids:
+                    option_codes[option_ids[(field['id'], value)]] = code
+    matrix = SurveyAnswerMatrix(response_ids, categories)
+    if not len(response_ids):
+        return matrix
+
+    queryset = Answer.objects.filter(response__survey_id = survey_id).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(
+            queryset.filter(id__gt = last_id).values_list(
+                'id', 'response_id', 'field_id', 'option_id', 'numeric_value'
+            )[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        _, answer_response_ids, field_ids, options, numeric_values = zip(*chunk)
+        answer_response_ids = np.array(answer_response_ids, dtype = np.int64)
+        rows = np.minimum(np.searchsorted(response_ids, answer_response_ids), len(response_ids) - 1)
+        # Answers of responses created after the response ids were read are left out
+        known = response_ids[rows] == answer_response_ids
+        field_ids = np.where(known, np.array(field_ids, dtype = np.int64), -1)
+        codes = np.array([option_codes.get(option_id, -1) for option_id in options], dtype = np.int32)
+        numeric_values = np.array([np.nan if value is None else value for value in numeric_values])
+
+        for field_id in np.unique(field_ids[known]):
+            in_field = field_ids == field_id
+            field_id = int(field_id)
+            if field_id in matrix.codes:
+                has_code = in_field & (codes >= 0)
+                matrix.codes[field_id][rows[has_code]] = codes[has_code]
+            has_number = in_field & ~np.isnan(numeric_values)
+            if has_number.any():
+                matrix.numeric_column(field_id)[rows[has_number]] = numeric_values[has_number]
+        if len(chunk) < chunk_size:
+            break
+    return matrix
+
+
+def crosstab(matrix: SurveyAnswerMatrix, row_field_id: int, column_field_id: int) -> np.ndarray:
+    """
+    Count the responses per pair of options of two choice fields
+    """
+    rows = matrix.codes[row_field_id]
+    columns = matrix.codes[column_field_id]
+    row_count = len(matrix.categories[row_field_id])
+    column_count = len(matrix.categories[column_field_id])
+    answered = (rows >= 0) & (columns >= 0)
+    return np.bincount(
+        rows[answered].astype(np.int64) * column_count + columns[answered],
+        minlength = row_count * column_count
+    ).reshape(row_count, column_count)
+
+
+def percentiles(matrix: SurveyAnswerMatrix, field_id: int, q = (25, 50, 75)) -> np.ndarray:
+    """
+    Get percentiles of the numeric answers of a field
+    """
+    values = matrix.numeric.get(field_id)
+    if values is None or np.isnan(values).all():
+        return np.full(len(q), np.nan)
+    return np.nanpercentile(values, q)
+
+
+def correlation(matrix: SurveyAnswerMatrix, field_ids: list) -> np.ndarray:
+    """
+    Get the Pearson correlation matrix of numeric fields over the responses that answered all of them
+    """
+    columns = np.vstack([matrix.numeric.get(field_id, np.full(len(matrix), np.nan)) for field_id in field_ids])
+    complete = ~np.isnan(columns).any(axis = 0)
+    if complete.sum() < 2:
+        return np.full((len(field_ids), len(field_ids)), np.nan)
+    return np.corrcoef(columns[:, complete])
+
+
+def analyze_survey_answers(survey_id: int, crosstabs: list = None, numeric_field_ids: list = None) -> dict:
+    """
+    Run the crosstabs, percentiles and correlations of a survey and return them as plain
+    lists, or the errors when a crosstab names a field that is not a choice field of the survey
+    """
+    matrix = load_survey_answers(survey_id)
+    errors = []
+    for pair in crosstabs or []:
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+            errors.append(f"Crosstab {pair} must be a pair of field ids.")
+            continue
+        errors.extend(
+            f"Field {field_id} is not a choice field of survey {survey_id}."
+            for field_id in pair
+            if not isinstance(field_id, int) or field_id not in matrix.codes
+        )
+    if errors:
+        return {'survey': survey_id, 'errors': errors}
+    if numeric_field_ids is None:
+        numeric_field_ids = sorted(matrix.numeric)
+
+    def as_list(array: np.ndarray) -> list:
+        return np.where(np.isnan(array), None, array).tolist() if array.dtype.kind == 'f' else array.tolist()
+
+    return {
+        'survey': survey_id,
+        'responses': len(matrix),
+        'crosstabs': [
+            {
+                'rows': row_field_id,
+                'columns': column_field_id,
+                'row_values': matrix.categories[row_field_id],
+                'column_values': matrix.categories[column_field_id],
+                'counts': as_list(crosstab(matrix, row_field_id, column_field_id)),
+            }
+            for row_field_id, column_field_id in (crosstabs or [])
+        ],
+        'percentiles': {
+            field_id: as_list(percentiles(matrix, field_id)) for field_id in numeric_field_ids
+        },
+        'correlation': {
+            'fields': numeric_field_ids,
+            'matrix': as_list(correlation(matrix, numeric_field_ids)) if numeric_field_ids else [],
+        },
+    }
@@ -0,0 +1,152 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, FloatField, Max, Min, StdDev
+from django.db.models.functions import Cast, Floor, Least
+from surveys_builder.utils.cache import get_survey_revision
+
+SURVEY_OPTIONS_KEY = 'survey_options:{survey_id}:{revision}'
+
+
+def _answer_values(value):
+    """
+    Split an answer value into (numeric value, text value) pairs, list answers
+    give one pair per item
+    """
+    if isinstance(value, list):
+        for item in value:
+            yield from _answer_values(item)
+    elif value is None:
+        return
+    elif isinstance(value, bool):
+        yield float(value), str(value).lower()
+    elif isinstance(value, (int, float)):
+        yield float(value), None
+    elif isinstance(value, str):
+        try:
+            numeric_value = float(value)
+        except ValueError:
+            numeric_value = None
+        yield numeric_value, value
+    else:
+        yield None, json.dumps(value)
+
+
+def get_survey_options(survey_id: int) -> dict:
+    """
+    Get the option ids of a survey keyed by (field id, option value), cached per survey revision
+    """
+    from surveys_builder.models import Option
+
+    revision = get_survey_revision(survey_id)
+    key = SURVEY_OPTIONS_KEY.format(survey_id = survey_id, revision = revision)
+    options = cache.get(key)
+    if options is None:
+        options = {
+            (field_id, value): option_id
+            for option_id, field_id, value in Option.objects.filter(
+                field__section__survey_id = survey_id
+            ).values_list('id', 'field_id', 'value')
+        }
+        cache.set(key, options, timeout = settings.SURVEY_SCHEMA_CACHE_TIMEOUT)
+    return options
+
+
+def build_answers(survey_id: int, responses: list) -> list:
+    """
+    Build the Answer rows of (response id, plain response data) pairs of a survey,
+    answers to fields outside the survey and to sensitive fields are not copied
+    """
+    from surveys_builder.models import Answer
+    from surveys_builder.utils.schema import get_survey_schema
+
+    field_ids = {
+        field['id']
+        for section in get_survey_schema(survey_id)['sections']
+        for field in section['fields']
+        if not field['sensitive']
+    }
+    options = get_survey_options(survey_id)
+
+    answers = []
+    for response_id, response_data in responses:
+        for section in response_data.get('sections', []):
+            for field in section.get('fields', []):
+                if field.get('id') not in field_ids:
+                    continue
+                for numeric_value, text_value in _answer_values(field.get('value')):
+                    answers.append(
+                        Answer(
+                            response_id = response_id,
+                            field_id = field['id'],
+                            option_id = options.get((field['id'], text_value)),
+                            numeric_value = numeric_value,
+                            text_value = text_value
+                        )
+                    )
+    return answers
+
+
+def sync_response_answers(survey_id: int, responses: list) -> list:
+    """
+    Replace the Answer rows of (response id, plain response data) pairs of a survey
+    """
+    from surveys_builder.models import Answer
+
+    Answer.objects.filter(response_id__in = [response_id for response_id, _ in responses]).delete()
+    return Answer.objects.bulk_create(build_answers(survey_id, responses))
+
+
+def count_answers_per_option(field_id: int) -> dict:
+    """
+    Get the number of answers per option id of a field
+    """
+    from surveys_builder.models import Answer
+
+    return dict(
+        Answer.objects.filter(field_id = field_id, option__isnull = False).values('option_id').annotate(
+            count = Count('id')
+        ).order_by().values_list('option_id', 'count')
+    )
+
+
+def summarize_numeric_answers(field_id: int) -> dict:
+    """
+    Get the count, average, standard deviation and range of the numeric answers of a field
+    """
+    from surveys_builder.models import Answer
+
+    return Answer.objects.filter(field_id = field_id, numeric_value__isnull = False).aggregate(
+        count = Count('id'),
+        average = Avg('numeric_value'),
+        stddev = StdDev('numeric_value'),
+        minimum = Min('numeric_value'),
+        maximum = Max('numeric_value')
+    )
+
+
+def histogram_numeric_answers(field_id: int, bins: int = 10) -> list:
+    """
+    Get the number of numeric answers of a field in equal width bins, as
+    (lower bound, upper bound, count) tuples
+    """
+    from surveys_builder.models import Answer
+
+    queryset = Answer.objects.filter(field_id = field_id, numeric_value__isnull = False)
+    bounds = queryset.aggregate(minimum = Min('numeric_value'), maximum = Max('numeric_value'))
+    if bounds['minimum'] is None:
+        return []
+    width = (bounds['maximum'] - bounds['minimum']) / bins or 1
+    counts = dict(
+        queryset.annotate(
+            bin = Least(
+                Cast(Floor((Cast('numeric_value', FloatField()) - bounds['minimum']) / width), FloatField()),
+                float(bins - 1)
+            )
+        ).values('bin').annotate(count = Count('id')).order_by().values_list('bin', 'count')
+    )
+    return [
+        (bounds['minimum'] + index * width, bounds['minimum'] + (index + 1) * width, counts.get(float(index), 0))
+        for index in range(bins)
+    ]
@@ -0,0 +1,108 @@
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from surveys_builder.utils.cache import bump_view_cache
+from surveys_builder.utils.constants import AUDIT_LOGS_CACHE_NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+AUDIT_EVENT_REFERENCES = ('survey_id', 'section_id', 'field_id', 'survey_response_id')
+
+_state = threading.local()
+
+
+@contextmanager
+def audit_buffer():
+    """
+    Collect the audit events recorded in this scope and write them in one batch when it exits
+    """
+    buffer = getattr(_state, 'buffer', None)
+    if buffer is not None:
+        yield buffer
+        return
+    buffer = _state.buffer = []
+    try:
+        yield buffer
+    finally:
+        _state.buffer = None
+        write_audit_events(buffer)
+
+
+def record_audit_event(**event) -> None:
+    record_audit_events([event])
+
+
+def record_audit_events(events: list) -> None:
+    """
+    Record audit events once the current transaction commits, events are dicts of
+    AuditLog column values (user_id, survey_id, section_id, field_id, survey_response_id, action)
+    """
+    if events:
+        transaction.on_commit(partial(_commit_audit_events, getattr(_state, 'buffer', None), list(events)))
+
+
+def _commit_audit_events(buffer, events: list) -> None:
+    if buffer is not None and getattr(_state, 'buffer', None) is buffer:
+        buffer.extend(events)
+    else:
+        write_audit_events(events)
+
+
+def write_audit_events(events: list) -> None:
+    """
+    Persist audit events now, or hand them to a worker when AUDIT_LOG_MODE is celery
+    """
+    if not events:
+        return
+    if settings.AUDIT_LOG_MODE == 'celery':
+        from surveys_builder.tasks import persist_audit_events
+        persist_audit_events.delay(events)
+    else:
+        persist_audit_events_now(events)
+
+
+def persist_audit_events_now(events: list) -> None:
+    from surveys_builder.models import AuditLog
+
+    events = _drop_dangling_references(events)
+    AuditLog.objects.bulk_create(
+        [AuditLog(**event) for event in events],
+        batch_size = settings.AUDIT_LOG_BATCH_SIZE
+    )
+    if events:
+        bump_view_cache(AUDIT_LOGS_CACHE_NAMESPACE)
+
+
+def _drop_dangling_references(events: list) -> list:
+    """
+    Clear references to rows removed before the events were written, deleted
+    objects can no longer be referenced, and drop events without an actor
+    """
+    from surveys_builder.models import Survey, Section, Field, SurveyResponse
+
+    models = dict(zip(AUDIT_EVENT_REFERENCES, (Survey, Section, Field, SurveyResponse)))
+    existing = {}
+    for reference, model in models.items():
+        ids = {event[reference] for event in events if event.get(reference) and event['action'] == 'delete'}
+        if ids:
+            existing[reference] = set(model.objects.filter(pk__in = ids).values_list('pk', flat = True))
+
+    cleaned = []
+    for event in events:
+        if not event.get('user_id'):
+            logger.warning(f'Dropping audit event without a user: {event}')
+            continue
+        if event['action'] == 'delete':
+            event = {
+                **event,
+                **{
+                    reference: None for reference in existing
+                    if event.get(reference) and event[reference] not in existing[reference]
+                }
+            }
+        cleaned.append(event)
+    return cleaned
@@ -0,0 +1,70 @@
+import datetime
+import gzip
+import json
+import os
+import uuid
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from surveys_builder.models import (
+    AuditLog,
+    AuditLogDailyAggregate
+)
+from surveys_builder.utils.cache import bump_view_cache
+from surveys_builder.utils.constants import AUDIT_LOGS_CACHE_NAMESPACE
+from surveys_builder.utils.reports import refresh_audit_log_aggregates
+
+AUDIT_ARCHIVE_COLUMNS = (
+    'id', 'created_at', 'user_id', 'action', 'survey_id', 'section_id', 'field_id', 'survey_response_id'
+)
+
+
+def get_archive_path(handle: str) -> str:
+    return os.path.join(settings.AUDIT_ARCHIVE_ROOT, handle)
+
+
+def archive_audit_logs(cutoff: datetime.datetime = None, chunk_size: int = None) -> dict:
+    """
+    Move the audit logs older than the retention period to a gzipped JSONL archive,
+    rows are only deleted once the archive is complete and folded into the daily aggregates
+    """
+    chunk_size = chunk_size or settings.AUDIT_LOG_BATCH_SIZE
+    if cutoff is None:
+        cutoff = timezone.now() - datetime.timedelta(days = settings.AUDIT_LOG_RETENTION_DAYS)
+
+    refresh_audit_log_aggregates()
+    watermark = AuditLogDailyAggregate.objects.aggregate(watermark = Max('last_log_id'))['watermark'] or 0
+    queryset = AuditLog.objects.filter(created_at__lt = cutoff, id__lte = watermark)
+    bounds = queryset.aggregate(first_id = Min('id'), last_id = Max('id'))
+    if bounds['first_id'] is None:
+        return {'handle': None, 'rows': 0}
+    queryset = queryset.filter(id__lte = bounds['last_id'])
+
+    os.makedirs(settings.AUDIT_ARCHIVE_ROOT, exist_ok = True)
+    handle = f"audit_logs_{cutoff.strftime('%Y%m%d')}_{bounds['first_id']}_{bounds['last_id']}_" \
+             f"{uuid.uuid4().hex[:8]}.jsonl.gz"
+    path = get_archive_path(handle)
+    rows = 0
+    chunks = []
+    with gzip.open(f'{path}.part', 'wt') as archive:
+        last_id = bounds['first_id'] - 1
+        while True:
+            chunk = list(
+                queryset.filter(id__gt = last_id).order_by('id').values_list(*AUDIT_ARCHIVE_COLUMNS)[:chunk_size]
+            )
+            if not chunk:
+                break
+            for values in chunk:
+                row = dict(zip(AUDIT_ARCHIVE_COLUMNS, values))
+                row['created_at'] = row['created_at'].isoformat()
+                archive.write(json.dumps(row) + '\n')
+            rows += len(chunk)
+            chunks.append((chunk[0][0], chunk[-1][0]))
+            last_id = chunk[-1][0]
+    os.replace(f'{path}.part', path)
+
+    for first_id, last_id in chunks:
+        queryset.filter(id__gte = first_id, id__lte = last_id).delete()
+    bump_view_cache(AUDIT_LOGS_CACHE_NAMESPACE, everything = True)
+    return {'handle': handle, 'rows': rows}
@@ -0,0 +1,231 @@
+from django.db import DatabaseError, connection
+from django.db.models import Max, Q
+from rest_framework import serializers
+from surveys_builder.models import (
+    Field,
+    FieldType,
+    Option,
+    Section,
+    Condition,
+    ConditionDependency,
+    Dependency
+)
+from surveys_builder.utils.audit import record_audit_events
+from surveys_builder.utils.cache import bump_survey_revision
+
+
+def bulk_create_with_pks(model, objects: list, **lookup) -> list:
+    """
+    Bulk create objects and make sure their primary keys are set, backends that
+    cannot return rows from a bulk insert (MySQL) get them back from one extra
+    query, the lookup must match the parents the new rows were created under
+    """
+    if not objects:
+        return objects
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objects)
+    last_pk = model.objects.filter(**lookup).aggregate(last_pk = Max('pk'))['last_pk'] or 0
+    model.objects.bulk_create(objects)
+    pks = list(model.objects.filter(pk__gt = last_pk, **lookup).order_by('pk').values_list('pk', flat = True))
+    if len(pks) != len(objects):
+        # Rows inserted concurrently under the same parents make the recovered keys ambiguous
+        raise DatabaseError(f"Expected {len(objects)} new {model.__name__} rows, found {len(pks)}.")
+    for instance, pk in zip(objects, pks):
+        instance.pk = pk
+    return objects
+
+
+def resolve_field_types(field_types_data: list, user = None) -> dict:
+    """
+    Get or create the field types for a list of (name, widget) pairs in one lookup
+    """
+    pairs = {(data['name'], data['widget']) for data in field_types_data}
+    if not pairs:
+        return {}
+
+    lookup = Q()
+    for name, widget in pairs:
+        lookup |= Q(name = name, widget = widget)
+    field_types = {}
+    for field_type in FieldType.objects.filter(lookup).order_by('-id'):
+        field_types[(field_type.name, field_type.widget)] = field_type
+
+    missing = [
+        FieldType(name = name, widget = widget, created_by = user)
+        for name, widget in sorted(pairs - set(field_types))
+    ]
+    bulk_create_with_pks(FieldType, missing, name__in = [field_type.name for field_type in missing])
+    field_types.update({(field_type.name, field_type.widget): field_type for field_type in missing})
+    return field_types
+
+
+class SurveyTreeBuilder:
+    """
+    Create sections, fields, options, conditions and dependencies level by level
+    with one bulk insert per level.
+
+    Conditions and dependencies may reference fields and sections created by the
+    same builder through the `ref` given in their data, or existing rows through
+    model instances.
+    """
+
+    def __init__(self, user = None):
+        self.user = user
+        self.field_refs = {}
+        self.section_refs = {}
+        self.conditional_logic = []
+        self.dependencies = []
+        self.surveys = set()
+
+    def create_sections(self, survey, sections_data: list) -> list:
+        sections = [
+            Section(
+                survey = survey,
+                title = data.get('title'),
+                # Sections sent without an order take their position in the list
+                order = data['order'] if 'order' in data else index,
+                created_by = self.user
+            )
+            for index, data in enumerate(sections_data)
+        ]
+        bulk_create_with_pks(Section, sections, survey = survey)
+        self.surveys.add(survey.id)
+        record_audit_events(
+            [
+                {'user_id': self._user_id, 'section_id': section.id, 'survey_id': survey.id, 'action': 'create'}
+                for section in sections
+            ]
+        )
+
+        section_fields = []
+        for section, data in zip(sections, sections_data):
+            if 'ref' in data:
+                self.section_refs[data['ref']] = section
+            for logic in data.get('conditional_logic', []):
+                self.conditional_logic.append((logic, None, section))
+            section_fields.extend((section, field_data) for field_data in data.get('fields', []))
+        self.create_fields(section_fields)
+        return sections
+
+    def create_fields(self, section_fields: list) -> list:
+        field_types = resolve_field_types([data['field_type'] for _, data in section_fields], self.user)
+        positions = {}
+        fields = []
+        for section, data in section_fields:
+            position = positions[section] = positions.get(section, -1) + 1
+            field_type = field_types[(data['field_type']['name'], data['field_type']['widget'])]
+            fields.append(
+                Field(
+                    section = section,
+                    field_type = field_type,
+                    label = data.get('label'),
+                    order = data.get('order', position),
+                    required = data.get('required', False),
+                    is_sensitive = data.get('is_sensitive', False),
+                    created_by = self.user
+                )
+            )
+        bulk_create_with_pks(Field, fields, section__in = {section for section, _ in section_fields})
+        record_audit_events(
+            [
+                {
+                    'user_id': self._user_id,
+                    'field_id': field.id,
+                    'section_id': field.section_id,
+                    'survey_id': field.section.survey_id,
+                    'action': 'create'
+                }
+                for field in fields
+            ]
+        )
+        self.surveys.update(field.section.survey_id for field in fields)
+
+        options = []
+        for field, (_, data) in zip(fields, section_fields):
+            if 'ref' in data:
+                self.field_refs[data['ref']] = field
+            for index, option_data in enumerate(data.get('options', [])):
+                options.append(
+                    Option(
+                        field = field,
+                        value = option_data.get('value'),
+                        order = option_data.get('order', index),
+                        created_by = self.user
+                    )
+                )
+            for logic in data.get('conditional_logic', []):
+                self.conditional_logic.append((logic, field, None))
+            for dependency in data.get('dependencies', []):
+                self.dependencies.append((dependency, field))
+        Option.objects.bulk_create(options)
+        return fields
+
+    def create_rules(self) -> None:
+        """
+        Create the conditions and dependencies collected from the created tree
+        """
+        conditions = []
+        condition_dependencies = []
+        for logic, field, section in self.conditional_logic:
+            condition_data = logic['condition']
+            condition = Condition(
+                source_field_id = self._resolve(condition_data.get('source_field'), self.field_refs, 'field'),
+                operator = condition_data['operator'],
+                value = condition_data['value'],
+                created_by = self.user
+            )
+            conditions.append(condition)
+            affected_field = logic.get('affected_field')
+            affected_section = logic.get('affected_section')
+            if affected_field is None and affected_section is None:
+                affected_field, affected_section = field, section
+            condition_dependencies.append(
+                ConditionDependency(
+                    condition = condition,
+                    affected_field_id = self._resolve(affected_field, self.field_refs, 'field', required = False),
+                    affected_section_id = self._resolve(affected_section, self.section_refs, 'section',
+                                                        required = False),
+                    created_by = self.user
+                )
+            )
+        bulk_create_with_pks(
+            Condition,
+            conditions,
+            source_field_id__in = {condition.source_field_id for condition in conditions}
+        )
+        ConditionDependency.objects.bulk_create(condition_dependencies)
+
+        Dependency.objects.bulk_create(
+            [
+                Dependency(
+                    source_field = field,
+                    target_field_id = self._resolve(dependency['target_field'], self.field_refs, 'field'),
+                    dependency_type = dependency['dependency_type'],
+                    created_by = self.user
+                )
+                for dependency, field in self.dependencies
+            ]
+        )
+        self.conditional_logic = []
+        self.dependencies = []
+
+    def finish(self) -> None:
+        self.create_rules()
+        for survey_id in self.surveys:
+            bump_survey_revision(survey_id)
+
+    @property
+    def _user_id(self):
+        return self.user.id if self.user else None
+
+    @staticmethod
+    def _resolve(reference, refs: dict, kind: str, required: bool = True):
+        if reference is None:
+            if required:
+                raise serializers.ValidationError(f"A {kind} reference is required.")
+            return None
+        if hasattr(reference, 'pk'):
+            return reference.pk
+        if reference in refs:
+            return refs[reference].pk
+        raise serializers.ValidationError(f"Unknown {kind} reference {reference}.")
@@ -0,0 +1,156 @@
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+from surveys_builder.utils.roles import get_request_roles
+
+SURVEY_REVISION_KEY = 'survey_revision:{survey_id}'
+SURVEY_MODIFIED_KEY = 'survey_modified:{survey_id}'
+VIEW_CACHE_VERSION_KEY = 'view_cache_version:{namespace}:{scope}'
+VIEW_CACHE_KEY = 'view_cache:{namespace}:{versions}:{scope}:{params}'
+# Counters are seeded from the clock so letting them expire only invalidates what was cached under them,
+# and lookups of ids that do not exist do not leave keys behind forever
+COUNTER_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _initial_revision() -> int:
+    """
+    Seed a revision counter from the clock so a counter that was evicted
+    never restarts at a value an older process may still hold
+    """
+    return int(time.time() * 1000)
+
+
+def _get_counters(keys: list) -> dict:
+    counters = cache.get_many(keys)
+    missing = [key for key in keys if key not in counters]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_revision(), timeout = COUNTER_TIMEOUT)
+        counters.update(cache.get_many(missing))
+    return counters
+
+
+def _increment_counter(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_revision(), timeout = COUNTER_TIMEOUT)
+
+
+def _bump_counter(key: str) -> None:
+    _increment_counter(key)
+    # Readers may rebuild from the pre-commit rows until the change commits, bump again once it does
+    transaction.on_commit(partial(_increment_counter, key))
+
+
+def get_survey_revision(survey_id: int) -> int:
+    """
+    Get the current revision of a survey definition
+    """
+    return get_survey_revisions([survey_id])[survey_id]
+
+
+def get_survey_revisions(survey_ids: list) -> dict:
+    """
+    Get the current revisions of several survey definitions in one round trip
+    """
+    keys = {survey_id: SURVEY_REVISION_KEY.format(survey_id = survey_id) for survey_id in survey_ids}
+    revisions = _get_counters(list(keys.values()))
+    return {survey_id: revisions[key] for survey_id, key in keys.items()}
+
+
+def bump_survey_revision(survey_id: int) -> None:
+    """
+    Invalidate everything derived from a survey definition
+    """
+    if survey_id is None:
+        return
+    _bump_counter(SURVEY_REVISION_KEY.format(survey_id = survey_id))
+    _touch(SURVEY_MODIFIED_KEY.format(survey_id = survey_id))
+    transaction.on_commit(partial(_touch, SURVEY_MODIFIED_KEY.format(survey_id = survey_id)))
+
+
+def _touch(key: str) -> None:
+    cache.set(key, time.time(), timeout = None)
+
+
+def get_survey_modified_times(survey_ids: list) -> dict:
+    """
+    Get the timestamps of the last changes of survey definitions, surveys whose
+    timestamp was evicted are left out
+    """
+    keys = {survey_id: SURVEY_MODIFIED_KEY.format(survey_id = survey_id) for survey_id in survey_ids}
+    modified = cache.get_many(list(keys.values()))
+    return {survey_id: modified[key] for survey_id, key in keys.items() if key in modified}
+
+
+def _view_cache_version_keys(namespace: str, object_id = None) -> list:
+    return [
+        VIEW_CACHE_VERSION_KEY.format(namespace = namespace, scope = 'all'),
+        VIEW_CACHE_VERSION_KEY.format(namespace = namespace, scope = 'list' if object_id is None else object_id),
+    ]
+
+
+def bump_view_cache(namespace: str, object_id = None, everything: bool = False) -> None:
+    """
+    Invalidate the cached lists of a namespace and the cached detail of one object,
+    or every cached entry of the namespace
+    """
+    if everything:
+        _bump_counter(VIEW_CACHE_VERSION_KEY.format(namespace = namespace, scope = 'all'))
+        return
+    scopes = ['list'] if object_id is None else ['list', object_id]
+    for key in [VIEW_CACHE_VERSION_KEY.format(namespace = namespace, scope = scope) for scope in scopes]:
+        _bump_counter(key)
+
+
+class ScopedCacheMixin:
+    """
+    Cache the list and detail representations of a viewset per role, or per user
+    when `cache_scope` is 'user', and per query parameters.
+
+    Entries are invalidated through `bump_view_cache` with the viewset `cache_namespace`.
+    """
+    cache_namespace = None
+    cache_scope = 'role'
+
+    def list(self, request, *args, **kwargs):
+        return self._cached_response(request, None, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        object_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self._cached_response(request, object_id, super().retrieve, *args, **kwargs)
+
+    def get_cache_scope(self, request) -> str:
+        if self.cache_scope == 'user':
+            return f'user:{request.user.id}'
+        return 'role:' + ','.join(sorted(get_request_roles(request)))
+
+    def get_cache_key(self, request, object_id = None) -> str:
+        version_keys = _view_cache_version_keys(self.cache_namespace, object_id)
+        versions = _get_counters(version_keys)
+        params = hashlib.md5(
+            repr(sorted(request.query_params.lists())).encode(),
+            usedforsecurity = False
+        ).hexdigest()
+        return VIEW_CACHE_KEY.format(
+            namespace = self.cache_namespace,
+            versions = '.'.join(str(versions[key]) for key in version_keys),
+            scope = f'{self.get_cache_scope(request)}:{self.action}:{object_id}',
+            params = params
+        )
+
+    def _cached_response(self, request, object_id, view, *args, **kwargs):
+        key = self.get_cache_key(request, object_id)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout = settings.VIEW_CACHE_TIMEOUT)
+        return response
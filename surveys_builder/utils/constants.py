@@ -24,4 +24,14 @@ AUDIT_LOG_ACTIONS = [
     ('export_response', 'Export response'),
     ('generate_report', 'Generate report'),
     ('send_invitations', 'Send invitations'),
-]
\ No newline at end of file
+]
+
+OPERATOR_ALIASES = {
+    'equal': 'equals',
+    'not_equal': 'does_not_equal',
+    'greater_than_or_equal': 'greater_than_or_equals',
+    'less_than_or_equal': 'less_than_or_equals',
+}
+
+SURVEY_RESPONSES_CACHE_NAMESPACE = 'survey_responses'
+AUDIT_LOGS_CACHE_NAMESPACE = 'audit_logs'
@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import json
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from django.conf import settings
+from django.core.cache import cache
+from surveys_builder.utils.cache import get_survey_revision
+
+SENSITIVE_FIELDS_KEY = 'survey_sensitive_fields:{survey_id}:{revision}'
+
+
+@lru_cache(maxsize = None)
+def get_cipher() -> MultiFernet:
+    """
+    Get the cipher for sensitive answers, the first configured key encrypts
+    and every configured key can decrypt
+    """
+    keys = list(getattr(settings, 'FIELD_ENCRYPTION_KEYS', None) or [])
+    if not keys:
+        keys = [base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest())]
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def get_sensitive_field_ids(survey_id: int) -> frozenset:
+    """
+    Get the ids of the sensitive fields of a survey from its cached schema
+    """
+    from surveys_builder.utils.schema import get_survey_schema
+
+    revision = get_survey_revision(survey_id)
+    key = SENSITIVE_FIELDS_KEY.format(survey_id = survey_id, revision = revision)
+    field_ids = cache.get(key)
+    if field_ids is None:
+        field_ids = frozenset(
+            field['id']
+            for section in get_survey_schema(survey_id, revision)['sections']
+            for field in section['fields']
+            if field['sensitive']
+        )
+        cache.set(key, field_ids, timeout = settings.SURVEY_SCHEMA_CACHE_TIMEOUT)
+    return field_ids
+
+
+def _is_encrypted(cipher: MultiFernet, field: dict) -> bool:
+    if field.get('encrypted') is not True or not isinstance(field['value'], str):
+        return False
+    try:
+        cipher.decrypt(field['value'].encode())
+    except InvalidToken:
+        return False
+    return True
+
+
+def encrypt_response_data(response_data: dict, sensitive_field_ids) -> dict:
+    """
+    Encrypt the answers of the sensitive fields of a response document, an answer
+    is only left as is when it is a token issued by the cipher so an `encrypted`
+    key sent by a client cannot keep it in plaintext
+    """
+    if not sensitive_field_ids:
+        return response_data
+    cipher = get_cipher()
+    sections = []
+    for section in response_data['sections']:
+        fields = []
+        for field in section['fields']:
+            if field['id'] in sensitive_field_ids and not _is_encrypted(cipher, field):
+                field = {
+                    **{key: value for key, value in field.items() if key != 'encrypted'},
+                    'value': cipher.encrypt(json.dumps(field['value']).encode()).decode(),
+                    'encrypted': True
+                }
+            fields.append(field)
+        sections.append({**section, 'fields': fields})
+    return {**response_data, 'sections': sections}
+
+
+def decrypt_response_data(response_data: dict) -> dict:
+    """
+    Decrypt the encrypted answers of a response document
+    """
+    cipher = get_cipher()
+    sections = []
+    for section in response_data['sections']:
+        fields = []
+        for field in section['fields']:
+            if field.get('encrypted'):
+                field = {key: value for key, value in field.items() if key != 'encrypted'}
+                field['value'] = json.loads(cipher.decrypt(field['value'].encode()))
+            fields.append(field)
+        sections.append({**section, 'fields': fields})
+    return {**response_data, 'sections': sections}
@@ -0,0 +1,62 @@
+import hashlib
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+from surveys_builder.utils.cache import (
+    get_survey_modified_times,
+    get_survey_revisions
+)
+
+
+def get_revision_etag(request, revisions: list) -> str:
+    """
+    Get a strong ETag for a representation built from objects of survey definitions
+    at the given (object id, survey revision) pairs, it varies with the query
+    parameters and the negotiated media type
+    """
+    digest = hashlib.md5(
+        repr((revisions, sorted(request.query_params.lists()), request.accepted_media_type)).encode(),
+        usedforsecurity = False
+    ).hexdigest()
+    return quote_etag(digest)
+
+
+def _is_not_modified(request, etag: str, last_modified: float = None) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since'))
+    return None not in (last_modified, if_modified_since) and int(last_modified) <= if_modified_since
+
+
+class RevisionETagMixin:
+    """
+    Answer reads of representations derived from survey definitions with a strong
+    ETag from the survey revisions and Last-Modified from their last change, and
+    answer conditional reads with 304 before the representation is built
+    """
+
+    def conditional_response(self, request, objects: list, build, last_modified: bool = True) -> Response:
+        """
+        Get the response of `build()` for the (object id, survey id) pairs it represents, or a 304.
+
+        Lists pass `last_modified = False`, objects leaving a list do not move the
+        modification time of the ones left so only their ETag can tell the list changed
+        """
+        survey_ids = list(dict.fromkeys(survey_id for _, survey_id in objects))
+        revisions = get_survey_revisions(survey_ids)
+        etag = get_revision_etag(request, [(object_id, revisions[survey_id]) for object_id, survey_id in objects])
+        modified = get_survey_modified_times(survey_ids) if last_modified else {}
+        last_modified = max(modified.values()) if survey_ids and len(modified) == len(survey_ids) else None
+
+        if _is_not_modified(request, etag, last_modified):
+            response = Response(status = status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = build()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
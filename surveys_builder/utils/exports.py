@@ -0,0 +1,272 @@
+import csv
+import json
+import math
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from surveys_builder.models import (
+    Field,
+    SurveyResponse
+)
+from surveys_builder.utils.crypto import decrypt_response_data
+from surveys_builder.utils.helpers import get_section_field_map
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+EXPORT_METADATA_COLUMNS = ['response_id', 'user_id', 'created_at']
+
+
+def get_export_columns(survey_id: int) -> list:
+    """
+    Get the ordered field ids exported as columns for a survey
+    """
+    return list(
+        Field.objects.filter(
+            section__survey_id = survey_id
+        ).order_by('section__order', 'order', 'id').values_list('id', flat = True)
+    )
+
+
+def get_export_path(handle: str) -> str:
+    return os.path.join(settings.EXPORT_ROOT, handle)
+
+
+def new_export_handle(survey_id: int, export_format: str, suffix: str = '') -> str:
+    timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    return f'survey_{survey_id}_{timestamp}_{uuid.uuid4().hex[:8]}{suffix}.{export_format}'
+
+
+def _cell(value):
+    """
+    Encode an answer for a flat export column, lists and dicts as JSON and anything else as is
+    """
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _remove_partial(temporary_path: str) -> None:
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+
+class CSVExportWriter:
+    def __init__(self, path: str, field_ids: list, include_header: bool = True):
+        self.file = open(path, 'w', newline = '', encoding = 'utf-8')
+        self.writer = csv.writer(self.file)
+        self.field_ids = field_ids
+        if include_header:
+            self.writer.writerow(EXPORT_METADATA_COLUMNS + [f'field_{field_id}' for field_id in field_ids])
+
+    def write(self, rows: list) -> None:
+        self.writer.writerows(
+            [
+                [row['response_id'], row['user_id'], row['created_at']] + [
+                    _cell(row['answers'].get(field_id)) for field_id in self.field_ids
+                ]
+                for row in rows
+            ]
+        )
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class JSONLExportWriter:
+    def __init__(self, path: str, field_ids: list, include_header: bool = True):
+        self.file = open(path, 'w', encoding = 'utf-8')
+
+    def write(self, rows: list) -> None:
+        self.file.writelines(json.dumps(row) + '\n' for row in rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetExportWriter:
+    def __init__(self, path: str, field_ids: list, include_header: bool = True):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet exports require the pyarrow package.")
+        self.pyarrow = pyarrow
+        self.field_ids = field_ids
+        self.schema = pyarrow.schema(
+            [
+                ('response_id', pyarrow.int64()),
+                ('user_id', pyarrow.int64()),
+                ('created_at', pyarrow.string()),
+            ] + [(f'field_{field_id}', pyarrow.string()) for field_id in field_ids]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list) -> None:
+        columns = {
+            'response_id': [row['response_id'] for row in rows],
+            'user_id': [row['user_id'] for row in rows],
+            'created_at': [row['created_at'] for row in rows],
+        }
+        for field_id in self.field_ids:
+            columns[f'field_{field_id}'] = [
+                # The same text as the CSV cell of the answer
+                None if row['answers'].get(field_id) is None else str(_cell(row['answers'][field_id]))
+                for row in rows
+            ]
+        self.writer.write_table(self.pyarrow.table(columns, schema = self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    'csv': CSVExportWriter,
+    'jsonl': JSONLExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def iter_response_chunks(survey_id: int, start_id: int = None, end_id: int = None, chunk_size: int = None):
+    """
+    Iterate the decrypted responses of a survey in chunks ordered by id,
+    only one chunk is held in memory at a time
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = SurveyResponse.objects.filter(survey_id = survey_id).order_by('id')
+    if end_id is not None:
+        queryset = queryset.filter(id__lte = end_id)
+    last_id = start_id - 1 if start_id is not None else None
+    while True:
+        chunk_queryset = queryset if last_id is None else queryset.filter(id__gt = last_id)
+        chunk = []
+        for response_id, user_id, created_at, response_data in chunk_queryset.values_list(
+            'id', 'user_id', 'created_at', 'response_data'
+        )[:chunk_size].iterator(chunk_size = chunk_size):
+            chunk.append(
+                {
+                    'response_id': response_id,
+                    'user_id': user_id,
+                    'created_at': created_at.isoformat(),
+                    'answers': get_section_field_map(decrypt_response_data(response_data)),
+                }
+            )
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1]['response_id']
+
+
+def write_survey_responses(
+    survey_id: int,
+    path: str,
+    export_format: str,
+    field_ids: list = None,
+    start_id: int = None,
+    end_id: int = None,
+    include_header: bool = True,
+    on_chunk = None
+) -> int:
+    """
+    Stream the responses of a survey into an export file and return the number of rows written
+    """
+    if export_format not in EXPORT_WRITERS:
+        raise ValueError(f"Unsupported export format {export_format}.")
+    if field_ids is None:
+        field_ids = get_export_columns(survey_id)
+
+    rows = 0
+    temporary_path = f'{path}.part'
+    try:
+        writer = EXPORT_WRITERS[export_format](temporary_path, field_ids, include_header = include_header)
+        try:
+            for chunk in iter_response_chunks(survey_id, start_id = start_id, end_id = end_id):
+                writer.write(chunk)
+                rows += len(chunk)
+                if on_chunk:
+                    on_chunk(rows)
+        finally:
+            writer.close()
+    except Exception:
+        _remove_partial(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+    return rows
+
+
+def export_survey_responses_to_file(survey_id: int, export_format: str = 'csv') -> dict:
+    """
+    Export the responses of a survey to a file on local storage and return its handle
+    """
+    os.makedirs(settings.EXPORT_ROOT, exist_ok = True)
+    handle = new_export_handle(survey_id, export_format)
+    rows = write_survey_responses(survey_id, get_export_path(handle), export_format)
+    return {
+        'survey_id': survey_id,
+        'format': export_format,
+        'handle': handle,
+        'rows': rows,
+    }
+
+
+def plan_export_shards(survey_id: int) -> list:
+    """
+    Split the responses of a survey into id ranges of roughly EXPORT_SHARD_SIZE rows
+    """
+    bounds = SurveyResponse.objects.filter(survey_id = survey_id).aggregate(
+        first_id = Min('id'),
+        last_id = Max('id'),
+        total = Count('id')
+    )
+    if not bounds['total']:
+        return [(None, None)]
+    shard_count = min(settings.EXPORT_MAX_SHARDS, math.ceil(bounds['total'] / settings.EXPORT_SHARD_SIZE))
+    span = math.ceil((bounds['last_id'] - bounds['first_id'] + 1) / shard_count)
+    return [
+        (bounds['first_id'] + index * span, min(bounds['first_id'] + (index + 1) * span - 1, bounds['last_id']))
+        for index in range(shard_count)
+    ]
+
+
+def merge_export_files(handles: list, survey_id: int, export_format: str, field_ids: list) -> str:
+    """
+    Merge shard export files, in order, into a single export file and return its handle
+    """
+    handle = new_export_handle(survey_id, export_format)
+    path = get_export_path(handle)
+    temporary_path = f'{path}.part'
+    try:
+        if export_format == 'parquet':
+            import pyarrow.parquet
+
+            writer = None
+            for shard_handle in handles:
+                shard_file = pyarrow.parquet.ParquetFile(get_export_path(shard_handle))
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(temporary_path, shard_file.schema_arrow)
+                for batch in shard_file.iter_batches():
+                    writer.write_batch(batch)
+            if writer is None:
+                ParquetExportWriter(temporary_path, field_ids).close()
+            else:
+                writer.close()
+        else:
+            with open(temporary_path, 'wb') as export_file:
+                if export_format == 'csv':
+                    header = EXPORT_METADATA_COLUMNS + [f'field_{field_id}' for field_id in field_ids]
+                    export_file.write((','.join(header) + '\r\n').encode())
+                for shard_handle in handles:
+                    with open(get_export_path(shard_handle), 'rb') as shard_file:
+                        shutil.copyfileobj(shard_file, export_file)
+    except Exception:
+        _remove_partial(temporary_path)
+        raise
+    os.replace(temporary_path, path)
+    for shard_handle in handles:
+        os.remove(get_export_path(shard_handle))
+    return handle
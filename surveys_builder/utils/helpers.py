@@ -1,24 +1,3 @@
-def evaluate_condition(condition, section_field_map):
-    """
-    Evaluate a condition and return the result
-    """
-    for dependency in condition.dependencies.all():
-        source_field = dependency.source_field
-        target_field = dependency.target_field
-        dependency_type = dependency.dependency_type
-        source_value = section_field_map.get(source_field.id)
-        target_value = section_field_map.get(target_field.id)
-        if not source_value or not target_value:
-            return False
-        if dependency_type == 'equal':
-            if source_value != target_value:
-                return False
-        elif dependency_type == 'not_equal':
-            if source_value == target_value:
-                return False
-    return True
-
-
 def get_section_field_map(response_data):
     """
     Get a map of section field ids to field values
@@ -30,29 +9,32 @@ def get_section_field_map(response_data):
     return section_field_map
 
 
-def check_dependency(field, dependent_field_value):
+def get_field_survey_id(field_id):
     """
-    Check if a field dependency is met
+    Get the id of the survey a field belongs to
     """
-    if field['dependency_type'] == 'equal':
-        return field['value'] == dependent_field_value
-    elif field['dependency_type'] == 'does_not_equal':
-        return field['value'] != dependent_field_value
-    elif field['dependency_type'] == 'greater_than':
-        return field['value'] > dependent_field_value
-    elif field['dependency_type'] == 'less_than':
-        return field['value'] < dependent_field_value
-    elif field['dependency_type'] == 'greater_than_or_equal':
-        return field['value'] >= dependent_field_value
-    elif field['dependency_type'] == 'less_than_or_equal':
-        return field['value'] <= dependent
-    elif field['dependency_type'] == 'contains':
-        return field['value'] in dependent_field_value
-    elif field['dependency_type'] == 'not_contains':
-        return field['value'] not in dependent_field_value
-    elif field['dependency_type'] == 'is_true':
-        return field['value'] is True
-    elif field['dependency_type'] == 'is_false':
-        return field['value'] is False
-    else:
-        return False
+    from surveys_builder.models import Section
+    return Section.objects.filter(fields__id = field_id).values_list('survey_id', flat = True).first()
+
+
+# Keys of answers that only the server sets
+RESERVED_FIELD_KEYS = ('encrypted',)
+
+
+def get_response_shape_error(response_data):
+    """
+    Get what is wrong with the shape of a response document, or None
+    """
+    sections = response_data.get('sections') if isinstance(response_data, dict) else None
+    if not isinstance(sections, list):
+        return "Response data must contain a list of sections."
+    for section in sections:
+        if not isinstance(section, dict) or not isinstance(section.get('fields'), list):
+            return "Every section must contain a list of fields."
+        for field in section['fields']:
+            if not isinstance(field, dict) or 'id' not in field or 'value' not in field:
+                return "Every field must contain an id and a value."
+            reserved = [key for key in RESERVED_FIELD_KEYS if key in field]
+            if reserved:
+                return f"Fields must not contain the reserved key '{reserved[0]}'."
+    return None
@@ -0,0 +1,74 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_REPLAYED_HEADER = 'Idempotent-Replayed'
+IDEMPOTENT_RESPONSE_KEY = 'idempotency:{user_id}:{key}'
+IDEMPOTENCY_PENDING_TIMEOUT = 60
+
+
+def _fingerprint(data) -> str:
+    return hashlib.md5(
+        json.dumps(data, sort_keys = True, default = str).encode(),
+        usedforsecurity = False
+    ).hexdigest()
+
+
+def idempotent(view):
+    """
+    Answer retries of a view method carrying the same Idempotency-Key header
+    with the stored response of the first request, keys are scoped per user and
+    a key reused with a different request body is rejected
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not idempotency_key:
+            return view(self, request, *args, **kwargs)
+
+        key = IDEMPOTENT_RESPONSE_KEY.format(
+            user_id = request.user.id,
+            key = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        )
+        fingerprint = _fingerprint(request.data)
+        pending = {'fingerprint': fingerprint, 'status': None}
+        stored = None
+        if not cache.add(key, pending, timeout = IDEMPOTENCY_PENDING_TIMEOUT):
+            stored = cache.get(key, pending)
+        if stored is not None:
+            if stored['fingerprint'] != fingerprint:
+                return Response(
+                    {'error': 'The idempotency key was already used with a different request.'},
+                    status = status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if stored['status'] is None:
+                return Response(
+                    {'error': 'A request with this idempotency key is in progress.'},
+                    status = status.HTTP_409_CONFLICT
+                )
+            response = Response(stored['data'], status = stored['status'])
+            response[IDEMPOTENCY_REPLAYED_HEADER] = 'true'
+            return response
+
+        try:
+            response = view(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(key)
+            raise
+        if status.is_success(response.status_code):
+            cache.set(
+                key,
+                {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data},
+                timeout = settings.IDEMPOTENCY_KEY_TIMEOUT
+            )
+        else:
+            # Let the client fix the request and retry it with the same key
+            cache.delete(key)
+        return response
+    return wrapper
@@ -0,0 +1,194 @@
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from surveys_builder.models import Survey
+from surveys_builder.utils.crypto import get_cipher
+from surveys_builder.utils.helpers import get_response_shape_error
+from surveys_builder.utils.rules import get_survey_rule_plan
+from surveys_builder.utils.submissions import save_submissions
+
+logger = logging.getLogger(__name__)
+
+SUBMISSION_RECEIPT_KEY = 'submission_receipt:{receipt}'
+SUBMISSION_QUEUE_SLOT_KEY = 'submission_queue:{position}'
+SUBMISSION_QUEUE_HEAD_KEY = 'submission_queue_head'
+SUBMISSION_QUEUE_TAIL_KEY = 'submission_queue_tail'
+SUBMISSION_QUEUE_GAP_KEY = 'submission_queue_gap'
+SUBMISSION_QUEUE_LOCK_KEY = 'submission_queue_lock'
+SUBMISSION_INGESTION_SCHEDULED_KEY = 'submission_ingestion_scheduled'
+# Written by ingestion to a slot it gave up waiting for, so the producer of that slot takes another one
+ABANDONED_SLOT = 'abandoned'
+
+
+def get_submission_errors(item) -> list:
+    """
+    Check a submission against the shape of response documents and the cached
+    rule plan of its survey, without touching its responses
+    """
+    if not isinstance(item, dict):
+        return ["Expected an object."]
+    if not isinstance(item.get('survey'), int) or not isinstance(item.get('user'), int):
+        return ["Survey and user must be provided."]
+    shape_error = get_response_shape_error(item.get('response_data'))
+    if shape_error:
+        return [shape_error]
+    try:
+        return get_survey_rule_plan(item['survey']).validate(item['response_data'])
+    except Survey.DoesNotExist:
+        return [f"Survey {item['survey']} does not exist."]
+
+
+def _next_queue_position() -> int:
+    try:
+        return cache.incr(SUBMISSION_QUEUE_TAIL_KEY)
+    except ValueError:
+        cache.add(SUBMISSION_QUEUE_TAIL_KEY, cache.get(SUBMISSION_QUEUE_HEAD_KEY, 0), timeout = None)
+        return cache.incr(SUBMISSION_QUEUE_TAIL_KEY)
+
+
+def enqueue_submission(item: dict, submitted_by: int) -> str:
+    """
+    Queue a submission for ingestion and return its receipt, the submission is
+    kept encrypted in the cache until a worker persists it
+    """
+    receipt = uuid.uuid4().hex
+    payload = get_cipher().encrypt(json.dumps(item).encode()).decode()
+    while True:
+        position = _next_queue_position()
+        cache.set(
+            SUBMISSION_RECEIPT_KEY.format(receipt = receipt),
+            {'status': 'queued', 'submitted_by': submitted_by, 'payload': payload, 'position': position},
+            timeout = settings.SUBMISSION_RECEIPT_TIMEOUT
+        )
+        if cache.add(
+            SUBMISSION_QUEUE_SLOT_KEY.format(position = position),
+            receipt,
+            timeout = settings.SUBMISSION_RECEIPT_TIMEOUT
+        ):
+            break
+    schedule_submission_ingestion()
+    return receipt
+
+
+def schedule_submission_ingestion() -> None:
+    """
+    Schedule one ingestion run per batch window so a burst of submissions is persisted together
+    """
+    if cache.add(SUBMISSION_INGESTION_SCHEDULED_KEY, True, timeout = settings.SUBMISSION_BATCH_DELAY):
+        from surveys_builder.tasks import ingest_submissions
+        ingest_submissions.apply_async(countdown = settings.SUBMISSION_BATCH_DELAY)
+
+
+def get_submission_status(receipt: str) -> dict:
+    """
+    Get the status of a queued submission, None once its receipt expired
+    """
+    record = cache.get(SUBMISSION_RECEIPT_KEY.format(receipt = receipt))
+    if record is None:
+        return None
+    if record['status'] == 'queued' and record['position'] <= cache.get(SUBMISSION_QUEUE_HEAD_KEY, 0):
+        # The queue moved past the submission without ingesting it
+        return {
+            'status': 'error',
+            'submitted_by': record['submitted_by'],
+            'errors': ["The submission was lost before it was saved, submit it again."],
+        }
+    return {key: value for key, value in record.items() if key not in ('payload', 'position')}
+
+
+def _claim_queue_positions(head: int, tail: int) -> tuple:
+    """
+    Get the receipts queued after `head`, up to one batch, the positions given up on and the last position read
+    """
+    positions = range(head + 1, min(tail, head + settings.SUBMISSION_BATCH_SIZE) + 1)
+    slots = cache.get_many([SUBMISSION_QUEUE_SLOT_KEY.format(position = position) for position in positions])
+    receipts = []
+    abandoned = set()
+    last = head
+    # The tail when a missing slot was first seen, the slots up to it were all handed out before that time
+    gap = cache.get(SUBMISSION_QUEUE_GAP_KEY)
+    for position in positions:
+        slot_key = SUBMISSION_QUEUE_SLOT_KEY.format(position = position)
+        receipt = slots.get(slot_key)
+        if receipt is None:
+            # A producer may still be writing this slot, give up on it only once it was handed out more than the
+            # grace period ago and claim it first so a late producer takes another slot instead of writing an orphan
+            if gap is None or position > gap['tail']:
+                cache.set(SUBMISSION_QUEUE_GAP_KEY, {'tail': tail, 'since': time.time()}, timeout = None)
+                break
+            if time.time() - gap['since'] < settings.SUBMISSION_QUEUE_GAP_GRACE:
+                break
+            if cache.add(slot_key, ABANDONED_SLOT, timeout = settings.SUBMISSION_RECEIPT_TIMEOUT):
+                abandoned.add(position)
+            else:
+                receipt = cache.get(slot_key)
+        if receipt not in (None, ABANDONED_SLOT):
+            receipts.append(receipt)
+        last = position
+    return receipts, abandoned, last
+
+
+def _ingest_receipts(receipts: list) -> None:
+    keys = [SUBMISSION_RECEIPT_KEY.format(receipt = receipt) for receipt in receipts]
+    records = cache.get_many(keys)
+    queued = [key for key in keys if records.get(key, {}).get('status') == 'queued']
+    items = [json.loads(get_cipher().decrypt(records[key]['payload'].encode())) for key in queued]
+    submitted_by = [records[key]['submitted_by'] for key in queued]
+    try:
+        results = save_submissions(items, submitted_by)
+    except Exception:
+        # One bad submission must not stall the queue, retry them one by one and fail only the ones that break
+        logger.exception(f'Saving a batch of {len(items)} queued submissions failed, saving them one by one')
+        results = []
+        for item, user_id in zip(items, submitted_by):
+            try:
+                results.extend(save_submissions([item], [user_id]))
+            except Exception:
+                logger.exception(f'Saving a queued submission of survey {item.get("survey")} failed')
+                results.append({'status': 'error', 'errors': ["The submission could not be saved."]})
+    cache.set_many(
+        {
+            key: {
+                'status': result['status'],
+                'submitted_by': records[key]['submitted_by'],
+                'id': result.get('id'),
+                'errors': result.get('errors', []),
+            }
+            for key, result in zip(queued, results)
+        },
+        timeout = settings.SUBMISSION_RECEIPT_TIMEOUT
+    )
+
+
+def ingest_queued_submissions() -> int:
+    """
+    Persist the queued submissions in batches and return the number of receipts processed
+    """
+    if not cache.add(SUBMISSION_QUEUE_LOCK_KEY, True, timeout = 60 * 10):
+        return 0
+    cache.delete(SUBMISSION_INGESTION_SCHEDULED_KEY)
+    processed = 0
+    try:
+        while True:
+            head = cache.get(SUBMISSION_QUEUE_HEAD_KEY, 0)
+            tail = cache.get(SUBMISSION_QUEUE_TAIL_KEY, 0)
+            if head >= tail:
+                return processed
+            receipts, abandoned, last = _claim_queue_positions(head, tail)
+            if last == head:
+                return processed
+            _ingest_receipts(receipts)
+            cache.set(SUBMISSION_QUEUE_HEAD_KEY, last, timeout = None)
+            # Abandoned slots are kept until they expire so a late producer cannot claim them
+            cache.delete_many([
+                SUBMISSION_QUEUE_SLOT_KEY.format(position = position)
+                for position in range(head + 1, last + 1)
+                if position not in abandoned
+            ])
+            processed += len(receipts)
+    finally:
+        cache.delete(SUBMISSION_QUEUE_LOCK_KEY)
@@ -0,0 +1,156 @@
+import csv
+import datetime
+import os
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from surveys_builder.models import (
+    AuditLog,
+    AuditLogDailyAggregate
+)
+
+AUDIT_REPORT_COLUMNS = ['id', 'created_at', 'user', 'action', 'survey', 'section', 'field']
+
+AUDIT_AGGREGATES_LOCK_KEY = 'audit_log_aggregates_lock'
+
+
+def _day_start(day) -> datetime.datetime:
+    if isinstance(day, str):
+        day = parse_date(day)
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def filter_audit_logs(start = None, end = None, survey_id: int = None, actions: list = None):
+    """
+    Get the audit logs between two dates (inclusive), of a survey and of some actions
+    """
+    queryset = AuditLog.objects.all()
+    if start:
+        queryset = queryset.filter(created_at__gte = _day_start(start))
+    if end:
+        queryset = queryset.filter(created_at__lt = _day_start(end) + datetime.timedelta(days = 1))
+    if survey_id:
+        queryset = queryset.filter(survey_id = survey_id)
+    if actions:
+        queryset = queryset.filter(action__in = actions)
+    return queryset
+
+
+def iter_audit_log_chunks(queryset, chunk_size: int = None):
+    """
+    Iterate audit log rows in chunks ordered by id with their users, surveys,
+    sections and fields joined in the same query
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('id').values_list(
+        'id', 'created_at', 'user__username', 'action', 'survey__title', 'section__title', 'field__label'
+    )
+    last_id = None
+    while True:
+        chunk_queryset = queryset if last_id is None else queryset.filter(id__gt = last_id)
+        chunk = list(chunk_queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+
+def write_audit_report(path: str, queryset) -> int:
+    """
+    Stream audit logs into a CSV report and return the number of rows written
+    """
+    rows = 0
+    temporary_path = f'{path}.part'
+    with open(temporary_path, 'w', newline = '') as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(AUDIT_REPORT_COLUMNS)
+        for chunk in iter_audit_log_chunks(queryset):
+            writer.writerows(
+                [log_id, created_at.isoformat(), *values] for log_id, created_at, *values in chunk
+            )
+            rows += len(chunk)
+    os.replace(temporary_path, path)
+    return rows
+
+
+def new_report_handle() -> str:
+    timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    return f'audit_report_{timestamp}_{uuid.uuid4().hex[:8]}.csv'
+
+
+def refresh_audit_log_aggregates() -> int:
+    """
+    Fold the audit logs written since the last refresh into the per day counts
+    and return the number of logs processed.
+
+    Ids are allocated before their transaction commits, so only logs older than
+    AUDIT_AGGREGATE_SETTLE_SECONDS move the watermark, a log committed late with
+    a lower id would otherwise fall under it and never be counted.
+    """
+    if not cache.add(AUDIT_AGGREGATES_LOCK_KEY, True, timeout = 60 * 10):
+        return 0
+    try:
+        with transaction.atomic():
+            watermark = AuditLogDailyAggregate.objects.aggregate(
+                watermark = Max('last_log_id')
+            )['watermark'] or 0
+            settled = timezone.now() - datetime.timedelta(seconds = settings.AUDIT_AGGREGATE_SETTLE_SECONDS)
+            upper = AuditLog.objects.filter(created_at__lt = settled).aggregate(upper = Max('id'))['upper'] or 0
+            if upper <= watermark:
+                return 0
+            counts = AuditLog.objects.filter(id__gt = watermark, id__lte = upper).annotate(
+                day = TruncDate('created_at')
+            ).values('day', 'survey_id', 'action').annotate(count = Count('id')).order_by()
+
+            new_counts = {(row['day'], row['survey_id'], row['action']): row['count'] for row in counts}
+            existing = {
+                (aggregate.day, aggregate.survey_id, aggregate.action): aggregate
+                for aggregate in AuditLogDailyAggregate.objects.select_for_update().filter(
+                    day__in = {day for day, _, _ in new_counts}
+                )
+            }
+            updated, created = [], []
+            for key, count in new_counts.items():
+                aggregate = existing.get(key)
+                if aggregate is None:
+                    day, survey_id, action = key
+                    created.append(
+                        AuditLogDailyAggregate(
+                            day = day, survey_id = survey_id, action = action, count = count, last_log_id = upper
+                        )
+                    )
+                else:
+                    aggregate.count += count
+                    aggregate.last_log_id = upper
+                    updated.append(aggregate)
+            AuditLogDailyAggregate.objects.bulk_update(updated, ['count', 'last_log_id'])
+            AuditLogDailyAggregate.objects.bulk_create(created)
+            return sum(new_counts.values())
+    finally:
+        cache.delete(AUDIT_AGGREGATES_LOCK_KEY)
+
+
+def get_audit_log_summary(start = None, end = None, survey_id: int = None, actions: list = None) -> list:
+    """
+    Get the number of audit logs per day and action from the daily aggregates
+    """
+    queryset = AuditLogDailyAggregate.objects.all()
+    if start:
+        queryset = queryset.filter(day__gte = start)
+    if end:
+        queryset = queryset.filter(day__lte = end)
+    if survey_id:
+        queryset = queryset.filter(survey_id = survey_id)
+    if actions:
+        queryset = queryset.filter(action__in = actions)
+    return list(
+        queryset.values('day', 'action').annotate(count = Sum('count')).order_by('day', 'action')
+    )
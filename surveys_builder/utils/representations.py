@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from surveys_builder.models import (
+    ConditionDependency,
+    Field,
+    Section,
+    Survey
+)
+from surveys_builder.serializers import SurveySerializer
+from surveys_builder.utils.cache import get_survey_revisions
+from surveys_builder.utils.selection import (
+    FULL_SELECTION,
+    Selection,
+    apply_selection
+)
+from surveys_builder.utils.trees import build_survey_trees
+
+SURVEY_REPRESENTATION_KEY = 'survey_representation:{survey_id}:{revision}'
+
+SURVEY_TREE_PREFETCH = (
+    'sections__fields__field_type',
+    'sections__fields__options',
+    'sections__fields__conditional_logic__condition',
+    'sections__fields__dependencies',
+)
+
+
+def get_field_tree_queryset():
+    """
+    Get fields with everything FieldSerializer nests loaded in a fixed number of queries
+    """
+    return Field.objects.select_related('field_type').prefetch_related(
+        'options',
+        Prefetch('conditional_logic', queryset = ConditionDependency.objects.select_related('condition')),
+        'dependencies'
+    )
+
+
+def get_section_tree_queryset():
+    """
+    Get sections with everything SectionSerializer nests loaded in a fixed number of queries
+    """
+    return Section.objects.prefetch_related(Prefetch('fields', queryset = get_field_tree_queryset()))
+
+
+def _serialize_surveys(survey_ids: list, selection: Selection = FULL_SELECTION) -> list:
+    surveys = Survey.objects.filter(id__in = survey_ids).prefetch_related(*SURVEY_TREE_PREFETCH)
+    serializer = SurveySerializer(surveys, many = True)
+    apply_selection(serializer, selection)
+    return serializer.data
+
+
+def get_survey_representations(
+    survey_ids: list,
+    read_path: str = 'serializer',
+    selection: Selection = FULL_SELECTION
+) -> list:
+    """
+    Get the serialized representations of surveys, in the given order, from the
+    cache and build only the surveys whose revision is not cached yet, with
+    SurveySerializer or from .values() rows when `read_path` is 'values'.
+    Partial selections are built directly and not cached
+    """
+    build = build_survey_trees if read_path == 'values' else _serialize_surveys
+    if not selection.is_full:
+        built = {data['id']: data for data in build(survey_ids, selection)}
+        return [built[survey_id] for survey_id in survey_ids if survey_id in built]
+
+    revisions = get_survey_revisions(survey_ids)
+    keys = {
+        survey_id: SURVEY_REPRESENTATION_KEY.format(survey_id = survey_id, revision = revision)
+        for survey_id, revision in revisions.items()
+    }
+    representations = cache.get_many(keys.values())
+
+    missing = [survey_id for survey_id, key in keys.items() if key not in representations]
+    if missing:
+        built = {keys[data['id']]: data for data in build(missing)}
+        cache.set_many(built, timeout = settings.SURVEY_SCHEMA_CACHE_TIMEOUT)
+        representations.update(built)
+
+    return [representations[keys[survey_id]] for survey_id in survey_ids if keys[survey_id] in representations]
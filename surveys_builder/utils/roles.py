@@ -0,0 +1,56 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.settings import api_settings
+
+USER_ROLES_KEY = 'user_roles:{user_id}'
+ROLES_CHANGED_AT_KEY = 'roles_changed_at:{user_id}'
+
+
+def get_user_roles(user) -> frozenset:
+    """
+    Get the group names of a user from the cache, loading them once when missing
+    """
+    if not user or not user.is_authenticated:
+        return frozenset()
+    key = USER_ROLES_KEY.format(user_id = user.id)
+    roles = cache.get(key)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat = True))
+        cache.set(key, roles, timeout = settings.USER_ROLES_CACHE_TIMEOUT)
+    return roles
+
+
+def get_request_roles(request) -> frozenset:
+    """
+    Get the roles of the user of a request, resolved once per request, users
+    authenticated statelessly from their token get the roles claim of the token
+    """
+    roles = getattr(request, '_roles', None)
+    if roles is None:
+        token = getattr(request.user, 'token', None)
+        if token is not None and 'roles' in token:
+            roles = frozenset(token['roles'])
+        else:
+            roles = get_user_roles(request.user)
+        request._roles = roles
+    return roles
+
+
+def invalidate_user_roles(user_ids) -> None:
+    """
+    Drop the cached roles of users and record the change so roles claims issued
+    before it are no longer trusted
+    """
+    user_ids = list(user_ids)
+    keys = [USER_ROLES_KEY.format(user_id = user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Requests may cache the pre-commit membership until the change commits, delete again once it does
+    transaction.on_commit(partial(cache.delete_many, keys))
+    cache.set_many(
+        {ROLES_CHANGED_AT_KEY.format(user_id = user_id): time.time() for user_id in user_ids},
+        timeout = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+    )
@@ -0,0 +1,278 @@
+import math
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Max, Min, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from surveys_builder.models import (
+    Answer,
+    FieldRollup,
+    OptionRollup,
+    Survey,
+    SurveyResponse,
+    SurveyRollup
+)
+from surveys_builder.utils.answers import (
+    build_answers,
+    get_survey_options
+)
+from surveys_builder.utils.crypto import decrypt_response_data
+from surveys_builder.utils.schema import get_survey_schema
+
+EMPTY_VALUES = (None, '', [])
+
+
+def _get_schema_fields(survey_id: int) -> dict:
+    return {
+        field['id']: field
+        for section in get_survey_schema(survey_id)['sections']
+        for field in section['fields']
+    }
+
+
+def get_response_contribution(survey_id: int, response_data: dict) -> dict:
+    """
+    Get what a plain response document adds to the rollups of its survey
+    """
+    fields = _get_schema_fields(survey_id)
+    answered = {
+        field['id']
+        for section in response_data.get('sections', [])
+        for field in section.get('fields', [])
+        if field.get('id') in fields and field.get('value') not in EMPTY_VALUES
+    }
+    options = Counter()
+    numeric = {}
+    for answer in build_answers(survey_id, [(None, response_data)]):
+        if answer.option_id:
+            options[(answer.field_id, answer.option_id)] += 1
+        if answer.numeric_value is not None:
+            numeric.setdefault(answer.field_id, []).append(answer.numeric_value)
+    required = {field_id for field_id, field in fields.items() if field['required']}
+    return {
+        'responses': 1,
+        'completed': int(required <= answered),
+        'answered': answered,
+        'options': options,
+        'numeric': numeric,
+    }
+
+
+EMPTY_CONTRIBUTION = {'responses': 0, 'completed': 0, 'answered': set(), 'options': Counter(), 'numeric': {}}
+
+
+def _shift(column: str, delta: int):
+    """
+    Add `delta` to an unsigned counter without taking it, or an intermediate value, below zero
+    """
+    if delta >= 0:
+        return F(column) + delta
+    return Greatest(F(column), Value(-delta)) - (-delta)
+
+
+def ensure_survey_rollups(survey_id: int) -> bool:
+    """
+    Build the rollups of a survey that has responses but no rollups yet, like the
+    responses stored before rollups existed, and return whether it did
+    """
+    with transaction.atomic():
+        list(Survey.objects.select_for_update().filter(pk = survey_id).values_list('id'))
+        if SurveyRollup.objects.filter(survey_id = survey_id).exists():
+            return False
+        if not SurveyResponse.objects.filter(survey_id = survey_id).exists():
+            return False
+        recompute_survey_rollups(survey_id)
+        return True
+
+
+def update_survey_rollups(survey_id: int, previous_data: dict = None, response_data: dict = None) -> None:
+    """
+    Apply the change of one response, from its previous to its current plain
+    document (None when created or deleted), to the rollups of its survey
+    """
+    apply_rollup_changes(survey_id, [(previous_data, response_data)])
+
+
+def apply_rollup_changes(survey_id: int, changes: list) -> None:
+    """
+    Apply (previous, current) plain document pairs of responses of a survey to
+    its rollups with one update per touched row, the changes must already be
+    stored as surveys without rollups are rebuilt from their responses instead
+    """
+    if ensure_survey_rollups(survey_id):
+        return
+    responses = completed = 0
+    answered = Counter()
+    added, removed = {}, {}
+    options = Counter()
+    for previous_data, response_data in changes:
+        before = get_response_contribution(survey_id, previous_data) if previous_data else EMPTY_CONTRIBUTION
+        after = get_response_contribution(survey_id, response_data) if response_data else EMPTY_CONTRIBUTION
+        responses += after['responses'] - before['responses']
+        completed += after['completed'] - before['completed']
+        answered.update(after['answered'] - before['answered'])
+        answered.subtract(before['answered'] - after['answered'])
+        for field_id, values in after['numeric'].items():
+            added.setdefault(field_id, []).extend(values)
+        for field_id, values in before['numeric'].items():
+            removed.setdefault(field_id, []).extend(values)
+        options.update(after['options'])
+        options.subtract(before['options'])
+
+    if responses > 0:
+        SurveyRollup.objects.bulk_create([SurveyRollup(survey_id = survey_id)], ignore_conflicts = True)
+    if responses or completed:
+        SurveyRollup.objects.filter(survey_id = survey_id).update(
+            responses = _shift('responses', responses),
+            completed = _shift('completed', completed)
+        )
+
+    field_updates = {}
+    created_fields = set()
+    for field_id, count in answered.items():
+        if count:
+            field_updates.setdefault(field_id, {})['answered'] = _shift('answered', count)
+            if count > 0:
+                created_fields.add(field_id)
+    recompute_bounds = set()
+    for field_id in set(added) | set(removed):
+        field_added = added.get(field_id, [])
+        field_removed = removed.get(field_id, [])
+        if sorted(field_added) == sorted(field_removed):
+            continue
+        updates = field_updates.setdefault(field_id, {})
+        updates['numeric_count'] = _shift('numeric_count', len(field_added) - len(field_removed))
+        updates['numeric_sum'] = F('numeric_sum') + sum(field_added) - sum(field_removed)
+        updates['numeric_sum_squares'] = F('numeric_sum_squares') + sum(value * value for value in field_added) \
+            - sum(value * value for value in field_removed)
+        if field_removed:
+            recompute_bounds.add(field_id)
+        else:
+            created_fields.add(field_id)
+            updates['numeric_min'] = Least(Coalesce(F('numeric_min'), Value(min(field_added))), Value(min(field_added)))
+            updates['numeric_max'] = Greatest(Coalesce(F('numeric_max'), Value(max(field_added))), Value(max(field_added)))
+
+    FieldRollup.objects.bulk_create(
+        [FieldRollup(field_id = field_id, survey_id = survey_id) for field_id in created_fields],
+        ignore_conflicts = True
+    )
+    for field_id, updates in field_updates.items():
+        FieldRollup.objects.filter(field_id = field_id).update(**updates)
+    for field_id in recompute_bounds:
+        FieldRollup.objects.filter(field_id = field_id).update(
+            **Answer.objects.filter(field_id = field_id, numeric_value__isnull = False).aggregate(
+                numeric_min = Min('numeric_value'),
+                numeric_max = Max('numeric_value')
+            )
+        )
+
+    OptionRollup.objects.bulk_create(
+        [
+            OptionRollup(option_id = option_id, field_id = field_id)
+            for (field_id, option_id), count in options.items()
+            if count > 0
+        ],
+        ignore_conflicts = True
+    )
+    for (_, option_id), count in options.items():
+        if count:
+            OptionRollup.objects.filter(option_id = option_id).update(count = _shift('count', count))
+
+
+def recompute_survey_rollups(survey_id: int, chunk_size: int = 1000) -> int:
+    """
+    Rebuild the rollups of a survey from all of its responses and return the number of responses read
+    """
+    survey_rollup = SurveyRollup(survey_id = survey_id)
+    field_rollups = {}
+    option_rollups = {}
+    last_id = 0
+    while True:
+        chunk = list(
+            SurveyResponse.objects.filter(survey_id = survey_id, id__gt = last_id).order_by('id').values_list(
+                'id', 'response_data'
+            )[:chunk_size]
+        )
+        if not chunk:
+            break
+        for _, response_data in chunk:
+            contribution = get_response_contribution(survey_id, decrypt_response_data(response_data))
+            survey_rollup.responses += 1
+            survey_rollup.completed += contribution['completed']
+            for field_id in contribution['answered'] | set(contribution['numeric']):
+                rollup = field_rollups.setdefault(field_id, FieldRollup(field_id = field_id, survey_id = survey_id))
+                rollup.answered += field_id in contribution['answered']
+                for value in contribution['numeric'].get(field_id, []):
+                    rollup.numeric_count += 1
+                    rollup.numeric_sum += value
+                    rollup.numeric_sum_squares += value * value
+                    rollup.numeric_min = value if rollup.numeric_min is None else min(rollup.numeric_min, value)
+                    rollup.numeric_max = value if rollup.numeric_max is None else max(rollup.numeric_max, value)
+            for (field_id, option_id), count in contribution['options'].items():
+                rollup = option_rollups.setdefault(option_id, OptionRollup(option_id = option_id, field_id = field_id))
+                rollup.count += count
+        last_id = chunk[-1][0]
+
+    SurveyRollup.objects.filter(survey_id = survey_id).delete()
+    FieldRollup.objects.filter(survey_id = survey_id).delete()
+    OptionRollup.objects.filter(field__section__survey_id = survey_id).delete()
+    survey_rollup.save()
+    FieldRollup.objects.bulk_create(field_rollups.values())
+    OptionRollup.objects.bulk_create(option_rollups.values())
+    return survey_rollup.responses
+
+
+def get_survey_analytics(survey_id: int) -> dict:
+    """
+    Get the response distributions of a survey from its rollups
+    """
+    survey = Survey.objects.filter(pk = survey_id).values('id', 'rollup__responses', 'rollup__completed').get()
+    if survey['rollup__responses'] is None and ensure_survey_rollups(survey_id):
+        survey = Survey.objects.filter(pk = survey_id).values('id', 'rollup__responses', 'rollup__completed').get()
+    responses = survey['rollup__responses'] or 0
+    field_rollups = {rollup.field_id: rollup for rollup in FieldRollup.objects.filter(survey_id = survey_id)}
+    option_counts = {
+        option_id: count
+        for option_id, count in OptionRollup.objects.filter(field__section__survey_id = survey_id).values_list(
+            'option_id', 'count'
+        )
+    }
+    option_ids = get_survey_options(survey_id)
+
+    fields = []
+    for field_id, field in _get_schema_fields(survey_id).items():
+        rollup = field_rollups.get(field_id) or FieldRollup(field_id = field_id, survey_id = survey_id)
+        numeric = None
+        if rollup.numeric_count:
+            average = rollup.numeric_sum / rollup.numeric_count
+            numeric = {
+                'count': rollup.numeric_count,
+                'average': average,
+                'stddev': math.sqrt(max(rollup.numeric_sum_squares / rollup.numeric_count - average * average, 0)),
+                'min': rollup.numeric_min,
+                'max': rollup.numeric_max,
+            }
+        fields.append(
+            {
+                'id': field_id,
+                'label': field['label'],
+                'answered': rollup.answered,
+                'response_rate': rollup.answered / responses if responses else 0,
+                'options': [
+                    {
+                        'id': option_ids.get((field_id, value)),
+                        'value': value,
+                        'count': option_counts.get(option_ids.get((field_id, value)), 0)
+                    }
+                    for value, _ in field['options']
+                ],
+                'numeric': numeric,
+            }
+        )
+    return {
+        'survey': survey_id,
+        'responses': responses,
+        'completed': survey['rollup__completed'] or 0,
+        'completion_rate': (survey['rollup__completed'] or 0) / responses if responses else 0,
+        'fields': fields,
+    }
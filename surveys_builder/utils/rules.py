@@ -0,0 +1,254 @@
+import logging
+import operator
+from collections import defaultdict
+from functools import lru_cache
+
+from surveys_builder.utils.cache import get_survey_revision
+from surveys_builder.utils.constants import OPERATOR_ALIASES
+from surveys_builder.utils.helpers import get_section_field_map
+from surveys_builder.utils.schema import get_survey_schema
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+# Compiled plans kept per worker process, older revisions are evicted with the least recently used surveys
+RULE_PLAN_CACHE_SIZE = 256
+
+TRUE_VALUES = {'true', '1', 'yes', 'on'}
+FALSE_VALUES = {'false', '0', 'no', 'off'}
+
+
+def _as_number(value):
+    if isinstance(value, bool) or value is MISSING or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_text(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = _as_text(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    return None
+
+
+def _numeric(compare):
+    def evaluate(left, right) -> bool:
+        left, right = _as_number(left), _as_number(right)
+        if left is None or right is None:
+            return False
+        return compare(left, right)
+    return evaluate
+
+
+def _equals(left, right) -> bool:
+    left_number, right_number = _as_number(left), _as_number(right)
+    if left_number is not None and right_number is not None:
+        return left_number == right_number
+    return _as_text(left) == _as_text(right)
+
+
+def _contains(left, right) -> bool:
+    if isinstance(left, (list, tuple)):
+        return any(_equals(item, right) for item in left)
+    return _as_text(right) in _as_text(left)
+
+
+OPERATOR_CALLABLES = {
+    'equals': _equals,
+    'does_not_equal': lambda left, right: not _equals(left, right),
+    'contains': _contains,
+    'not_contains': lambda left, right: not _contains(left, right),
+    'greater_than': _numeric(operator.gt),
+    'less_than': _numeric(operator.lt),
+    'greater_than_or_equals': _numeric(operator.ge),
+    'less_than_or_equals': _numeric(operator.le),
+    'is_true': lambda left, right: _as_bool(left) is True,
+    'is_false': lambda left, right: _as_bool(left) is False,
+}
+
+NUMERIC_OPERATORS = {'greater_than', 'less_than', 'greater_than_or_equals', 'less_than_or_equals'}
+
+
+def _never(left, right) -> bool:
+    return False
+
+
+def resolve_operator(name: str):
+    """
+    Resolve an operator or dependency type name to its callable
+    """
+    name = OPERATOR_ALIASES.get(name, name)
+    if name not in OPERATOR_CALLABLES:
+        logger.warning(f'Unknown rule operator {name}')
+        return _never
+    return OPERATOR_CALLABLES[name]
+
+
+class CompiledCondition:
+    __slots__ = ('id', 'source_field_id', 'test', 'operand')
+
+    def __init__(self, condition_id, source_field_id, operator_name, value):
+        self.id = condition_id
+        self.source_field_id = source_field_id
+        self.test = resolve_operator(operator_name)
+        if OPERATOR_ALIASES.get(operator_name, operator_name) in NUMERIC_OPERATORS:
+            value = _as_number(value)
+        self.operand = value
+
+    def is_met(self, values: dict) -> bool:
+        value = values.get(self.source_field_id, MISSING)
+        if value is MISSING or value is None:
+            return False
+        return self.test(value, self.operand)
+
+
+class CompiledDependency:
+    __slots__ = ('id', 'target_field_id', 'test')
+
+    def __init__(self, dependency_id, target_field_id, dependency_type):
+        self.id = dependency_id
+        self.target_field_id = target_field_id
+        name = OPERATOR_ALIASES.get(dependency_type, dependency_type)
+        if name in ('contains', 'not_contains'):
+            # A dependency checks that the source value is (not) contained in the target value
+            compare = resolve_operator(name)
+            self.test = lambda left, right: compare(right, left)
+        else:
+            self.test = resolve_operator(name)
+
+    def is_met(self, value, values: dict) -> bool:
+        target_value = values.get(self.target_field_id, MISSING)
+        if target_value is MISSING or target_value is None:
+            return False
+        return self.test(value, target_value)
+
+
+class SurveyRulePlan:
+    """
+    In-memory validation plan for the responses of one survey revision
+    """
+
+    def __init__(self, survey_id: int, revision: int, field_ids: set, gates: dict, dependencies: dict):
+        self.survey_id = survey_id
+        self.revision = revision
+        self.field_ids = field_ids
+        self.gates = gates
+        self.dependencies = dependencies
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list:
+        incoming = {field_id: set() for field_id in self.gates}
+        outgoing = defaultdict(set)
+        for field_id, conditions in self.gates.items():
+            for condition in conditions:
+                if condition.source_field_id in self.gates and condition.source_field_id != field_id:
+                    incoming[field_id].add(condition.source_field_id)
+                    outgoing[condition.source_field_id].add(field_id)
+
+        ready = sorted(field_id for field_id, sources in incoming.items() if not sources)
+        order = []
+        while ready:
+            field_id = ready.pop()
+            order.append(field_id)
+            for dependent_id in outgoing[field_id]:
+                incoming[dependent_id].discard(field_id)
+                if not incoming[dependent_id]:
+                    ready.append(dependent_id)
+
+        cyclic = sorted(set(self.gates) - set(order))
+        if cyclic:
+            logger.warning(f'Conditional logic cycle in survey {self.survey_id} between fields {cyclic}')
+            order.extend(cyclic)
+        return order
+
+    def visibility(self, values: dict) -> dict:
+        """
+        Resolve which conditionally shown fields are visible for the given answers
+        """
+        visible = {}
+        for field_id in self.order:
+            visible[field_id] = all(
+                visible.get(condition.source_field_id, True) and condition.is_met(values)
+                for condition in self.gates[field_id]
+            )
+        return visible
+
+    def validate(self, response_data: dict) -> list:
+        """
+        Validate a response document and return the list of rule violations
+        """
+        values = get_section_field_map(response_data)
+        errors = []
+        unknown = [field_id for field_id in values if field_id not in self.field_ids]
+        if unknown:
+            errors.append(f"Fields {unknown} do not belong to survey {self.survey_id}")
+
+        visible = self.visibility(values)
+        for field_id, value in values.items():
+            if value is None or value == '':
+                continue
+            if not visible.get(field_id, True):
+                for condition in self.gates[field_id]:
+                    if not (visible.get(condition.source_field_id, True) and condition.is_met(values)):
+                        errors.append(f"Condition {condition.id} not met for field {field_id}")
+                        break
+            for dependency in self.dependencies.get(field_id, ()):
+                if not dependency.is_met(value, values):
+                    errors.append(f"Dependency {dependency.id} not met for field {field_id}")
+        return errors
+
+
+def compile_survey_rules(survey_id: int, revision: int = None) -> SurveyRulePlan:
+    """
+    Compile the conditions and dependencies of a survey into a rule plan
+    """
+    if revision is None:
+        revision = get_survey_revision(survey_id)
+    schema = get_survey_schema(survey_id, revision)
+
+    section_fields = {
+        section['id']: [field['id'] for field in section['fields']]
+        for section in schema['sections']
+    }
+    field_ids = {field_id for fields in section_fields.values() for field_id in fields}
+
+    gates = defaultdict(list)
+    for condition in schema['conditions']:
+        compiled = CompiledCondition(condition['id'], condition['source'], condition['operator'], condition['value'])
+        affected = [condition['field']] if 'field' in condition else section_fields.get(condition['section'], [])
+        for field_id in affected:
+            gates[field_id].append(compiled)
+
+    dependencies = defaultdict(list)
+    for dependency in schema['dependencies']:
+        dependencies[dependency['source']].append(
+            CompiledDependency(dependency['id'], dependency['target'], dependency['type'])
+        )
+
+    return SurveyRulePlan(survey_id, revision, field_ids, dict(gates), dict(dependencies))
+
+
+@lru_cache(maxsize = RULE_PLAN_CACHE_SIZE)
+def _get_compiled_plan(survey_id: int, revision: int) -> SurveyRulePlan:
+    return compile_survey_rules(survey_id, revision)
+
+
+def get_survey_rule_plan(survey_id: int) -> SurveyRulePlan:
+    """
+    Get the compiled rule plan of a survey, recompiling it when the survey revision changes
+    """
+    return _get_compiled_plan(survey_id, get_survey_revision(survey_id))
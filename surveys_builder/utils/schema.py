@@ -0,0 +1,240 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import serializers
+from surveys_builder.models import (
+    Condition,
+    Field,
+    FieldType,
+    Option,
+    Section,
+    Survey,
+    ConditionDependency,
+    Dependency
+)
+from surveys_builder.utils.authoring import SurveyTreeBuilder
+from surveys_builder.utils.cache import get_survey_revision
+
+# Version 2 added the ids of conditions and dependencies, they are not needed on import
+# so version 1 documents are still accepted
+SCHEMA_VERSION = 2
+SUPPORTED_SCHEMA_VERSIONS = (1, 2)
+
+SURVEY_SCHEMA_KEY = 'survey_schema:{version}:{survey_id}:{revision}'
+
+
+def export_survey_schema(survey: Survey) -> dict:
+    """
+    Export a survey definition as a compact versioned document, ids in the
+    document are only used to link conditions and dependencies to fields
+    and are not kept on import
+    """
+    sections = list(
+        Section.objects.filter(survey = survey).order_by('order', 'id').values('id', 'title', 'order')
+    )
+    fields = list(
+        Field.objects.filter(section__survey = survey).order_by('order', 'id').values(
+            'id', 'section_id', 'field_type_id', 'label', 'order', 'required', 'is_sensitive'
+        )
+    )
+    field_types = list(
+        FieldType.objects.filter(id__in = {field['field_type_id'] for field in fields}).values_list(
+            'id', 'name', 'widget'
+        )
+    )
+    field_type_index = {field_type_id: index for index, (field_type_id, _, _) in enumerate(field_types)}
+
+    options = {}
+    for field_id, value, order in Option.objects.filter(field__section__survey = survey).order_by(
+        'order', 'id'
+    ).values_list('field_id', 'value', 'order'):
+        options.setdefault(field_id, []).append([value, order])
+
+    section_fields = {}
+    for field in fields:
+        section_fields.setdefault(field['section_id'], []).append(
+            {
+                'id': field['id'],
+                'label': field['label'],
+                'order': field['order'],
+                'required': field['required'],
+                'sensitive': field['is_sensitive'],
+                'type': field_type_index[field['field_type_id']],
+                'options': options.get(field['id'], []),
+            }
+        )
+
+    conditions = []
+    for condition_id, source_field_id, operator, value, affected_field_id, affected_section_id in (
+        ConditionDependency.objects.filter(
+            condition__source_field__section__survey = survey
+        ).order_by('id').values_list(
+            'condition_id',
+            'condition__source_field_id',
+            'condition__operator',
+            'condition__value',
+            'affected_field_id',
+            'affected_section_id'
+        )
+    ):
+        condition = {'id': condition_id, 'source': source_field_id, 'operator': operator, 'value': value}
+        if affected_field_id:
+            condition['field'] = affected_field_id
+        else:
+            condition['section'] = affected_section_id
+        conditions.append(condition)
+
+    return {
+        'version': SCHEMA_VERSION,
+        'survey': {'id': survey.id, 'title': survey.title, 'description': survey.description},
+        'field_types': [[name, widget] for _, name, widget in field_types],
+        'sections': [
+            {
+                'id': section['id'],
+                'title': section['title'],
+                'order': section['order'],
+                'fields': section_fields.get(section['id'], []),
+            }
+            for section in sections
+        ],
+        'conditions': conditions,
+        'dependencies': [
+            {'id': dependency_id, 'source': source_field_id, 'target': target_field_id, 'type': dependency_type}
+            for dependency_id, source_field_id, target_field_id, dependency_type in Dependency.objects.filter(
+                source_field__section__survey = survey
+            ).order_by('id').values_list('id', 'source_field_id', 'target_field_id', 'dependency_type')
+        ],
+    }
+
+
+def get_survey_schema(survey_id: int, revision: int = None) -> dict:
+    """
+    Get the schema document of a survey from the cache, rebuilding it when the survey revision changes
+    """
+    if revision is None:
+        revision = get_survey_revision(survey_id)
+    key = SURVEY_SCHEMA_KEY.format(version = SCHEMA_VERSION, survey_id = survey_id, revision = revision)
+    document = cache.get(key)
+    if document is None:
+        document = export_survey_schema(Survey.objects.get(pk = survey_id))
+        cache.set(key, document, timeout = settings.SURVEY_SCHEMA_CACHE_TIMEOUT)
+    return document
+
+
+def _schema_error(message: str):
+    return serializers.ValidationError({'schema': [message]})
+
+
+def _clean(model, name: str, value, what: str):
+    """
+    Validate a document value against the model field it is stored in and get its python value
+    """
+    try:
+        return model._meta.get_field(name).clean(value, None)
+    except DjangoValidationError as exc:
+        raise _schema_error(f"Invalid {what} {name}: {' '.join(exc.messages)}")
+
+
+def build_survey_tree(document: dict) -> list:
+    """
+    Convert a schema document into the nested section data used by SurveyTreeBuilder,
+    the exported ids become builder refs
+    """
+    if not isinstance(document, dict) or document.get('version') not in SUPPORTED_SCHEMA_VERSIONS:
+        raise _schema_error(f"Unsupported schema version, expected one of {SUPPORTED_SCHEMA_VERSIONS}.")
+    try:
+        field_types = [
+            {
+                'name': _clean(FieldType, 'name', name, 'field type'),
+                'widget': _clean(FieldType, 'widget', widget, 'field type'),
+            }
+            for name, widget in document.get('field_types', [])
+        ]
+        sections_data = []
+        fields_data = {}
+        for section in document.get('sections', []):
+            section_data = {
+                'ref': section['id'],
+                'title': _clean(Section, 'title', section.get('title'), 'section'),
+                'order': _clean(Section, 'order', section.get('order', 0), 'section'),
+                'conditional_logic': [],
+                'fields': [],
+            }
+            if any(other['order'] == section_data['order'] for other in sections_data):
+                raise _schema_error(f"Duplicate section order {section_data['order']}.")
+            for field in section.get('fields', []):
+                field_type = field['type']
+                if type(field_type) is not int or not 0 <= field_type < len(field_types):
+                    raise _schema_error(f"Field {field['id']} has an unknown type {field_type}.")
+                field_data = {
+                    'ref': field['id'],
+                    'label': _clean(Field, 'label', field.get('label'), 'field'),
+                    'order': _clean(Field, 'order', field.get('order', 0), 'field'),
+                    'required': _clean(Field, 'required', field.get('required', False), 'field'),
+                    'is_sensitive': _clean(Field, 'is_sensitive', field.get('sensitive', False), 'field'),
+                    'field_type': field_types[field_type],
+                    'options': [
+                        {
+                            'value': _clean(Option, 'value', value, 'option'),
+                            'order': _clean(Option, 'order', order, 'option'),
+                        }
+                        for value, order in field.get('options', [])
+                    ],
+                    'conditional_logic': [],
+                    'dependencies': [],
+                }
+                if field['id'] in fields_data:
+                    raise _schema_error(f"Duplicate field id {field['id']}.")
+                fields_data[field['id']] = field_data
+                section_data['fields'].append(field_data)
+            sections_data.append(section_data)
+        sections_by_ref = {section['ref']: section for section in sections_data}
+
+        for condition in document.get('conditions', []):
+            if condition['source'] not in fields_data:
+                raise _schema_error(f"Condition source field {condition['source']} is not part of the schema.")
+            logic = {'condition': {
+                'source_field': condition['source'],
+                'operator': _clean(Condition, 'operator', condition['operator'], 'condition'),
+                'value': _clean(Condition, 'value', condition['value'], 'condition'),
+            }}
+            if condition.get('field') in fields_data:
+                fields_data[condition['field']]['conditional_logic'].append(logic)
+            elif condition.get('section') in sections_by_ref:
+                sections_by_ref[condition['section']]['conditional_logic'].append(logic)
+            else:
+                raise _schema_error("Condition targets a field or section that is not part of the schema.")
+
+        for dependency in document.get('dependencies', []):
+            if dependency['source'] not in fields_data or dependency['target'] not in fields_data:
+                raise _schema_error("Dependency references a field that is not part of the schema.")
+            fields_data[dependency['source']]['dependencies'].append(
+                {
+                    'target_field': dependency['target'],
+                    'dependency_type': _clean(Dependency, 'dependency_type', dependency['type'], 'dependency'),
+                }
+            )
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise _schema_error("Malformed survey schema document.")
+    return sections_data
+
+
+@transaction.atomic
+def import_survey_schema(document: dict, user = None) -> Survey:
+    """
+    Create a new survey from a schema document
+    """
+    sections_data = build_survey_tree(document)
+    survey_data = document.get('survey') or {}
+    if not isinstance(survey_data, dict):
+        raise _schema_error("Malformed survey schema document.")
+    survey = Survey.objects.create(
+        title = _clean(Survey, 'title', survey_data.get('title'), 'survey'),
+        description = _clean(Survey, 'description', survey_data.get('description'), 'survey'),
+        created_by = user
+    )
+    builder = SurveyTreeBuilder(user = user)
+    builder.create_sections(survey, sections_data)
+    builder.finish()
+    return survey
@@ -0,0 +1,111 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class Selection:
+    """
+    The keys of a representation requested with ?fields= and the relations
+    requested with ?expand=, both comma separated dotted paths.
+
+    Without ?fields= every key is returned and without ?expand= every relation
+    is expanded. Relations that are returned but not expanded are given as ids,
+    `fields=sections.title` implies `sections` and `expand=sections.fields` implies `sections`.
+    """
+
+    def __init__(self, fields: set = None, expand: set = None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request) -> 'Selection':
+        def parse(name: str):
+            value = request.query_params.get(name)
+            if value is None:
+                return None
+            return {path.strip() for path in value.split(',') if path.strip()}
+        return cls(parse('fields'), parse('expand'))
+
+    @property
+    def is_full(self) -> bool:
+        return self.fields is None and self.expand is None
+
+    @staticmethod
+    def _names(paths: set) -> set:
+        return {path.split('.', 1)[0] for path in paths}
+
+    def includes(self, key: str) -> bool:
+        return self.fields is None or key in self._names(self.fields)
+
+    def expands(self, key: str) -> bool:
+        return self.includes(key) and (self.expand is None or key in self._names(self.expand))
+
+    def nested(self, key: str) -> 'Selection':
+        fields = None
+        if self.fields is not None and key not in self.fields:
+            fields = {path.split('.', 1)[1] for path in self.fields if path.startswith(f'{key}.')}
+        expand = None
+        if self.expand is not None:
+            expand = {path.split('.', 1)[1] for path in self.expand if path.startswith(f'{key}.')}
+        return Selection(fields, expand)
+
+    def prune(self, representation):
+        """
+        Drop the keys that are not selected from a representation, or a list of them
+        """
+        if self.fields is None and self.expand is None:
+            return representation
+        if isinstance(representation, list):
+            return [self.prune(item) for item in representation]
+        if not isinstance(representation, dict):
+            return representation
+        return {
+            key: self.nested(key).prune(value)
+            for key, value in representation.items()
+            if self.includes(key)
+        }
+
+
+FULL_SELECTION = Selection()
+
+
+def apply_selection(serializer, selection: Selection) -> None:
+    """
+    Drop the fields of a serializer that are not selected and turn the nested
+    serializers that are not expanded into primary keys
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    for key, field in list(serializer.fields.items()):
+        if not selection.includes(key):
+            serializer.fields.pop(key)
+            continue
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        if not isinstance(nested, serializers.BaseSerializer):
+            continue
+        if selection.expands(key):
+            apply_selection(nested, selection.nested(key))
+        else:
+            serializer.fields[key] = serializers.PrimaryKeyRelatedField(
+                many = many,
+                read_only = True,
+                source = None if field.source == key else field.source
+            )
+
+
+class SelectionMixin:
+    """
+    Apply the ?fields= and ?expand= selection of read requests to the serializer of a viewset
+    """
+
+    def get_selection(self) -> Selection:
+        if not hasattr(self, '_selection'):
+            self._selection = Selection.from_request(self.request) if self.request else FULL_SELECTION
+        return self._selection
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        selection = self.get_selection()
+        if self.request.method in SAFE_METHODS and not selection.is_full:
+            apply_selection(serializer, selection)
+        return serializer
@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from surveys_builder.models import (
+    Survey,
+    SurveyResponse
+)
+from surveys_builder.utils.answers import sync_response_answers
+from surveys_builder.utils.audit import record_audit_events
+from surveys_builder.utils.cache import bump_view_cache
+from surveys_builder.utils.constants import SURVEY_RESPONSES_CACHE_NAMESPACE
+from surveys_builder.utils.crypto import (
+    decrypt_response_data,
+    encrypt_response_data,
+    get_sensitive_field_ids
+)
+from surveys_builder.utils.helpers import get_response_shape_error
+from surveys_builder.utils.rollups import apply_rollup_changes
+from surveys_builder.utils.rules import get_survey_rule_plan
+
+
+def validate_submissions(items: list, default_user_id: int = None) -> tuple:
+    """
+    Validate a batch of submissions of the form {survey, user, response_data},
+    the user defaults to `default_user_id`. Return the accepted rows keyed by
+    (survey id, user id) with the index of their item, and the errors per item index
+    """
+    items = [item if isinstance(item, dict) else {} for item in items]
+    survey_ids = {item.get('survey') for item in items if isinstance(item.get('survey'), int)}
+    user_ids = {
+        item.get('user', default_user_id) for item in items if isinstance(item.get('user', default_user_id), int)
+    }
+    surveys = set(Survey.objects.filter(id__in = survey_ids).values_list('id', flat = True))
+    users = set(User.objects.filter(id__in = user_ids).values_list('id', flat = True))
+
+    accepted = {}
+    errors = {}
+    for index, item in enumerate(items):
+        survey_id = item.get('survey')
+        user_id = item.get('user', default_user_id)
+        response_data = item.get('response_data')
+        if not isinstance(survey_id, int) or not isinstance(user_id, int):
+            errors[index] = ["Survey and user must be provided."]
+            continue
+        if survey_id not in surveys:
+            errors[index] = [f"Survey {survey_id} does not exist."]
+            continue
+        if user_id not in users:
+            errors[index] = [f"User {user_id} does not exist."]
+            continue
+        shape_error = get_response_shape_error(response_data)
+        if shape_error:
+            errors[index] = [shape_error]
+            continue
+        rule_errors = get_survey_rule_plan(survey_id).validate(response_data)
+        if rule_errors:
+            errors[index] = rule_errors
+            continue
+        if (survey_id, user_id) in accepted:
+            errors[accepted[(survey_id, user_id)][0]] = ["Superseded by a later item for the same survey and user."]
+        accepted[(survey_id, user_id)] = (index, response_data)
+    return accepted, errors
+
+
+def upsert_survey_responses(rows: dict, submitted_by: dict = None) -> dict:
+    """
+    Encrypt and insert or update plain response documents keyed by (survey id, user id)
+    with one bulk upsert, then sync their answers, rollups, audit events and cached
+    views in batch. `submitted_by` maps the same keys to the acting user ids.
+    Return {(survey id, user id): (response id, created)}
+    """
+    submitted_by = submitted_by or {}
+    if not rows:
+        return {}
+    survey_ids = {survey_id for survey_id, _ in rows}
+    user_ids = {user_id for _, user_id in rows}
+    with transaction.atomic():
+        previous = {
+            (survey_id, user_id): response_data
+            for survey_id, user_id, response_data in SurveyResponse.objects.select_for_update().filter(
+                survey_id__in = survey_ids,
+                user_id__in = user_ids
+            ).values_list('survey_id', 'user_id', 'response_data')
+            if (survey_id, user_id) in rows
+        }
+        sensitive_field_ids = {survey_id: get_sensitive_field_ids(survey_id) for survey_id in survey_ids}
+        conflict_target = {}
+        if connection.features.supports_update_conflicts_with_target:
+            conflict_target['unique_fields'] = ['survey', 'user']
+        SurveyResponse.objects.bulk_create(
+            [
+                SurveyResponse(
+                    survey_id = survey_id,
+                    user_id = user_id,
+                    response_data = encrypt_response_data(response_data, sensitive_field_ids[survey_id]),
+                    created_by_id = submitted_by.get((survey_id, user_id)),
+                    updated_by_id = submitted_by.get((survey_id, user_id))
+                )
+                for (survey_id, user_id), response_data in rows.items()
+            ],
+            batch_size = settings.BULK_SUBMISSION_BATCH_SIZE,
+            update_conflicts = True,
+            update_fields = ['response_data', 'updated_at', 'updated_by'],
+            **conflict_target
+        )
+        response_ids = {
+            (survey_id, user_id): response_id
+            for response_id, survey_id, user_id in SurveyResponse.objects.filter(
+                survey_id__in = survey_ids,
+                user_id__in = user_ids
+            ).values_list('id', 'survey_id', 'user_id')
+            if (survey_id, user_id) in rows
+        }
+
+        for survey_id in survey_ids:
+            keys = [key for key in rows if key[0] == survey_id]
+            sync_response_answers(survey_id, [(response_ids[key], rows[key]) for key in keys])
+            apply_rollup_changes(
+                survey_id,
+                [
+                    (decrypt_response_data(previous[key]) if key in previous else None, rows[key])
+                    for key in keys
+                ]
+            )
+        record_audit_events(
+            [
+                {
+                    'user_id': submitted_by.get((survey_id, user_id)) or user_id,
+                    'survey_response_id': response_ids[(survey_id, user_id)],
+                    'survey_id': survey_id,
+                    'action': 'update' if (survey_id, user_id) in previous else 'create'
+                }
+                for survey_id, user_id in rows
+            ]
+        )
+        bump_view_cache(SURVEY_RESPONSES_CACHE_NAMESPACE, everything = True)
+    return {key: (response_ids[key], key not in previous) for key in rows}
+
+
+def save_submissions(items: list, submitted_by: list) -> list:
+    """
+    Validate and upsert a batch of submissions, each made by the user at the same
+    index of `submitted_by`, and return one result per item
+    """
+    accepted, errors = validate_submissions(items)
+    saved = upsert_survey_responses(
+        {key: response_data for key, (index, response_data) in accepted.items() if index not in errors},
+        {key: submitted_by[index] for key, (index, _) in accepted.items() if index not in errors}
+    )
+    results = [None] * len(items)
+    for index, item_errors in errors.items():
+        results[index] = {'index': index, 'status': 'error', 'errors': item_errors}
+    for key, (response_id, created) in saved.items():
+        index = accepted[key][0]
+        results[index] = {'index': index, 'status': 'created' if created else 'updated', 'id': response_id}
+    return results
+
+
+def submit_survey_responses(items: list, user) -> list:
+    """
+    Save a batch of submissions made by a user, the user of the items defaults to them
+    """
+    items = [{'user': user.id, **item} if isinstance(item, dict) else item for item in items]
+    return save_submissions(items, [user.id] * len(items))
@@ -0,0 +1,226 @@
+from django.http import Http404
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from surveys_builder.models import (
+    ConditionDependency,
+    Dependency,
+    Field,
+    Option,
+    Section,
+    Survey
+)
+from surveys_builder.renderers import ORJSONRenderer
+from surveys_builder.utils.etags import RevisionETagMixin
+from surveys_builder.utils.selection import (
+    FULL_SELECTION,
+    Selection,
+    SelectionMixin
+)
+
+# Plain dict trees with the keys, in the same order, of SurveySerializer, SectionSerializer and FieldSerializer.
+# Relations that are not selected are never queried, relations that are selected but not expanded are given as ids.
+
+
+def _group(rows: list, parent_column: str, build) -> dict:
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[parent_column], []).append(build(row))
+    return groups
+
+
+def _related(selection: Selection, key: str, queryset, parent_column: str, columns: list, build) -> dict:
+    """
+    Get the representations of a many relation grouped by parent, as ids when it is not expanded
+    """
+    if not selection.includes(key):
+        return {}
+    if not selection.expands(key):
+        return _group(queryset.values(parent_column, 'id'), parent_column, lambda row: row['id'])
+    return _group(queryset.values(parent_column, 'id', *columns), parent_column, build)
+
+
+def _build_fields(queryset, selection: Selection) -> list:
+    columns = ['id', 'field_type_id', 'order', 'label', 'required', 'is_sensitive', 'section_id']
+    expand_field_type = selection.expands('field_type')
+    if expand_field_type:
+        columns += ['field_type__name', 'field_type__widget']
+    rows = list(queryset.order_by('order', 'id').values(*columns))
+    field_ids = [row['id'] for row in rows]
+
+    options = _related(
+        selection, 'options',
+        Option.objects.filter(field_id__in = field_ids).order_by('order', 'id'),
+        'field_id', ['order', 'value'],
+        lambda row: {'id': row['id'], 'order': row['order'], 'value': row['value']}
+    )
+    expand_condition = selection.nested('conditional_logic').expands('condition')
+    condition_columns = ['condition__operator', 'condition__value'] if expand_condition else []
+    conditional_logic = _related(
+        selection, 'conditional_logic',
+        ConditionDependency.objects.filter(affected_field_id__in = field_ids).order_by('id'),
+        'affected_field_id',
+        ['condition_id', 'affected_section_id'] + condition_columns,
+        lambda row: {
+            'id': row['id'],
+            'condition': {
+                'id': row['condition_id'],
+                'operator': row['condition__operator'],
+                'value': row['condition__value'],
+            } if expand_condition else row['condition_id'],
+            'affected_field': row['affected_field_id'],
+            'affected_section': row['affected_section_id'],
+        }
+    )
+    dependencies = _related(
+        selection, 'dependencies',
+        Dependency.objects.filter(source_field_id__in = field_ids).order_by('id'),
+        'source_field_id', ['dependency_type', 'target_field_id'],
+        lambda row: {'id': row['id'], 'dependency_type': row['dependency_type'], 'target_field': row['target_field_id']}
+    )
+    return [
+        {
+            'id': row['id'],
+            'field_type': {
+                'id': row['field_type_id'],
+                'name': row['field_type__name'],
+                'widget': row['field_type__widget'],
+            } if expand_field_type else row['field_type_id'],
+            'options': options.get(row['id'], []),
+            'conditional_logic': conditional_logic.get(row['id'], []),
+            'dependencies': dependencies.get(row['id'], []),
+            'order': row['order'],
+            'label': row['label'],
+            'required': row['required'],
+            'is_sensitive': row['is_sensitive'],
+            'section': row['section_id'],
+        }
+        for row in rows
+    ]
+
+
+def _build_sections(queryset, selection: Selection) -> list:
+    rows = list(queryset.order_by('order', 'id').values('id', 'order', 'title', 'survey_id'))
+    section_ids = [row['id'] for row in rows]
+    fields = {}
+    if selection.expands('fields'):
+        for field in _build_fields(Field.objects.filter(section_id__in = section_ids), selection.nested('fields')):
+            fields.setdefault(field['section'], []).append(field)
+    elif selection.includes('fields'):
+        fields = _group(
+            Field.objects.filter(section_id__in = section_ids).order_by('order', 'id').values('section_id', 'id'),
+            'section_id',
+            lambda row: row['id']
+        )
+    return [
+        {
+            'id': row['id'],
+            'fields': fields.get(row['id'], []),
+            'order': row['order'],
+            'title': row['title'],
+            'survey': row['survey_id'],
+        }
+        for row in rows
+    ]
+
+
+def _in_order(trees: list, ids: list, selection: Selection) -> list:
+    by_id = {tree['id']: tree for tree in trees}
+    return [selection.prune(by_id[object_id]) for object_id in ids if object_id in by_id]
+
+
+def build_field_trees(field_ids: list, selection: Selection = FULL_SELECTION) -> list:
+    """
+    Build the representations of fields, in the given order, from .values() rows
+    """
+    return _in_order(_build_fields(Field.objects.filter(id__in = field_ids), selection), field_ids, selection)
+
+
+def build_section_trees(section_ids: list, selection: Selection = FULL_SELECTION) -> list:
+    """
+    Build the representations of sections, in the given order, from .values() rows
+    """
+    return _in_order(_build_sections(Section.objects.filter(id__in = section_ids), selection), section_ids, selection)
+
+
+def build_survey_trees(survey_ids: list, selection: Selection = FULL_SELECTION) -> list:
+    """
+    Build the representations of surveys, in the given order, from .values() rows
+    """
+    sections = {}
+    if selection.expands('sections'):
+        section_queryset = Section.objects.filter(survey_id__in = survey_ids)
+        for section in _build_sections(section_queryset, selection.nested('sections')):
+            sections.setdefault(section['survey'], []).append(section)
+    elif selection.includes('sections'):
+        sections = _group(
+            Section.objects.filter(survey_id__in = survey_ids).order_by('order', 'id').values('survey_id', 'id'),
+            'survey_id',
+            lambda row: row['id']
+        )
+    surveys = [
+        {
+            'id': row['id'],
+            'sections': sections.get(row['id'], []),
+            'title': row['title'],
+            'description': row['description'],
+        }
+        for row in Survey.objects.filter(id__in = survey_ids).values('id', 'title', 'description')
+    ]
+    return _in_order(surveys, survey_ids, selection)
+
+
+class TreeRendererMixin:
+    """
+    Render list and retrieve with orjson instead of JSONRenderer when they are served
+    from the dict trees, the trees hold no floats so the bytes are the same
+    """
+    read_path = 'values'
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.read_path != 'values' or getattr(self, 'action', None) not in ('list', 'retrieve'):
+            return renderers
+        return [ORJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+
+
+class TreeReadMixin(TreeRendererMixin, RevisionETagMixin, SelectionMixin):
+    """
+    Serve list and retrieve from the plain dict trees of `tree_builder` instead of
+    the serializer when `read_path` is 'values', with ETags from the revisions of
+    the surveys found through `survey_lookup`.
+
+    `tree_builder` takes a list of ids and a Selection and returns their representations in that order.
+    """
+    read_path = 'values'
+    tree_builder = None
+    survey_lookup = None
+
+    def list(self, request, *args, **kwargs):
+        if self.read_path != 'values':
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(
+            self.get_queryset().prefetch_related(None).values('id', 'created_at', self.survey_lookup)
+        )
+        page = self.paginate_queryset(queryset)
+        return self.conditional_response(
+            request,
+            [(row['id'], row[self.survey_lookup]) for row in page],
+            lambda: self.get_paginated_response(self.tree_builder([row['id'] for row in page], self.get_selection())),
+            last_modified = False
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.read_path != 'values':
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            object_id = int(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            raise Http404
+        survey_id = self.get_queryset().filter(pk = object_id).values_list(self.survey_lookup, flat = True).first()
+        if survey_id is None:
+            raise Http404
+        return self.conditional_response(
+            request,
+            [(object_id, survey_id)],
+            lambda: Response(self.tree_builder([object_id], self.get_selection())[0])
+        )
@@ -1,24 +1,33 @@
+from celery.result import AsyncResult
 from rest_framework import viewsets
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.decorators import (
     api_view,
     permission_classes,
     action
 )
+from surveys_builder.authentication import (
+    revoke_token,
+    revoke_user_tokens
+)
+from surveys_builder.pagination import IdCursorPagination
 from surveys_builder.permissions import (
     IsAdmin,
     IsAnalyst,
     IsDataViewer
 )
 from surveys_builder.models import (
-    Field,
     Survey,
-    Section,
     SurveyResponse,
     AuditLog
 )
@@ -29,14 +38,46 @@ from surveys_builder.serializers import (
     SurveyResponseSerializer,
     AuditLogSerializer
 )
+from surveys_builder.utils.cache import ScopedCacheMixin
+from surveys_builder.utils.constants import (
+    AUDIT_LOGS_CACHE_NAMESPACE,
+    SURVEY_RESPONSES_CACHE_NAMESPACE
+)
+from surveys_builder.utils.etags import RevisionETagMixin
+from surveys_builder.utils.exports import EXPORT_FORMATS
+from surveys_builder.utils.idempotency import idempotent
+from surveys_builder.utils.ingestion import (
+    enqueue_submission,
+    get_submission_errors,
+    get_submission_status
+)
+from surveys_builder.utils.representations import (
+    get_field_tree_queryset,
+    get_section_tree_queryset,
+    get_survey_representations
+)
+from surveys_builder.utils.rollups import get_survey_analytics
+from surveys_builder.utils.selection import SelectionMixin
+from surveys_builder.utils.submissions import submit_survey_responses
+from surveys_builder.utils.trees import (
+    TreeReadMixin,
+    TreeRendererMixin,
+    build_field_trees,
+    build_section_trees
+)
+from surveys_builder.utils.schema import (
+    export_survey_schema,
+    import_survey_schema
+)
 from surveys_builder.tasks import (
+    EXPORT_SHARDS_KEY,
     generate_report,
-    export_survey_responses,
+    start_sharded_export,
     send_survey_invitations
 )
 
 
-class BaseViewSet(viewsets.ModelViewSet):
+class BaseViewSet(SelectionMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     class Meta:
@@ -45,14 +86,14 @@ class BaseViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action in ['update', 'partial_update']:
             self.permission_classes = [IsAuthenticated, IsAdmin | IsAnalyst]
-        elif self.action == 'retrieve':
+        elif self.action in ['retrieve', 'schema', 'analytics']:
             self.permission_classes = [IsAuthenticated, IsAdmin | IsAnalyst | IsDataViewer]
         else:
             self.permission_classes = [IsAuthenticated, IsAdmin]
         return super().get_permissions()
 
 
-class SurveyViewSet(BaseViewSet):
+class SurveyViewSet(TreeRendererMixin, RevisionETagMixin, BaseViewSet):
     """
     A viewset for viewing and editing survey instances.
     """
@@ -61,6 +102,7 @@ class SurveyViewSet(BaseViewSet):
         'sections__fields__field_type'
     )
     serializer_class = SurveySerializer
+    read_path = 'values'
 
     def perform_create(self, serializer):
         serializer.save(created_by = self.request.user)
@@ -68,21 +110,66 @@ class SurveyViewSet(BaseViewSet):
     def perform_update(self, serializer):
         serializer.save(updated_by = self.request.user)
 
-    @method_decorator(cache_page(300, key_prefix = 'surveys_list'))
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.filter_queryset(Survey.objects.values('id', 'created_at')))
+        survey_ids = [survey['id'] for survey in page]
+        return self.conditional_response(
+            request,
+            [(survey_id, survey_id) for survey_id in survey_ids],
+            lambda: self.get_paginated_response(
+                get_survey_representations(survey_ids, self.read_path, self.get_selection())
+            ),
+            last_modified = False
+        )
 
-    @method_decorator(cache_page(300, key_prefix = 'surveys_detail'))
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        try:
+            survey_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        if not self.get_queryset().filter(pk = survey_id).exists():
+            raise Http404
+
+        def build():
+            representations = get_survey_representations([survey_id], self.read_path, self.get_selection())
+            if not representations:
+                raise Http404
+            return Response(representations[0])
+        return self.conditional_response(request, [(survey_id, survey_id)], build)
+
+    @action(detail = True, methods = ['get'])
+    def schema(self, request, pk = None):
+        survey = get_object_or_404(Survey.objects.only('id'), pk = pk)
+        self.check_object_permissions(request, survey)
+        return self.conditional_response(
+            request,
+            [(survey.id, survey.id)],
+            lambda: Response(export_survey_schema(Survey.objects.get(pk = survey.id)))
+        )
+
+    @action(detail = True, methods = ['get'])
+    def analytics(self, request, pk = None):
+        survey = get_object_or_404(Survey, pk = pk)
+        self.check_object_permissions(request, survey)
+        return Response(get_survey_analytics(survey.id))
+
+    @action(detail = False, methods = ['post'], url_path = 'schema/import')
+    def import_schema(self, request):
+        survey = import_survey_schema(request.data, request.user)
+        return Response(
+            {'id': survey.id},
+            status = status.HTTP_201_CREATED
+        )
 
 
-class SectionViewSet(BaseViewSet):
+class SectionViewSet(TreeReadMixin, BaseViewSet):
     """
     A viewset for viewing and editing section instances.
     """
-    queryset = Section.objects.all()
+    queryset = get_section_tree_queryset()
     serializer_class = SectionSerializer
+    tree_builder = staticmethod(build_section_trees)
+    survey_lookup = 'survey_id'
 
     def perform_create(self, serializer):
         serializer.save(created_by = self.request.user)
@@ -90,21 +177,15 @@ class SectionViewSet(BaseViewSet):
     def perform_update(self, serializer):
         serializer.save(updated_by = self.request.user)
 
-    @method_decorator(cache_page(300, key_prefix = 'sections_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-
-    @method_decorator(cache_page(300, key_prefix = 'sections_detail'))
-    def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
-
 
-class FieldViewSet(BaseViewSet):
+class FieldViewSet(TreeReadMixin, BaseViewSet):
     """
     A viewset for viewing and editing field instances.
     """
-    queryset = Field.objects.all()
+    queryset = get_field_tree_queryset()
     serializer_class = FieldSerializer
+    tree_builder = staticmethod(build_field_trees)
+    survey_lookup = 'section__survey_id'
 
     def perform_create(self, serializer):
         serializer.save(created_by = self.request.user)
@@ -112,21 +193,29 @@ class FieldViewSet(BaseViewSet):
     def perform_update(self, serializer):
         serializer.save(updated_by = self.request.user)
 
-    @method_decorator(cache_page(300, key_prefix = 'fields_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-
-    @method_decorator(cache_page(300, key_prefix = 'fields_detail'))
-    def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
 
-
-class SurveyResponseViewSet(BaseViewSet):
+class SurveyResponseViewSet(ScopedCacheMixin, BaseViewSet):
     """
     A viewset for viewing and editing survey response instances.
     """
     queryset = SurveyResponse.objects.all()
     serializer_class = SurveyResponseSerializer
+    cache_namespace = SURVEY_RESPONSES_CACHE_NAMESPACE
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        if settings.SUBMISSION_MODE != 'queued':
+            return super().create(request, *args, **kwargs)
+        item = {
+            'survey': request.data.get('survey'),
+            'user': request.data.get('user', request.user.id),
+            'response_data': request.data.get('response_data'),
+        }
+        errors = get_submission_errors(item)
+        if errors:
+            return Response({'errors': errors}, status = status.HTTP_400_BAD_REQUEST)
+        receipt = enqueue_submission(item, request.user.id)
+        return Response({'receipt': receipt, 'status': 'queued'}, status = status.HTTP_202_ACCEPTED)
 
     def perform_create(self, serializer):
         serializer.save(created_by = self.request.user)
@@ -134,30 +223,37 @@ class SurveyResponseViewSet(BaseViewSet):
     def perform_update(self, serializer):
         serializer.save(updated_by = self.request.user)
 
-    @method_decorator(cache_page(300, key_prefix = 'surveys_response_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+    @action(detail = False, methods = ['get'], url_path = r'receipts/(?P<receipt>[0-9a-f]+)')
+    def receipt(self, request, receipt = None):
+        submission = get_submission_status(receipt)
+        if submission is None or submission['submitted_by'] != request.user.id:
+            raise Http404
+        return Response({'receipt': receipt, **submission}, status = status.HTTP_200_OK)
 
-    @method_decorator(cache_page(300, key_prefix = 'surveys_response_detail'))
-    def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+    @action(detail = False, methods = ['post'])
+    @idempotent
+    def bulk(self, request):
+        items = request.data if isinstance(request.data, list) else request.data.get('responses')
+        if not isinstance(items, list) or not 0 < len(items) <= settings.BULK_SUBMISSION_MAX_ITEMS:
+            return Response(
+                {'error': f'Expected a list of 1 to {settings.BULK_SUBMISSION_MAX_ITEMS} responses.'},
+                status = status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'results': submit_survey_responses(items, request.user)},
+            status = status.HTTP_200_OK
+        )
 
 
-class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
+class AuditLogViewSet(ScopedCacheMixin, SelectionMixin, viewsets.ReadOnlyModelViewSet):
     """
     A viewset for viewing audit log instances.
     """
     queryset = AuditLog.objects.all()
     serializer_class = AuditLogSerializer
     permission_classes = [IsAuthenticated, IsAdmin | IsAnalyst]
-
-    @method_decorator(cache_page(300, key_prefix = 'audit_logs_list'))
-    def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
-
-    @method_decorator(cache_page(300, key_prefix = 'audit_logs_detail'))
-    def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+    pagination_class = IdCursorPagination
+    cache_namespace = AUDIT_LOGS_CACHE_NAMESPACE
 
 
 class GenerateReportView(APIView):
@@ -166,7 +262,13 @@ class GenerateReportView(APIView):
     @action(detail = False, methods = ['post'])
     def post(self, request):
         emails = request.data.get('emails', [])
-        generate_report.delay(emails)
+        generate_report.delay(
+            emails,
+            start = request.data.get('start'),
+            end = request.data.get('end'),
+            survey_id = request.data.get('survey_id'),
+            actions = request.data.get('actions')
+        )
         return Response(
             {'success': True},
             status = status.HTTP_202_ACCEPTED
@@ -180,11 +282,14 @@ class ExportSurveyResponsesView(APIView):
     @action(detail = False, methods = ['post'])
     def post(self, request):
         try:
-            survey_id = request.POST.get('survey_id')
+            survey_id = request.data.get('survey_id')
+            export_format = request.data.get('format', 'csv')
+            if export_format not in EXPORT_FORMATS:
+                raise ValueError(f"Unsupported export format {export_format}.")
             user_id = request.user.id
-            task = export_survey_responses.delay(survey_id, user_id)
+            task, shard_task_ids = start_sharded_export(survey_id, user_id, export_format)
             return Response(
-                {'success': True},
+                {'success': True, 'task_id': task.id, 'shard_task_ids': shard_task_ids},
                 status = status.HTTP_202_ACCEPTED
             )
         except Exception as e:
@@ -194,6 +299,33 @@ class ExportSurveyResponsesView(APIView):
             )
 
 
+class ExportSurveyResponsesStatusView(APIView):
+    permission_classes = [IsAuthenticated, IsAdmin, IsAnalyst]
+
+    def get(self, request, task_id):
+        task = AsyncResult(task_id)
+        shards = [
+            {
+                'task_id': shard_task_id,
+                'state': shard.state,
+                'progress': shard.info if isinstance(shard.info, dict) else None
+            }
+            for shard_task_id, shard in (
+                (shard_task_id, AsyncResult(shard_task_id))
+                for shard_task_id in cache.get(EXPORT_SHARDS_KEY.format(task_id = task_id), [])
+            )
+        ]
+        return Response(
+            {
+                'task_id': task_id,
+                'state': task.state,
+                'result': task.result if task.successful() else None,
+                'shards': shards
+            },
+            status = status.HTTP_200_OK
+        )
+
+
 class SendSurveyInvitationsView(APIView):
     permission_classes = [IsAuthenticated, IsAdmin, IsAnalyst]
 
@@ -213,3 +345,36 @@ class SendSurveyInvitationsView(APIView):
                 {'error': str(e)},
                 status = status.HTTP_400_BAD_REQUEST
             )
+
+
+class RevokeTokenView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Revoke the access token of the request and the given refresh token,
+        or every token of the user when `all` is set
+        """
+        if request.data.get('all'):
+            revoke_user_tokens(request.user.id)
+        else:
+            if request.auth is not None:
+                revoke_token(request.auth)
+            if request.data.get('refresh'):
+                try:
+                    refresh = RefreshToken(request.data['refresh'])
+                except TokenError as e:
+                    return Response(
+                        {'error': str(e)},
+                        status = status.HTTP_400_BAD_REQUEST
+                    )
+                if refresh[jwt_settings.USER_ID_CLAIM] != request.user.id:
+                    return Response(
+                        {'error': 'Token belongs to another user.'},
+                        status = status.HTTP_400_BAD_REQUEST
+                    )
+                revoke_token(refresh)
+        return Response(
+            {'success': True},
+            status = status.HTTP_200_OK
+        )